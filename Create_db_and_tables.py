@@ -1,14 +1,33 @@
+import argparse
 import sqlite3
 
 # Define database name here (e.g. "database.db")
 Database_Name = ""
 
+# Choose the schema layout here:
+#   "text"  - gene_id and run_id are stored as TEXT on every run_genes row
+#   "keyed" - genes and runs get integer surrogate keys and run_genes is a WITHOUT ROWID
+#             table clustered on (gene_key, run_key), several times smaller and range-seekable by gene;
+#             differential_expression rows refer to their gene by integer key too
+Schema_Layout = "text"
 
-# Connect to a new database or create it if it doesn't exist
-conn = sqlite3.connect(Database_Name)
+# Choose how the run_genes_count_tpm loader stores expression values here:
+#   "long"   - one run_genes row per (run, gene) value
+#   "packed" - one run_vectors row per run holding float32 counts and TPM vectors as BLOBs,
+#              aligned to the per-study gene order in study_genes; much faster for whole-study matrices
+#   "sparse" - like "long", but rows whose count and TPM are both zero are not stored; the genes and
+#              runs of each study are kept in study_genes and study_runs, so readers fill the zeros back in
+Expression_Storage = "long"
+
+# Choose how run_genes stores count_value and tpm_value here:
+#   "real"    - both as FLOAT, so every non-integer TPM value takes an 8-byte REAL
+#   "compact" - count_value as INTEGER and tpm_value as an INTEGER holding round(TPM * Tpm_Scale),
+#               a 1 to 4 byte varint for most values; the loaders encode and the read helpers decode
+Value_Encoding = "real"
+
+# Fixed-point scale of compact TPM values: 1000 keeps TPM to 0.001
+Tpm_Scale = 1000
 
-# Create a cursor object to execute SQL commands
-cursor = conn.cursor()
 
 # List of table creation commands
 table_commands = [
@@ -61,30 +80,306 @@ table_commands = [
         FOREIGN KEY (gene_id) REFERENCES genes (gene_id)
     )
     ''',
+    # DE rows refer to their contrast by contrast_key, so a contrast's study and conditions are stored once
     '''
     CREATE TABLE differential_expression (
+        contrast_key INTEGER NOT NULL,
         gene_id TEXT,
-        log2FoldChange FLOAT, 
-        adj_p_value FLOAT,  
-        condition_1 INTEGER,  
-        condition_2 INTEGER, 
+        log2FoldChange FLOAT,
+        adj_p_value FLOAT,
+        FOREIGN KEY (contrast_key) REFERENCES contrasts (contrast_key),
+        FOREIGN KEY (gene_id) REFERENCES genes (gene_id)
+    )
+    ''',
+    # The runs metadata as one row per run and key, so runs can be found by a metadata value with an index seek
+    '''
+    CREATE TABLE run_metadata (
+        run_id TEXT NOT NULL,
+        key TEXT NOT NULL,
+        value,
+        PRIMARY KEY (run_id, key),
+        FOREIGN KEY (run_id) REFERENCES runs (run_id)
+    ) WITHOUT ROWID
+    ''',
+    # TPM summary per study, gene and condition, recomputed whenever a study's expression data is loaded
+    '''
+    CREATE TABLE gene_condition_stats (
+        study_id TEXT NOT NULL,
+        gene_id TEXT NOT NULL,
+        condition TEXT NOT NULL,
+        n_runs INTEGER,
+        mean_tpm FLOAT,
+        median_tpm FLOAT,
+        sd_tpm FLOAT,
+        min_tpm FLOAT,
+        max_tpm FLOAT,
+        fraction_expressed FLOAT,
+        PRIMARY KEY (study_id, gene_id, condition),
+        FOREIGN KEY (study_id) REFERENCES studies (study_id),
+        FOREIGN KEY (gene_id) REFERENCES genes (gene_id)
+    ) WITHOUT ROWID
+    ''',
+    # One row per DE contrast of a study, so DE rows can refer to a contrast by an integer key
+    '''
+    CREATE TABLE contrasts (
+        contrast_key INTEGER PRIMARY KEY,
+        study_id TEXT NOT NULL,
+        condition_1 TEXT NOT NULL,
+        condition_2 TEXT NOT NULL,
+        UNIQUE (study_id, condition_1, condition_2),
+        FOREIGN KEY (study_id) REFERENCES studies (study_id)
+    )
+    ''',
+    # Exposes differential_expression with the study and conditions of each row
+    '''
+    CREATE VIEW differential_expression_by_id AS
+    SELECT de.gene_id, de.log2FoldChange, de.adj_p_value, c.condition_1, c.condition_2, c.study_id
+    FROM differential_expression de
+    JOIN contrasts c ON c.contrast_key = de.contrast_key
+    '''
+]
+
+def run_genes_view_command(tpm_scale=None):
+    """
+    Build the run_genes_by_id view of the "keyed" layout, which exposes run_genes with text IDs.
+
+    Args:
+        tpm_scale (int, optional): The scale of compact TPM values, which the view decodes back
+            to their real value. None for real values.
+
+    Returns:
+        str: The CREATE VIEW command.
+    """
+    tpm_value = 'rg.tpm_value' if tpm_scale is None else f'rg.tpm_value / {float(tpm_scale)}'
+    return f'''
+    CREATE VIEW run_genes_by_id AS
+    SELECT r.run_id, g.gene_id, rg.count_value, {tpm_value} AS tpm_value
+    FROM run_genes rg
+    JOIN genes g ON g.gene_key = rg.gene_key
+    JOIN runs r ON r.run_key = rg.run_key
+    '''
+
+# Table creation commands for the "keyed" layout. Only genes, runs, run_genes, differential_expression and run_metadata differ from table_commands.
+keyed_table_commands = [
+    table_commands[0],  # species
+    table_commands[1],  # studies
+    '''
+    CREATE TABLE genes (
+        gene_key INTEGER PRIMARY KEY,
+        gene_id TEXT UNIQUE NOT NULL,
+        species_id TEXT,
+        FOREIGN KEY (species_id) REFERENCES species (species_id)
+    )
+    ''',
+    '''
+    CREATE TABLE runs (
+        run_key INTEGER PRIMARY KEY,
+        run_id TEXT UNIQUE NOT NULL,
+        condition TEXT,
         study_id TEXT,
-        FOREIGN KEY (gene_id) REFERENCES genes (gene_id),
-        FOREIGN KEY (condition_1) REFERENCES runs (condition),
-        FOREIGN KEY (condition_2) REFERENCES runs (condition),
+        metadata TEXT,
         FOREIGN KEY (study_id) REFERENCES studies (study_id)
     )
+    ''',
+    table_commands[4],  # study_species
+    '''
+    CREATE TABLE run_genes (
+        gene_key INTEGER NOT NULL,
+        run_key INTEGER NOT NULL,
+        count_value FLOAT,
+        tpm_value FLOAT,
+        PRIMARY KEY (gene_key, run_key),
+        FOREIGN KEY (gene_key) REFERENCES genes (gene_key),
+        FOREIGN KEY (run_key) REFERENCES runs (run_key)
+    ) WITHOUT ROWID
+    ''',
+    table_commands[9],  # contrasts
+    '''
+    CREATE TABLE differential_expression (
+        contrast_key INTEGER NOT NULL,
+        gene_key INTEGER NOT NULL,
+        log2FoldChange FLOAT,
+        adj_p_value FLOAT,
+        PRIMARY KEY (contrast_key, gene_key),
+        FOREIGN KEY (contrast_key) REFERENCES contrasts (contrast_key),
+        FOREIGN KEY (gene_key) REFERENCES genes (gene_key)
+    ) WITHOUT ROWID
+    ''',
+    '''
+    CREATE TABLE run_metadata (
+        run_key INTEGER NOT NULL,
+        key TEXT NOT NULL,
+        value,
+        PRIMARY KEY (run_key, key),
+        FOREIGN KEY (run_key) REFERENCES runs (run_key)
+    ) WITHOUT ROWID
+    ''',
+    table_commands[8],  # gene_condition_stats
+    # Exposes run_genes with text IDs, so queries written for the "text" layout keep working
+    run_genes_view_command(),
+    # Exposes differential_expression with the columns of the "text" layout
+    '''
+    CREATE VIEW differential_expression_by_id AS
+    SELECT g.gene_id, de.log2FoldChange, de.adj_p_value, c.condition_1, c.condition_2, c.study_id
+    FROM differential_expression de
+    JOIN contrasts c ON c.contrast_key = de.contrast_key
+    JOIN genes g ON g.gene_key = de.gene_key
+    '''
+]
+
+# Extra tables for the "packed" expression storage
+packed_table_commands = [
+    '''
+    CREATE TABLE study_genes (
+        study_id TEXT NOT NULL,
+        gene_position INTEGER NOT NULL,
+        gene_id TEXT NOT NULL,
+        PRIMARY KEY (study_id, gene_position),
+        FOREIGN KEY (study_id) REFERENCES studies (study_id),
+        FOREIGN KEY (gene_id) REFERENCES genes (gene_id)
+    ) WITHOUT ROWID
+    ''',
+    '''
+    CREATE TABLE run_vectors (
+        run_id TEXT PRIMARY KEY,
+        study_id TEXT NOT NULL,
+        run_position INTEGER NOT NULL,
+        count_vector BLOB,
+        tpm_vector BLOB,
+        FOREIGN KEY (run_id) REFERENCES runs (run_id),
+        FOREIGN KEY (study_id) REFERENCES studies (study_id)
+    )
+    ''',
+    '''
+    CREATE INDEX idx_run_vectors_study ON run_vectors (study_id, run_position)
+    '''
+]
+
+# Extra tables for the "sparse" expression storage: the genes and runs of each study's expression files,
+# so the zero values left out of run_genes are known
+sparse_table_commands = [
+    packed_table_commands[0],  # study_genes
+    '''
+    CREATE TABLE study_runs (
+        study_id TEXT NOT NULL,
+        run_id TEXT NOT NULL,
+        PRIMARY KEY (study_id, run_id),
+        FOREIGN KEY (study_id) REFERENCES studies (study_id),
+        FOREIGN KEY (run_id) REFERENCES runs (run_id)
+    ) WITHOUT ROWID
     '''
 ]
 
-print("Creating database tables...")
+# Records how the database was created, so the loaders know which layout to write
+schema_info_command = '''
+    CREATE TABLE schema_info (
+        key TEXT PRIMARY KEY,
+        value TEXT
+    )
+    '''
+
+
+def check_compact_schema(conn, layout, tpm_scale):
+    """
+    Check that a new "compact" database stores integers and that its keyed view decodes TPM.
+
+    The schema is read back from the database, so a command that did not come out as intended
+    fails here instead of storing or returning undecoded values without an error.
+
+    Args:
+        conn (Connection): The SQLite connection.
+        layout (str): "text" or "keyed".
+        tpm_scale (int): The fixed-point scale of compact TPM values.
+
+    Raises:
+        RuntimeError: If run_genes or the run_genes_by_id view are not as the "compact" encoding needs.
+    """
+    column_types = {name: column_type for _, name, column_type, *_ in conn.execute("PRAGMA table_info(run_genes)")}
+    if column_types.get('count_value') != 'INTEGER' or column_types.get('tpm_value') != 'INTEGER':
+        raise RuntimeError(f"run_genes values are not stored as INTEGER: {column_types}")
+
+    if layout == "keyed":
+        view = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'view' AND name = 'run_genes_by_id'").fetchone()
+        if view is None or f"rg.tpm_value / {float(tpm_scale)} AS tpm_value" not in view[0]:
+            raise RuntimeError("The run_genes_by_id view does not decode compact TPM values")
+
+def create_database(database_name, layout="text", expression_storage="long", value_encoding="real", tpm_scale=Tpm_Scale):
+    """
+    Create a database and the tables for the chosen layout.
+
+    Args:
+        database_name (str): The path of the database to create.
+        layout (str): "text" or "keyed", see Schema_Layout.
+        expression_storage (str): "long", "packed" or "sparse", see Expression_Storage.
+        value_encoding (str): "real" or "compact", see Value_Encoding.
+        tpm_scale (int): The fixed-point scale of compact TPM values, see Tpm_Scale.
+
+    Returns:
+        None
+    """
+    if layout == "text":
+        commands = table_commands
+    elif layout == "keyed":
+        commands = keyed_table_commands
+    else:
+        raise ValueError(f"Unknown schema layout: {layout}")
 
-# Execute each table creation command
-for command in table_commands:
-    cursor.execute(command)
+    if expression_storage == "packed":
+        commands = commands + packed_table_commands
+    elif expression_storage == "sparse":
+        commands = commands + sparse_table_commands
+    elif expression_storage != "long":
+        raise ValueError(f"Unknown expression storage: {expression_storage}")
+
+    if value_encoding == "compact":
+        # Only the run_genes value columns change; the keyed view is built again to decode TPM back to its real value
+        commands = [
+            run_genes_view_command(tpm_scale) if command == run_genes_view_command()
+            else command.replace("count_value FLOAT", "count_value INTEGER").replace("tpm_value FLOAT", "tpm_value INTEGER")
+            for command in commands
+        ]
+    elif value_encoding != "real":
+        raise ValueError(f"Unknown value encoding: {value_encoding}")
+
+    # Connect to a new database or create it if it doesn't exist
+    conn = sqlite3.connect(database_name)
+
+    # Create a cursor object to execute SQL commands
+    cursor = conn.cursor()
+
+    print("Creating database tables...")
+
+    # Execute each table creation command
+    for command in commands + [schema_info_command]:
+        cursor.execute(command)
+        conn.commit()
+
+    if value_encoding == "compact":
+        check_compact_schema(conn, layout, tpm_scale)
+
+    cursor.executemany("INSERT INTO schema_info (key, value) VALUES (?, ?)", [
+        ('layout', layout),
+        ('expression_storage', expression_storage),
+        ('value_encoding', value_encoding),
+        ('tpm_scale', str(tpm_scale)),
+    ])
+
+    # Commit the changes and close the connection
     conn.commit()
+    conn.close()
+
+    print(database_name + " created successfully.")
+
 
-# Commit the changes and close the connection
-conn.close()
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create the WBPS database and its tables.")
+    parser.add_argument("--database-name", default=Database_Name, help="Path of the database to create.")
+    parser.add_argument("--layout", choices=["text", "keyed"], default=Schema_Layout, help="Schema layout, see Schema_Layout.")
+    parser.add_argument("--expression-storage", choices=["long", "packed", "sparse"], default=Expression_Storage,
+                        help="How expression values are stored, see Expression_Storage.")
+    parser.add_argument("--value-encoding", choices=["real", "compact"], default=Value_Encoding,
+                        help="How run_genes stores counts and TPM, see Value_Encoding.")
+    parser.add_argument("--tpm-scale", type=int, default=Tpm_Scale, help="Fixed-point scale of compact TPM values, see Tpm_Scale.")
+    args = parser.parse_args()
 
-print(Database_Name + " created successfully.")
+    create_database(args.database_name, args.layout, args.expression_storage, args.value_encoding, args.tpm_scale)
@@ -1,86 +1,541 @@
+import argparse
 import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 
 from loaders import Species_loader  # Import the loader for species data
-from loaders import Studies_loader  # Import the loader for studies data
 from loaders import Genes_loader  # Import the loader for genes data
-from loaders import Runs_loader  # Import the loader for runs data
-from loaders import Studies_species_loader  # Import the loader for studies_species data
+from loaders import Studies_json_loader  # Import the combined loader for studies, runs and studies_species data
 from loaders import Run_genes_count_tpm_loader  # Import the loader for run_genes_count_tpm data
+from loaders import Gene_condition_stats  # Import the per-gene, per-condition TPM summary
 from loaders import Metadata_loader  # Import the loader for metadata data
 from loaders import Differential_Expression_loader  # Import the loader for differential_expression data
+from loaders import Finalize_database  # Import the post-load index and ANALYZE stage
+from loaders import Bulk_session  # Import the shared, tuned connection used by every loader
+from loaders import Load_manifest  # Import the record of loaded source files used to skip unchanged data
+from loaders import Tsv_reader  # Import the shared TSV reader, to choose its parser engine
+from loaders import Directory_catalog  # Import the one-time scan of a species folder used by every loader
+from loaders import Load_report  # Import the per-stage timing, row and memory measurements
+from loaders import Ingest_pipeline  # Import the background parsing that runs ahead of the writer
+from loaders import Schema_info  # Import the schema settings, to count loads for query result caches
 
 # Set the file_path and db_path, consider using r'' for Windows paths
 file_path = ""  # Set the path to the chosen directory
 db_path = ""  # Set the path to the database
+species_index = 4  # CHOOSE FOLDER INDEX HERE (ignored with --all-species)
 
+# The expensive, file-heavy parsing steps that can run in a worker process.
+# Each entry maps a stage name to a function taking species_path and returning data for the writer.
+PARSE_STAGES = [
+    ("genes", Genes_loader.read_gene_ids),
+    ("run_genes_count_tpm", Run_genes_count_tpm_loader.load_folders_in_directory),
+    ("metadata", Metadata_loader.load_folders_in_directory),
+    ("differential_expression", Differential_Expression_loader.load_folders_in_directory),
+]
 
-# Get the path to the chosen in the file_path directory
-for root, dirs, files in os.walk(file_path):
-    if dirs:  # Check if there are directories in the current root
-        species_folder = dirs[4]  # CHOOSE FOLDER INDEX HERE
-        species_path = os.path.join(root, species_folder)
-        break  # Exit the loop after finding the first directory
-else:
-    species_path = None  # No directories found
-
-print("Populating database with data from:", species_path)
-print("Populating database at:", db_path)
-
-# Load data into the database
-try:
-    print("     Loading species data...")
-    Species_loader.load_species_data(species_path, db_path) # Load species data into the database
-    print("         Species data loaded successfully.")
-except Exception as e:
-    print("         Error loading species data:", str(e))
-
-try:
-    print("     Loading studies data...")
-    Studies_loader.load_studies(species_path, db_path) # Load studies data into the database
-    print("         Studies data loaded successfully.")
-except Exception as e:
-    print("         Error loading studies data:", str(e))
-
-try:
-    print("     Loading genes data...")
-    Genes_loader.load_genes(species_path, db_path) # Load genes data into the database
-    print("         Genes data loaded successfully.")
-except Exception as e:
-    print("         Error loading genes data:", str(e))
-
-try:
-    print("     Loading runs data...")
-    Runs_loader.load_runs(species_path, db_path) # Load runs data into the database
-    print("         Runs data loaded successfully.")
-except Exception as e:
-    print("         Error loading runs data:", str(e))
-
-try:
-    print("     Loading studies_species data...")
-    Studies_species_loader.load_studies_species(species_path, db_path) # Load studies_species data into the database
-    print("         Studies_species data loaded successfully.")
-except Exception as e:
-    print("         Error loading studies_species data:", str(e))
-
-try:
-    print("     Processing run_genes_count_tpm data...")
-    Run_genes_count_tpm_loader.process_folders_in_directory(species_path, db_path) # Process folders in the species_path directory to load run_genes_count_tpm data into the database
-    print("         Run_genes_count_tpm data processed successfully.")
-except Exception as e:
-    print("         Error processing run_genes_count_tpm data:", str(e))
-
-try:
-    print("     Processing metadata data...")
-    Metadata_loader.process_folders_in_directory(species_path, db_path) # Process folders in the species_path directory to load metadata data into the database
-    print("         Metadata data processed successfully.")
-except Exception as e:
-    print("         Error processing metadata data:", str(e))
-
-try:
-    print("     Loading differential_expression data...")
-    Differential_Expression_loader.process_folders_in_directory(species_path, db_path) # Process folders in the species_path directory to load differential_expression data into the database
-    print("         Differential_expression data loaded successfully.")
-except Exception as e:
-    print("         Error loading differential_expression data:", str(e))
-
-print("Data loading and processing complete for " + species_path)
+# The per-study loaders, by stage name. Each records its subdirectories in the load_manifest table.
+FOLDER_LOADERS = {
+    "run_genes_count_tpm": Run_genes_count_tpm_loader,
+    "metadata": Metadata_loader,
+    "differential_expression": Differential_Expression_loader,
+}
+
+# Name under which the species-wide loaders record the studies.json file in the load_manifest table
+STUDIES_JSON_LOADER = "studies_json"
+
+
+def find_species_folder(file_path, index):
+    """
+    Find the species folder at the given index in the file_path directory.
+
+    Args:
+        file_path (str): The directory containing the species folders.
+        index (int): The index of the species folder to choose.
+
+    Returns:
+        str: The path to the chosen species folder, or None if there are no folders.
+    """
+    # Get the path to the chosen in the file_path directory
+    for root, dirs, files in os.walk(file_path):
+        if dirs:  # Check if there are directories in the current root
+            return os.path.join(root, dirs[index])
+        break  # Only the top level of file_path holds species folders
+
+    return None  # No directories found
+
+
+def find_species_folders(file_path):
+    """
+    Find every species folder in the file_path directory.
+
+    Args:
+        file_path (str): The directory containing the species folders.
+
+    Returns:
+        List[str]: The paths to the species folders, sorted by folder name.
+    """
+    with os.scandir(file_path) as entries:
+        return sorted(entry.path for entry in entries if entry.is_dir() and not entry.name.startswith('.'))
+
+
+def find_current_units(species_path, db_path, catalog):
+    """
+    Find the parts of a species folder that are unchanged since they were last fully loaded.
+
+    Args:
+        species_path (str): The path to the species folder.
+        db_path (str): The path to the database.
+        catalog (dict): The output of Directory_catalog.scan_species for species_path.
+
+    Returns:
+        Tuple[Set[str], dict]: The species-wide stages that are current, and for each
+            per-study stage the names of the current subdirectories.
+    """
+    name_id = os.path.basename(species_path)
+    current_stages = set()
+    if Load_manifest.check(db_path, Genes_loader.LOADER_NAME, name_id, Genes_loader.source_files(species_path, catalog)) == Load_manifest.CURRENT:
+        current_stages.add("genes")
+
+    current_folders = {stage: find_current_studies(db_path, loader, catalog) for stage, loader in FOLDER_LOADERS.items()}
+
+    return current_stages, current_folders
+
+def find_current_studies(db_path, loader, catalog):
+    """
+    Find the study folders of a per-study loader that are unchanged since they were last fully loaded.
+
+    Args:
+        db_path (str): The path to the database.
+        loader (module): The loader, one of FOLDER_LOADERS.
+        catalog (dict): The output of Directory_catalog.scan_species for the species folder.
+
+    Returns:
+        Set[str]: The names of the current subdirectories.
+    """
+    return {
+        name for name, study in catalog['studies'].items()
+        if Load_manifest.check(db_path, loader.LOADER_NAME, name, loader.source_files(study['path'], study['files'])) == Load_manifest.CURRENT
+    }
+
+
+def parse_species(species_path, skip_stages=(), skip_folders=None, catalog=None):
+    """
+    Run the parsing half of every PARSE_STAGES loader for one species folder.
+
+    Runs in a worker process and never touches the database, so any number of species
+    can be parsed at once. An error raised by a stage is returned in place of its data,
+    so the writer can report it at the same point a sequential load would.
+
+    Args:
+        species_path (str): The path to the species folder.
+        skip_stages (Iterable[str]): Stages the writer reads itself, e.g. run_genes data
+            when it is streamed or stored as packed vectors, or that are already loaded.
+        skip_folders (dict, optional): For each per-study stage, subdirectories that are already loaded.
+        catalog (dict, optional): The output of Directory_catalog.scan_species for species_path. Scanned when omitted.
+
+    Returns:
+        Tuple[dict, List[dict]]: The parsed data (or the exception raised) for each stage, keyed
+            by stage name, and the Load_report metrics of each parse.
+    """
+    catalog = catalog or Directory_catalog.scan_species(species_path)
+    report = Load_report.new_report(species=os.path.basename(species_path))
+    parsed = {}
+    for stage, parse in PARSE_STAGES:
+        if stage in skip_stages:
+            continue
+        try:
+            with Load_report.measure(report, stage, phase='parse'):
+                if stage in FOLDER_LOADERS:
+                    parsed[stage] = parse(species_path, (skip_folders or {}).get(stage, ()), catalog)
+                else:
+                    parsed[stage] = parse(species_path, catalog)
+        except Exception as e:
+            parsed[stage] = e
+
+    return parsed, report['stages']
+
+
+def parsed_stage(parsed, stage):
+    """
+    Return the pre-parsed data for a stage, re-raising the error if parsing failed.
+
+    Args:
+        parsed (dict): The parsed data returned by parse_species, or None for a sequential load.
+        stage (str): The stage name.
+
+    Returns:
+        The parsed data, or None if parsed is None or has no data for the stage.
+    """
+    if parsed is None or stage not in parsed:
+        return None
+    if isinstance(parsed[stage], Exception):
+        raise parsed[stage]
+    return parsed[stage]
+
+
+def populate_species(species_path, db_path, parsed=None, chunk_size=None, catalog=None, parse_stages=()):
+    """
+    Load every table for one species folder into the database.
+
+    Each stage is measured with Load_report; an error in one stage is printed and
+    recorded in the report, and the remaining stages still run.
+
+    Args:
+        species_path (str): The path to the species folder.
+        db_path (str): The path to the database.
+        parsed (dict, optional): The parsed data returned by parse_species for species_path. When given,
+            the parsed data is written instead of reading the large files again.
+        chunk_size (int, optional): Stream run_genes data in batches of at most this many values.
+        catalog (dict, optional): The output of Directory_catalog.scan_species for species_path. Scanned when omitted.
+        parse_stages (List[dict]): The metrics returned by parse_species, added to the report.
+
+    Returns:
+        dict: The Load_report report of the species, with the metrics of every stage.
+    """
+    print("Populating database with data from:", species_path)
+    print("Populating database at:", db_path)
+
+    name_id = os.path.basename(species_path)
+    report = Load_report.new_report(species=name_id, species_path=species_path)
+    Load_report.add_stages(report, parse_stages)
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+
+    # The species, studies, runs and studies_species tables all come from the studies.json file.
+    # They are skipped when it is unchanged and replaced when it changed since the last load.
+    # Scan the species folder once; every loader takes its files from the catalog
+    catalog = catalog or Directory_catalog.scan_species(species_path)
+    studies_json = [catalog['studies_json']] if catalog['studies_json'] else []
+
+    json_state = Load_manifest.begin(db_path, STUDIES_JSON_LOADER, name_id, studies_json)
+    json_current = json_state == Load_manifest.CURRENT
+    replace = json_state == Load_manifest.CHANGED
+    if json_current:
+        print("     Skipping species, studies, runs and studies_species data (studies.json unchanged since the last load)")
+        Load_report.skip(report, "species", "studies.json unchanged since the last load")
+        Load_report.skip(report, "studies_json", "studies.json unchanged since the last load")
+
+    # Load data into the database
+    if not json_current:
+        try:
+            with Load_report.measure(report, "species"):
+                print("     Loading species data...")
+                Species_loader.load_species_data(species_path, db_path, replace) # Load species data into the database
+                print("         Species data loaded successfully.")
+        except Exception as e:
+            print("         Error loading species data:", str(e))
+
+        try:
+            with Load_report.measure(report, "studies_json"):
+                print("     Loading studies, runs and studies_species data...")
+                Studies_json_loader.load_studies_json(species_path, db_path, replace, catalog) # Load the studies.json file into the database in one transaction
+                print("         Studies, runs and studies_species data loaded successfully.")
+                Load_manifest.complete(db_path, STUDIES_JSON_LOADER, name_id)
+        except Exception as e:
+            print("         Error loading studies, runs and studies_species data:", str(e))
+
+    try:
+        with Load_report.measure(report, "genes"):
+            print("     Loading genes data...")
+            Genes_loader.load_genes(species_path, db_path, parsed_stage(parsed, "genes"), catalog) # Load genes data into the database
+            print("         Genes data loaded successfully.")
+    except Exception as e:
+        print("         Error loading genes data:", str(e))
+
+    # The studies the run_genes stage skips, whose stats are not rewritten with their expression data
+    unchanged_studies = find_current_studies(db_path, Run_genes_count_tpm_loader, catalog) if replace else set()
+
+    try:
+        with Load_report.measure(report, "run_genes_count_tpm"):
+            print("     Processing run_genes_count_tpm data...")
+            Run_genes_count_tpm_loader.process_folders_in_directory(species_path, db_path, parsed_stage(parsed, "run_genes_count_tpm"), chunk_size, catalog) # Process folders in the species_path directory to load run_genes_count_tpm data into the database
+            print("         Run_genes_count_tpm data processed successfully.")
+    except Exception as e:
+        print("         Error processing run_genes_count_tpm data:", str(e))
+
+    # The run conditions come from studies.json, so a changed file can change the
+    # stats of studies whose expression files were unchanged and not reloaded.
+    # The studies reloaded above already got their stats in the same transaction as their data;
+    # a study whose load failed keeps its previous data and is refreshed with the others.
+    if replace:
+        try:
+            with Load_report.measure(report, "gene_condition_stats"):
+                print("     Refreshing gene_condition_stats data...")
+                reloaded_studies = find_current_studies(db_path, Run_genes_count_tpm_loader, catalog) - unchanged_studies
+                Gene_condition_stats.refresh_studies(db_path, [name for name in catalog['studies'] if name not in reloaded_studies], chunk_size)
+                print("         Gene_condition_stats data refreshed successfully.")
+        except Exception as e:
+            print("         Error refreshing gene_condition_stats data:", str(e))
+
+    try:
+        with Load_report.measure(report, "metadata"):
+            print("     Processing metadata data...")
+            Metadata_loader.process_folders_in_directory(species_path, db_path, parsed_stage(parsed, "metadata"), catalog) # Process folders in the species_path directory to load metadata data into the database
+            print("         Metadata data processed successfully.")
+    except Exception as e:
+        print("         Error processing metadata data:", str(e))
+
+    try:
+        with Load_report.measure(report, "differential_expression"):
+            print("     Loading differential_expression data...")
+            Differential_Expression_loader.process_folders_in_directory(species_path, db_path, parsed_stage(parsed, "differential_expression"), catalog) # Process folders in the species_path directory to load differential_expression data into the database
+            print("         Differential_expression data loaded successfully.")
+    except Exception as e:
+        print("         Error loading differential_expression data:", str(e))
+
+    print("Data loading and processing complete for " + species_path)
+    return Load_report.finish(report, wall_start, cpu_start)
+
+
+def populate_all_species(file_path, db_path, jobs=1, chunk_size=None):
+    """
+    Load every species folder in file_path, parsing species in parallel.
+
+    Worker processes run parse_species while this process is the only writer,
+    since SQLite allows a single writer at a time. Species are written in the
+    same sorted order as a sequential load, so the resulting database is identical.
+    At most jobs species are parsed ahead of the writer to keep memory bounded.
+
+    Args:
+        file_path (str): The directory containing the species folders.
+        db_path (str): The path to the database.
+        jobs (int): The number of worker processes used for parsing.
+        chunk_size (int, optional): Stream run_genes data in batches of at most this many values.
+
+    Returns:
+        List[dict]: The Load_report report of each species, in load order.
+    """
+    species_paths = find_species_folders(file_path)
+    print(f"Found {len(species_paths)} species folders in {file_path}")
+
+    if jobs <= 1:
+        return [populate_species(species_path, db_path, chunk_size=chunk_size) for species_path in species_paths]
+
+    # Streamed or packed run_genes data is read by the writer, so the workers skip it
+    writer_stages = set()
+    if chunk_size or Run_genes_count_tpm_loader.get_expression_storage(db_path) == 'packed':
+        writer_stages.add("run_genes_count_tpm")
+
+    # Workers parse with the same TSV engine as this process
+    reports = []
+    with ProcessPoolExecutor(max_workers=jobs, initializer=Tsv_reader.set_engine, initargs=(Tsv_reader.ENGINE,)) as executor:
+        pending = deque()
+        for species_path in species_paths:
+            # The species folder is scanned once here and the catalog shared with the worker.
+            # Data already loaded from unchanged files is not parsed again.
+            catalog = Directory_catalog.scan_species(species_path)
+            current_stages, current_folders = find_current_units(species_path, db_path, catalog)
+            future = executor.submit(parse_species, species_path, writer_stages | current_stages, current_folders, catalog)
+            pending.append((species_path, catalog, future))
+            # Write the oldest species once the pool is full
+            if len(pending) > jobs:
+                done_path, done_catalog, future = pending.popleft()
+                parsed, parse_stages = future.result()
+                reports.append(populate_species(done_path, db_path, parsed, chunk_size, done_catalog, parse_stages))
+
+        while pending:
+            done_path, done_catalog, future = pending.popleft()
+            parsed, parse_stages = future.result()
+            reports.append(populate_species(done_path, db_path, parsed, chunk_size, done_catalog, parse_stages))
+
+    return reports
+
+
+def bump_load_generation(db_path):
+    """
+    Count one more load of the database, so Query_service drops the results it cached before it.
+
+    Args:
+        db_path (str): The path to the database.
+
+    Returns:
+        int: The new load generation.
+    """
+    conn = Bulk_session.connect(db_path)
+    try:
+        generation = Schema_info.bump_load_generation(conn)
+        conn.commit()
+        return generation
+    finally:
+        Bulk_session.release(conn)
+
+
+def finalize(db_path, vacuum=False, report=None):
+    """
+    Run the post-load stage: build the indexes, ANALYZE and optionally VACUUM.
+
+    Args:
+        db_path (str): The path to the database.
+        vacuum (bool): Whether to VACUUM the database afterwards.
+        report (dict, optional): The Load_report report to add the stage's metrics to.
+
+    Returns:
+        None
+    """
+    try:
+        with Load_report.measure(report, "finalize"):
+            print("Finalizing database...")
+            Finalize_database.finalize_database(db_path, vacuum) # Build indexes and refresh statistics after all loaders
+            print("     Database finalized successfully.")
+    except Exception as e:
+        print("     Error finalizing database:", str(e))
+
+
+def populate_release(file_path, db_path, species_index=None, jobs=1, chunk_size=None, skip_finalize=False, vacuum=False):
+    """
+    Load a release directory and finalize the database, measuring every stage.
+
+    This is what the command line runs, for use from Python, e.g. by a scheduler that
+    follows each stage with Load_report.add_listener and keeps the returned report.
+
+    Args:
+        file_path (str): The directory containing the species folders.
+        db_path (str): The path to the database.
+        species_index (int, optional): Load only the species folder at this index instead of every folder.
+        jobs (int): The number of worker processes used for parsing every species.
+        chunk_size (int, optional): Stream run_genes data in batches of at most this many values.
+        skip_finalize (bool): Do not build indexes and ANALYZE after loading.
+        vacuum (bool): Whether to VACUUM the database after finalizing.
+
+    Returns:
+        dict: The release report, with a species_reports list of per-species reports,
+            the finalize stage and the totals of every stage across species.
+    """
+    report = Load_report.new_report(file_path=file_path, db_path=db_path, jobs=jobs, chunk_size=chunk_size,
+                                    tsv_engine=Tsv_reader.ENGINE, pipeline_depth=Ingest_pipeline.DEPTH)
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+
+    try:
+        if species_index is None:
+            report['species_reports'] = populate_all_species(file_path, db_path, jobs, chunk_size)
+        else:
+            report['species_reports'] = [populate_species(find_species_folder(file_path, species_index), db_path, chunk_size=chunk_size)]
+
+        if not skip_finalize:
+            finalize(db_path, vacuum, report)
+    finally:
+        # Even a failed load may have changed rows
+        report['load_generation'] = bump_load_generation(db_path)
+
+    return Load_report.finish(report, wall_start, cpu_start)
+
+
+def refresh_study(study_path, db_path, chunk_size=None, force=False):
+    """
+    Reload a single study folder, replacing its rows in every per-study table.
+
+    Each loader in FOLDER_LOADERS deletes the study's rows and inserts the new ones in one
+    transaction, finding the old rows through the indexes built by Finalize_database (built
+    first if missing), so the refresh only touches the study and readers of a WAL database
+    keep reading the rest, and the study's previous version, meanwhile. The run_genes stage
+    also recomputes the study's gene_condition_stats rows. Running it again is harmless.
+    The species-wide tables (species, studies, runs, genes) are left as they are.
+
+    Args:
+        study_path (str): The path to the study folder, inside its species folder.
+        db_path (str): The path to the database.
+        chunk_size (int, optional): Stream run_genes data in batches of at most this many values.
+        force (bool): Reload the study even if its files are unchanged since the last load.
+
+    Returns:
+        dict: The Load_report report of the refresh, with the metrics of every stage.
+    """
+    study_path = os.path.normpath(study_path)
+    species_path, study_id = os.path.dirname(study_path), os.path.basename(study_path)
+    print(f"Refreshing study {study_id} from {species_path}")
+
+    # A catalog of the species folder holding only this study, so every loader sees just the study
+    catalog = Directory_catalog.scan_species(species_path)
+    if study_id not in catalog['studies']:
+        raise FileNotFoundError(f"No study folder {study_id} in {species_path}")
+    catalog = dict(catalog, studies={study_id: catalog['studies'][study_id]})
+
+    report = Load_report.new_report(species=os.path.basename(species_path), study=study_id, force=force)
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+
+    conn = Bulk_session.connect(db_path)
+    try:
+        Finalize_database.build_indexes(conn)
+    finally:
+        Bulk_session.release(conn)
+
+    try:
+        for stage, loader in FOLDER_LOADERS.items():
+            if force:
+                Load_manifest.invalidate(db_path, loader.LOADER_NAME, study_id)
+            try:
+                with Load_report.measure(report, stage):
+                    print(f"     Refreshing {stage} data...")
+                    if loader is Run_genes_count_tpm_loader:
+                        loader.process_folders_in_directory(species_path, db_path, chunk_size=chunk_size, catalog=catalog)
+                    else:
+                        loader.process_folders_in_directory(species_path, db_path, catalog=catalog)
+                    print(f"         {stage.capitalize()} data refreshed successfully.")
+            except Exception as e:
+                print(f"         Error refreshing {stage} data:", str(e))
+    finally:
+        report['load_generation'] = bump_load_generation(db_path)
+
+    return Load_report.finish(report, wall_start, cpu_start)
+
+
+def write_reports(report, report_dir):
+    """
+    Write a release report as one JSON file per species and a release.json rollup.
+
+    Args:
+        report (dict): The output of populate_release.
+        report_dir (str): The directory to write the JSON files to.
+
+    Returns:
+        None
+    """
+    for species_report in report['species_reports']:
+        Load_report.write_report(species_report, os.path.join(report_dir, f"{species_report['species']}.json"))
+    Load_report.write_report(report, os.path.join(report_dir, "release.json"))
+    print(f"Load report written to {report_dir}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Populate the WBPS database from a release directory.")
+    parser.add_argument("--file-path", default=file_path, help="Directory containing the species folders.")
+    parser.add_argument("--db-path", default=db_path, help="Path to the database.")
+    parser.add_argument("--species-index", type=int, default=species_index, help="Index of the species folder to load.")
+    parser.add_argument("--all-species", action="store_true", help="Load every species folder in --file-path.")
+    parser.add_argument("--study", help="Only reload this study folder (inside its species folder), replacing its rows.")
+    parser.add_argument("--force", action="store_true", help="With --study, reload the study even if its files are unchanged.")
+    parser.add_argument("--jobs", type=int, default=1, help="Worker processes used to parse species with --all-species.")
+    parser.add_argument("--chunk-size", type=int, default=None,
+                        help="Stream run_genes data in batches of at most this many values instead of whole studies.")
+    parser.add_argument("--tsv-engine", choices=Tsv_reader.ENGINES, default=Tsv_reader.ENGINE,
+                        help="Parser for the TSV files. pyarrow is faster on large files and needs the pyarrow package.")
+    parser.add_argument("--pipeline-depth", type=int, default=Ingest_pipeline.DEPTH,
+                        help="Studies (or streamed batches) parsed ahead in a background thread while the current one is written. 0 parses and writes one after the other.")
+    parser.add_argument("--skip-finalize", action="store_true", help="Do not build indexes and ANALYZE after loading.")
+    parser.add_argument("--vacuum", action="store_true", help="VACUUM the database after finalizing.")
+    parser.add_argument("--session-mode", choices=sorted(Bulk_session.SESSION_MODES), default="safe",
+                        help="safe: WAL journal, survives crashes. fast: in-memory journal and no fsync, for raw ingest speed.")
+    parser.add_argument("--cache-size-mb", type=int, default=Bulk_session.CACHE_SIZE_MB, help="SQLite page cache size during the load.")
+    parser.add_argument("--mmap-size-mb", type=int, default=Bulk_session.MMAP_SIZE_MB, help="SQLite memory map size during the load.")
+    parser.add_argument("--report-dir", help="Write a JSON report of every stage's time, rows and memory, per species and for the release, to this directory.")
+    args = parser.parse_args()
+
+    Tsv_reader.set_engine(args.tsv_engine)
+    Ingest_pipeline.set_depth(args.pipeline_depth)
+
+    # All loaders share one tuned connection; durable settings are restored when the session ends
+    with Bulk_session.bulk_session(args.db_path, args.session_mode, args.cache_size_mb, args.mmap_size_mb):
+        if args.study:
+            report = refresh_study(args.study, args.db_path, args.chunk_size, args.force)
+        else:
+            report = populate_release(args.file_path, args.db_path, None if args.all_species else args.species_index,
+                                      args.jobs, args.chunk_size, args.skip_finalize, args.vacuum)
+
+    if args.report_dir and args.study:
+        Load_report.write_report(report, os.path.join(args.report_dir, f"{report['study']}.json"))
+    elif args.report_dir:
+        write_reports(report, args.report_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,289 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import sqlite3
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from multiprocessing import get_context
+
+import Create_db_and_tables
+import Populate_schema
+from benchmarks import Synthetic_dataset
+from loaders import Bulk_session
+from loaders import Species_loader
+from loaders import Studies_loader
+from loaders import Runs_loader
+from loaders import Studies_species_loader
+from loaders import Studies_json_loader
+from loaders import Genes_loader
+from loaders import Run_genes_count_tpm_loader
+from loaders import Metadata_loader
+from loaders import Differential_Expression_loader
+from loaders import Finalize_database
+from loaders import Load_report
+
+# Chunk size used by the streamed run_genes benchmark
+STREAM_CHUNK_SIZE = 100000
+
+def per_species(load):
+    """
+    Turn a loader taking (species_path, db_path) into a stage run over every species folder.
+
+    Args:
+        load (Callable): The loader function.
+
+    Returns:
+        Callable: A function taking (species_paths, db_path).
+    """
+    def stage(species_paths, db_path):
+        for species_path in species_paths:
+            load(species_path, db_path)
+    return stage
+
+# Every loader stage, as a function taking (species_paths, db_path)
+STAGES = {
+    'species': per_species(Species_loader.load_species_data),
+    'studies': per_species(Studies_loader.load_studies),
+    'runs': per_species(Runs_loader.load_runs),
+    'studies_species': per_species(Studies_species_loader.load_studies_species),
+    'studies_json': per_species(Studies_json_loader.load_studies_json),
+    'genes': per_species(Genes_loader.load_genes),
+    'run_genes_count_tpm': per_species(Run_genes_count_tpm_loader.process_folders_in_directory),
+    'run_genes_count_tpm_streamed': per_species(
+        lambda species_path, db_path: Run_genes_count_tpm_loader.process_folders_in_directory(species_path, db_path, chunk_size=STREAM_CHUNK_SIZE)
+    ),
+    'metadata': per_species(Metadata_loader.process_folders_in_directory),
+    'differential_expression': per_species(Differential_Expression_loader.process_folders_in_directory),
+    'finalize': lambda species_paths, db_path: Finalize_database.finalize_database(db_path),
+}
+
+# Stages that fill the tables the expression, metadata and DE loaders depend on
+BASE_STAGES = ['species', 'studies_json', 'genes']
+ALL_STAGES = BASE_STAGES + ['run_genes_count_tpm', 'metadata', 'differential_expression']
+
+# Each benchmark creates a fresh database with the given schema, runs its setup stages untimed,
+# then times its stages and counts the rows they wrote with the rows query.
+# The populate_schema benchmark times Populate_schema end to end instead.
+BENCHMARKS = {
+    'species': {'setup': [], 'stages': ['species'], 'rows': "SELECT COUNT(*) FROM species"},
+    'studies': {'setup': ['species'], 'stages': ['studies'], 'rows': "SELECT COUNT(*) FROM studies"},
+    'runs': {'setup': ['species', 'studies'], 'stages': ['runs'], 'rows': "SELECT COUNT(*) FROM runs"},
+    'studies_species': {'setup': ['species', 'studies'], 'stages': ['studies_species'], 'rows': "SELECT COUNT(*) FROM study_species"},
+    'studies_json': {
+        'setup': ['species'], 'stages': ['studies_json'],
+        'rows': "SELECT (SELECT COUNT(*) FROM studies) + (SELECT COUNT(*) FROM runs) + (SELECT COUNT(*) FROM study_species)",
+    },
+    'genes': {'setup': ['species'], 'stages': ['genes'], 'rows': "SELECT COUNT(*) FROM genes"},
+    'run_genes_count_tpm': {'setup': BASE_STAGES, 'stages': ['run_genes_count_tpm'], 'rows': "SELECT COUNT(*) FROM run_genes"},
+    'run_genes_count_tpm_streamed': {
+        'setup': BASE_STAGES, 'stages': ['run_genes_count_tpm_streamed'], 'rows': "SELECT COUNT(*) FROM run_genes",
+    },
+    'run_genes_count_tpm_keyed': {
+        'schema': {'layout': 'keyed'},
+        'setup': BASE_STAGES, 'stages': ['run_genes_count_tpm'], 'rows': "SELECT COUNT(*) FROM run_genes",
+    },
+    'run_genes_count_tpm_packed': {
+        'schema': {'expression_storage': 'packed'},
+        'setup': BASE_STAGES, 'stages': ['run_genes_count_tpm'],
+        # One value per gene and run, 4 bytes each, as in the long layouts
+        'rows': "SELECT COALESCE(SUM(LENGTH(count_vector)), 0) / 4 FROM run_vectors",
+    },
+    'run_genes_count_tpm_sparse': {
+        'schema': {'expression_storage': 'sparse'},
+        'setup': BASE_STAGES, 'stages': ['run_genes_count_tpm'], 'rows': "SELECT COUNT(*) FROM run_genes",
+    },
+    'run_genes_count_tpm_compact': {
+        'schema': {'value_encoding': 'compact'},
+        'setup': BASE_STAGES, 'stages': ['run_genes_count_tpm'], 'rows': "SELECT COUNT(*) FROM run_genes",
+    },
+    'metadata': {'setup': ['species', 'studies_json'], 'stages': ['metadata'], 'rows': "SELECT COUNT(*) FROM run_metadata"},
+    'differential_expression': {
+        'setup': ['species', 'studies_json'], 'stages': ['differential_expression'], 'rows': "SELECT COUNT(*) FROM differential_expression",
+    },
+    'finalize': {'setup': ALL_STAGES, 'stages': ['finalize'], 'rows': "SELECT COUNT(*) FROM run_genes"},
+    'populate_schema': {'end_to_end': True, 'rows': "SELECT COUNT(*) FROM run_genes"},
+}
+
+def run_benchmark(name, release_dir, work_dir, jobs=1, verbose=False):
+    """
+    Run one benchmark on a fresh database.
+
+    Meant to run in a process of its own, so the peak RSS belongs to this benchmark alone.
+
+    Args:
+        name (str): A key of BENCHMARKS.
+        release_dir (str): The directory containing the species folders.
+        work_dir (str): The directory for the benchmark database.
+        jobs (int): The number of worker processes for the populate_schema benchmark.
+        verbose (bool): Show the loaders' output instead of discarding it.
+
+    Returns:
+        dict: The wall time, rows written, rows per second and peak RSS.
+    """
+    benchmark = BENCHMARKS[name]
+    db_path = os.path.join(work_dir, f"{name}.db")
+    if os.path.exists(db_path):
+        os.remove(db_path)
+
+    output = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+    with output:
+        Create_db_and_tables.create_database(db_path, **benchmark.get('schema', {}))
+        species_paths = Populate_schema.find_species_folders(release_dir)
+
+        if benchmark.get('end_to_end'):
+            rss_before = Load_report.peak_rss_mb()
+            start = time.perf_counter()
+            with Bulk_session.bulk_session(db_path):
+                Populate_schema.populate_all_species(release_dir, db_path, jobs)
+                Populate_schema.finalize(db_path)
+            wall_seconds = time.perf_counter() - start
+        else:
+            with Bulk_session.bulk_session(db_path):
+                for stage in benchmark['setup']:
+                    STAGES[stage](species_paths, db_path)
+                rss_before = Load_report.peak_rss_mb()
+                start = time.perf_counter()
+                for stage in benchmark['stages']:
+                    STAGES[stage](species_paths, db_path)
+                wall_seconds = time.perf_counter() - start
+
+    conn = sqlite3.connect(db_path)
+    rows = conn.execute(benchmark['rows']).fetchone()[0]
+    conn.close()
+    peak_rss = Load_report.peak_rss_mb()
+
+    return {
+        'wall_seconds': round(wall_seconds, 4),
+        'rows': rows,
+        'rows_per_second': round(rows / wall_seconds, 1) if wall_seconds > 0 else None,
+        'peak_rss_mb': None if peak_rss is None else round(peak_rss, 1),
+        'peak_rss_before_mb': None if rss_before is None else round(rss_before, 1),
+    }
+
+def git_commit():
+    """
+    Get the commit the benchmarks ran on.
+
+    Returns:
+        str: The commit hash, with "-dirty" appended if there are uncommitted changes, or None outside a git checkout.
+    """
+    repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=repo_dir, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=repo_dir,
+                               capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + '-dirty' if dirty else commit
+
+def run_benchmarks(names, release_dir, work_dir, repeat=1, jobs=1, verbose=False):
+    """
+    Run benchmarks, each repetition in a fresh process.
+
+    Args:
+        names (List[str]): Keys of BENCHMARKS.
+        release_dir (str): The directory containing the species folders.
+        work_dir (str): The directory for the benchmark databases.
+        repeat (int): The number of times to run each benchmark. The fastest run is reported.
+        jobs (int): The number of worker processes for the populate_schema benchmark.
+        verbose (bool): Show the loaders' output.
+
+    Returns:
+        dict: The result of each benchmark, keyed by name.
+    """
+    results = {}
+    for name in names:
+        runs = []
+        for _ in range(repeat):
+            # A spawned process starts clean, so ru_maxrss is not inherited from earlier benchmarks
+            with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as executor:
+                runs.append(executor.submit(run_benchmark, name, release_dir, work_dir, jobs, verbose).result())
+
+        best = min(runs, key=lambda run: run['wall_seconds'])
+        best['all_wall_seconds'] = [run['wall_seconds'] for run in runs]
+        results[name] = best
+        print(f"{name:32s} {best['wall_seconds']:10.3f}s {best['rows']:12d} rows "
+              f"{best['rows_per_second'] or 0:14,.0f} rows/s {best['peak_rss_mb'] or 0:9.1f} MB")
+    return results
+
+def compare(results, baseline):
+    """
+    Print the speedup of each benchmark over a previous results file.
+
+    Args:
+        results (dict): The benchmarks of this run, as in the results file.
+        baseline (dict): The contents of a previous results file.
+
+    Returns:
+        None
+    """
+    print(f"\nCompared with {baseline.get('git_commit')} ({baseline.get('created')}):")
+    for name, result in results['benchmarks'].items():
+        old = baseline.get('benchmarks', {}).get(name)
+        if old is None:
+            print(f"{name:32s} (not in baseline)")
+            continue
+        speedup = old['wall_seconds'] / result['wall_seconds'] if result['wall_seconds'] else float('inf')
+        rss_change = (result['peak_rss_mb'] or 0) - (old['peak_rss_mb'] or 0)
+        print(f"{name:32s} {old['wall_seconds']:10.3f}s -> {result['wall_seconds']:10.3f}s  x{speedup:6.2f}  RSS {rss_change:+8.1f} MB")
+
+def main():
+    parser = argparse.ArgumentParser(description="Time every loader and Populate_schema on a synthetic WBPS-shaped dataset.")
+    parser.add_argument("--output", default="benchmark_results.json", help="JSON file to write the results to.")
+    parser.add_argument("--release-dir", help="Use an existing release directory instead of generating one.")
+    parser.add_argument("--work-dir", help="Directory for the generated dataset and databases, a temporary one by default.")
+    parser.add_argument("--species", type=int, default=Synthetic_dataset.N_SPECIES, help="Number of species folders to generate.")
+    parser.add_argument("--studies", type=int, default=Synthetic_dataset.N_STUDIES, help="Number of studies per species.")
+    parser.add_argument("--genes", type=int, default=Synthetic_dataset.N_GENES, help="Number of genes per species.")
+    parser.add_argument("--runs", type=int, default=Synthetic_dataset.N_RUNS, help="Number of runs per study.")
+    parser.add_argument("--contrasts", type=int, default=Synthetic_dataset.N_CONTRASTS, help="Number of DE contrasts per study.")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed of the generated dataset.")
+    parser.add_argument("--gzip", action="store_true", help="Generate gzip compressed TSV files.")
+    parser.add_argument("--only", nargs="+", choices=sorted(BENCHMARKS), help="Run only these benchmarks.")
+    parser.add_argument("--repeat", type=int, default=1, help="Run each benchmark this many times and report the fastest.")
+    parser.add_argument("--jobs", type=int, default=1, help="Worker processes for the populate_schema benchmark.")
+    parser.add_argument("--compare", help="A previous results file to compare against.")
+    parser.add_argument("--verbose", action="store_true", help="Show the loaders' output.")
+    args = parser.parse_args()
+
+    with contextlib.ExitStack() as stack:
+        work_dir = args.work_dir or stack.enter_context(tempfile.TemporaryDirectory(prefix="wbps_bench_"))
+        dataset = {'release_dir': args.release_dir}
+        release_dir = args.release_dir
+
+        if release_dir is None:
+            dataset = {'species': args.species, 'studies': args.studies, 'genes': args.genes, 'runs': args.runs,
+                       'contrasts': args.contrasts, 'seed': args.seed, 'gzip': args.gzip}
+            release_dir = os.path.join(work_dir, 'release')
+            print(f"Generating synthetic dataset in {release_dir}...")
+            Synthetic_dataset.generate_dataset(release_dir, args.species, args.studies, args.genes, args.runs,
+                                               args.contrasts, seed=args.seed, compress=args.gzip)
+
+        benchmarks = run_benchmarks(args.only or list(BENCHMARKS), release_dir, work_dir, args.repeat, args.jobs, args.verbose)
+
+    results = {
+        'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'git_commit': git_commit(),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'platform': platform.platform(),
+        'dataset': dataset,
+        'benchmarks': benchmarks,
+    }
+    with open(args.output, 'w') as file:
+        json.dump(results, file, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as file:
+            compare(results, json.load(file))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,259 @@
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from datetime import datetime, timezone
+
+import pandas as pd
+
+from benchmarks import Loader_benchmarks
+from loaders import Schema_info
+from queries import Query_service
+
+# Number of distinct requests of each kind drawn from the database. Clients pick among them
+# at random, so a smaller sample means more repeated queries and more cache hits.
+SAMPLE_SIZE = 200
+
+# Genes per gene_expression request
+GENES_PER_REQUEST = 3
+
+def sample_requests(db_path, sample_size=SAMPLE_SIZE, seed=0):
+    """
+    Draw a mix of realistic requests for every endpoint from the contents of a database.
+
+    Args:
+        db_path (str): The path to the SQLite database.
+        sample_size (int): The number of distinct requests of each kind.
+        seed (int): The random seed.
+
+    Returns:
+        List[Tuple[str, dict]]: The endpoint and parameters of each request.
+    """
+    rng = random.Random(seed)
+    conn = Query_service.open_readonly(db_path)
+    try:
+        gene_ids = [gene_id for (gene_id,) in conn.execute("SELECT gene_id FROM genes")]
+        contrasts = list(Query_service.contrasts(conn)[['study_id', 'condition_1', 'condition_2']].itertuples(index=False, name=None))
+        species = [species_id for (species_id,) in conn.execute("SELECT species_id FROM species")]
+        # Databases created before run_metadata existed get no runs_by_metadata requests
+        metadata = conn.execute("SELECT DISTINCT key, value FROM run_metadata").fetchall() \
+            if Schema_info.has_table(conn, 'run_metadata') else []
+    finally:
+        conn.close()
+
+    requests = []
+    for _ in range(sample_size):
+        if gene_ids:
+            requests.append(('gene_expression', {'gene_ids': rng.sample(gene_ids, min(GENES_PER_REQUEST, len(gene_ids)))}))
+        if contrasts:
+            study_id, condition_1, condition_2 = rng.choice(contrasts)
+            requests.append(('top_de_genes', {'study_id': study_id, 'condition_1': condition_1, 'condition_2': condition_2, 'n': 50}))
+            requests.append(('significant_de_genes', {'study_id': study_id, 'condition_1': condition_1, 'condition_2': condition_2}))
+        if metadata:
+            key, value = rng.choice(metadata)
+            requests.append(('runs_by_metadata', {'key': key, 'value': str(value)}))
+        if species:
+            requests.append(('studies_for_species', {'species': rng.choice(species)}))
+    return requests
+
+def request_url(base_url, endpoint, params):
+    """
+    Build the URL of a request to the HTTP service.
+
+    Args:
+        base_url (str): The service address, e.g. "http://127.0.0.1:8765".
+        endpoint (str): A key of Query_service.ENDPOINTS.
+        params (dict): The parameters; lists are sent comma separated.
+
+    Returns:
+        str: The URL.
+    """
+    query = {name: ','.join(value) if isinstance(value, (list, tuple)) else value for name, value in params.items()}
+    return f"{base_url}/{endpoint}?{urllib.parse.urlencode(query)}"
+
+def http_client(base_url):
+    """
+    Make a function sending one request to the HTTP service.
+
+    Args:
+        base_url (str): The service address.
+
+    Returns:
+        Callable: Takes (endpoint, params), returns the HTTP status.
+    """
+    def send(endpoint, params):
+        try:
+            with urllib.request.urlopen(request_url(base_url, endpoint, params)) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
+    return send
+
+def in_process_client(endpoint, params):
+    # Calls Query_service.query directly, to measure the service without HTTP
+    try:
+        Query_service.query(endpoint, **params)
+        return 200
+    except LookupError:
+        return 404
+    except (sqlite3.Error, pd.errors.DatabaseError):
+        return 500
+
+def percentile(values, fraction):
+    # The value below which the given fraction of the sorted values fall
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+def run_load(send, requests, clients=8, duration=10.0, seed=0):
+    """
+    Send random requests from concurrent client threads for a fixed time.
+
+    Args:
+        send (Callable): Sends one request, from http_client or in_process_client.
+        requests (List[Tuple[str, dict]]): The requests to pick from, from sample_requests.
+        clients (int): The number of client threads, each sending one request at a time.
+        duration (float): How long to send requests, in seconds.
+        seed (int): The random seed of the clients.
+
+    Returns:
+        dict: The requests sent, requests per second, errors, and latency percentiles in milliseconds.
+    """
+    latencies = [[] for _ in range(clients)]
+    errors = [0] * clients
+    deadline = time.perf_counter() + duration
+
+    def client(index):
+        rng = random.Random(seed + index)
+        while time.perf_counter() < deadline:
+            endpoint, params = rng.choice(requests)
+            start = time.perf_counter()
+            status = send(endpoint, params)
+            latencies[index].append(time.perf_counter() - start)
+            if status >= 500:
+                errors[index] += 1
+
+    threads = [threading.Thread(target=client, args=(index,)) for index in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall_seconds = time.perf_counter() - start
+
+    all_latencies = sorted(latency * 1000 for latency_list in latencies for latency in latency_list)
+    return {
+        'clients': clients,
+        'wall_seconds': round(wall_seconds, 3),
+        'requests': len(all_latencies),
+        'requests_per_second': round(len(all_latencies) / wall_seconds, 1) if wall_seconds > 0 else None,
+        'errors': sum(errors),
+        'latency_ms': {name: None if value is None else round(value, 3) for name, value in [
+            ('p50', percentile(all_latencies, 0.5)),
+            ('p95', percentile(all_latencies, 0.95)),
+            ('p99', percentile(all_latencies, 0.99)),
+        ]},
+    }
+
+def start_server(db_path, pool_size, cache_size):
+    """
+    Start the HTTP service in a process of its own on a free local port.
+
+    Args:
+        db_path (str): The path to the SQLite database.
+        pool_size (int): The number of pooled connections.
+        cache_size (int): The number of cached results, 0 to disable the cache.
+
+    Returns:
+        Tuple[Popen, str]: The server process and its address.
+    """
+    repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'queries.Query_service', os.path.abspath(db_path), '--port', '0',
+         '--pool-size', str(pool_size), '--cache-size', str(cache_size)],
+        cwd=repo_dir, stdout=subprocess.PIPE, text=True,
+    )
+    # The service prints its address once it listens
+    line = process.stdout.readline()
+    if ' on ' not in line:
+        process.kill()
+        raise RuntimeError(f"The query service did not start: {line!r}")
+    return process, line.split(' on ')[1].split()[0]
+
+def fetch_stats(base_url):
+    # The service counters, from this process when base_url is None
+    if base_url is None:
+        return Query_service.stats()
+    with urllib.request.urlopen(f"{base_url}/stats") as response:
+        return json.load(response)
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the throughput of the query service under concurrent readers.")
+    parser.add_argument("db_path", help="Path to the database.")
+    parser.add_argument("--url", help="Address of a running service, e.g. http://127.0.0.1:8765. One is started by default.")
+    parser.add_argument("--in-process", action="store_true", help="Call the service functions directly instead of over HTTP.")
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 4, 16], help="Numbers of concurrent clients to measure.")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds of load per number of clients.")
+    parser.add_argument("--pool-size", type=int, default=Query_service.POOL_SIZE, help="Connections of a started service.")
+    parser.add_argument("--cache-size", type=int, default=Query_service.CACHE_SIZE, help="Cached results of a started service, 0 to disable.")
+    parser.add_argument("--sample-size", type=int, default=SAMPLE_SIZE, help="Distinct requests of each kind.")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed of the requests.")
+    parser.add_argument("--output", default="query_load_results.json", help="JSON file to write the results to.")
+    args = parser.parse_args()
+
+    requests = sample_requests(args.db_path, args.sample_size, args.seed)
+    process, base_url = None, args.url
+    if args.in_process:
+        Query_service.start(args.db_path, args.pool_size, args.cache_size)
+        send = in_process_client
+    else:
+        if base_url is None:
+            process, base_url = start_server(args.db_path, args.pool_size, args.cache_size)
+        send = http_client(base_url)
+
+    loads = []
+    try:
+        for clients in args.clients:
+            result = run_load(send, requests, clients, args.duration, args.seed)
+            result['service'] = fetch_stats(None if args.in_process else base_url)
+            loads.append(result)
+            print(f"{clients:4d} clients {result['requests_per_second'] or 0:12,.1f} req/s  "
+                  f"p50 {result['latency_ms']['p50'] or 0:8.2f} ms  p99 {result['latency_ms']['p99'] or 0:8.2f} ms  "
+                  f"{result['errors']} errors")
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+        if args.in_process:
+            Query_service.stop()
+
+    results = {
+        'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'git_commit': Loader_benchmarks.git_commit(),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'platform': platform.platform(),
+        'db_path': args.db_path,
+        'mode': 'in-process' if args.in_process else 'http',
+        'pool_size': args.pool_size,
+        'cache_size': args.cache_size,
+        'sample_size': args.sample_size,
+        'loads': loads,
+    }
+    with open(args.output, 'w') as file:
+        json.dump(results, file, indent=2)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+import argparse
+import gzip
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+# Default size of a generated dataset
+N_SPECIES = 2
+N_STUDIES = 3
+N_GENES = 2000
+N_RUNS = 12
+N_CONTRASTS = 3
+ZERO_FRACTION = 0.3
+
+# Values used for the per-run metadata columns
+DEVELOPMENTAL_STAGES = ['L1', 'L2', 'L3', 'L4', 'adult']
+SEXES = ['male', 'female', 'hermaphrodite']
+
+def study_frames(rng, study_id, gene_ids, n_runs, n_contrasts, zero_fraction):
+    """
+    Generate the counts, TPM, metadata and DE tables of one study.
+
+    Args:
+        rng (Generator): The NumPy random generator.
+        study_id (str): The study ID, used as the prefix of the run IDs.
+        gene_ids (List[str]): The gene IDs of the species.
+        n_runs (int): The number of runs in the study.
+        n_contrasts (int): The number of DE contrasts, each against condition 0.
+        zero_fraction (float): The fraction of counts that are zero.
+
+    Returns:
+        Tuple[DataFrame, DataFrame, DataFrame, DataFrame, List[dict]]: The counts, TPM, metadata and
+            DE tables, and the runs as listed in studies.json.
+    """
+    run_ids = [f"{study_id}R{run:05d}" for run in range(n_runs)]
+    conditions = [f"condition {run % (n_contrasts + 1)}" for run in range(n_runs)]
+    n_genes = len(gene_ids)
+
+    # Counts with a gene-specific mean, and a share of exact zeros
+    means = rng.lognormal(mean=4, sigma=2, size=(n_genes, 1))
+    counts = rng.poisson(np.minimum(means, 1e6) * rng.uniform(0.5, 1.5, size=(n_genes, n_runs)))
+    counts[rng.random((n_genes, n_runs)) < zero_fraction] = 0
+
+    # TPM: counts per kilobase of a random gene length, scaled to a million per run
+    lengths = rng.integers(300, 10000, size=(n_genes, 1)) / 1000
+    rate = counts / lengths
+    tpm = np.round(rate / np.maximum(rate.sum(axis=0), 1) * 1e6, 4)
+
+    df_counts = pd.DataFrame(counts, index=pd.Index(gene_ids, name='gene_id'), columns=run_ids)
+    df_tpm = pd.DataFrame(tpm, index=pd.Index(gene_ids, name='gene_id'), columns=run_ids)
+
+    # Metadata, with some values left empty as in the real files
+    df_metadata = pd.DataFrame({
+        'run_id': run_ids,
+        'developmental_stage': rng.choice(DEVELOPMENTAL_STAGES, size=n_runs),
+        'sex': rng.choice(SEXES + [''], size=n_runs),
+        'replicate': np.arange(n_runs) // (n_contrasts + 1) + 1,
+    })
+
+    # DE: a log2 fold change and an adjusted p-value column per contrast, both named after the contrast
+    de_columns = {}
+    for contrast in range(1, n_contrasts + 1):
+        name = f"condition {contrast} vs condition 0"
+        de_columns[(name, 0)] = np.round(rng.normal(0, 2, size=n_genes), 3)
+        de_columns[(name, 1)] = np.round(rng.random(n_genes), 5)
+    df_de = pd.DataFrame(de_columns.values(), index=[name for name, _ in de_columns]).T
+    df_de.index = pd.Index(gene_ids, name='gene_id')
+
+    runs = [{'run_id': run_id, 'condition': condition} for run_id, condition in zip(run_ids, conditions)]
+    return df_counts, df_tpm, df_metadata, df_de, runs
+
+def write_tsv(df, path, preamble=(), index=True, compress=False):
+    """
+    Write a table as a TSV file, after optional "# " comment lines.
+
+    Args:
+        df (DataFrame): The table.
+        path (str): The path to the file.
+        preamble (Iterable[str]): Comment lines written before the header row.
+        index (bool): Whether to write the index as the first column.
+        compress (bool): Write path + ".gz", gzip compressed.
+
+    Returns:
+        None
+    """
+    with (gzip.open(path + '.gz', 'wt', newline='') if compress else open(path, 'w', newline='')) as file:
+        for line in preamble:
+            file.write(f"# {line}\n")
+        df.to_csv(file, sep='\t', index=index)
+
+def generate_dataset(out_dir, n_species=N_SPECIES, n_studies=N_STUDIES, n_genes=N_GENES, n_runs=N_RUNS,
+                     n_contrasts=N_CONTRASTS, zero_fraction=ZERO_FRACTION, seed=0, compress=False):
+    """
+    Generate a release directory with the same layout as the WBPS RNA-seq studies release.
+
+    Each species folder is named <species_name>_<id> and holds <species_name>.studies.json
+    and one folder per study with its counts_per_run.tsv, tpm_per_run.tsv (after a comment
+    preamble), metadata_per_run.tsv and de.all.tsv files. The same seed always gives the same files.
+
+    Args:
+        out_dir (str): The directory to write the species folders to.
+        n_species (int): The number of species folders.
+        n_studies (int): The number of studies per species.
+        n_genes (int): The number of genes per species, all present in every study.
+        n_runs (int): The number of runs per study.
+        n_contrasts (int): The number of DE contrasts per study.
+        zero_fraction (float): The fraction of counts that are zero.
+        seed (int): The random seed.
+        compress (bool): Write the TSV files gzip compressed, as .tsv.gz.
+
+    Returns:
+        List[str]: The paths to the species folders.
+    """
+    rng = np.random.default_rng(seed)
+    species_paths = []
+
+    for species in range(n_species):
+        species_name = f"synthetica_species{species}"
+        species_path = os.path.join(out_dir, f"{species_name}_prjsyn{species:04d}")
+        os.makedirs(species_path, exist_ok=True)
+        gene_ids = [f"SYN{species}G{gene:07d}" for gene in range(n_genes)]
+
+        studies = []
+        for study in range(n_studies):
+            study_id = f"SYN{species}S{study:04d}"
+            study_path = os.path.join(species_path, study_id)
+            os.makedirs(study_path, exist_ok=True)
+
+            df_counts, df_tpm, df_metadata, df_de, runs = study_frames(rng, study_id, gene_ids, n_runs, n_contrasts, zero_fraction)
+            write_tsv(df_counts, os.path.join(study_path, f"{study_id}.counts_per_run.tsv"), compress=compress)
+            write_tsv(df_tpm, os.path.join(study_path, f"{study_id}.tpm_per_run.tsv"),
+                      preamble=[f"Study: {study_id}", "TPM values per run, synthetic"], compress=compress)
+            write_tsv(df_metadata, os.path.join(study_path, f"{study_id}.metadata_per_run.tsv"), index=False, compress=compress)
+            write_tsv(df_de, os.path.join(study_path, f"{study_id}.de.all.tsv"),
+                      preamble=[f"Study: {study_id}", "Differential expression, synthetic"], compress=compress)
+
+            studies.append({
+                'study_id': study_id,
+                'study_title': f"Synthetic study {study} of {species_name}",
+                'study_category': 'Other',
+                'attributes': {'library_selection': 'cDNA', 'generated': True},
+                'runs': runs,
+            })
+
+        with open(os.path.join(species_path, f"{species_name}.studies.json"), 'w') as file:
+            json.dump(studies, file)
+
+        species_paths.append(species_path)
+
+    return species_paths
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic WBPS-shaped release directory.")
+    parser.add_argument("out_dir", help="Directory to write the species folders to.")
+    parser.add_argument("--species", type=int, default=N_SPECIES, help="Number of species folders.")
+    parser.add_argument("--studies", type=int, default=N_STUDIES, help="Number of studies per species.")
+    parser.add_argument("--genes", type=int, default=N_GENES, help="Number of genes per species.")
+    parser.add_argument("--runs", type=int, default=N_RUNS, help="Number of runs per study.")
+    parser.add_argument("--contrasts", type=int, default=N_CONTRASTS, help="Number of DE contrasts per study.")
+    parser.add_argument("--zero-fraction", type=float, default=ZERO_FRACTION, help="Fraction of counts that are zero.")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed.")
+    parser.add_argument("--gzip", action="store_true", help="Write the TSV files gzip compressed, as .tsv.gz.")
+    args = parser.parse_args()
+
+    paths = generate_dataset(args.out_dir, args.species, args.studies, args.genes, args.runs,
+                             args.contrasts, args.zero_fraction, args.seed, args.gzip)
+    print(f"Generated {len(paths)} species folders in {args.out_dir}")
@@ -0,0 +1,372 @@
+import argparse
+import json
+import os
+import shutil
+import sqlite3
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+from loaders import Load_manifest
+from loaders import Schema_info
+from loaders import Run_genes_count_tpm_loader
+from loaders import Differential_Expression_loader
+from queries import Expression_queries
+
+# Optional dependency: pyarrow writes the Parquet and Arrow files
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+    import pyarrow.parquet as pq
+    HAVE_PYARROW = True
+except ImportError:
+    HAVE_PYARROW = False
+
+# Output formats and their file extensions:
+#   "parquet" - compressed, for analytics and long-term storage
+#   "arrow"   - uncompressed Arrow IPC files, which the reader memory-maps without copying
+FORMATS = {'parquet': '.parquet', 'arrow': '.arrow'}
+
+# The exported tables, each written as <table>/species_id=<species>/study_id=<study>/part-0<extension>
+EXPORT_TABLES = ['run_genes', 'differential_expression']
+
+# The loaders whose load_manifest records decide whether a study changed since the last export
+SOURCE_LOADERS = [Run_genes_count_tpm_loader.LOADER_NAME, Differential_Expression_loader.LOADER_NAME]
+
+# Records what was exported, per study. The leading underscore hides it from pyarrow.dataset.
+MANIFEST_FILE = '_export_manifest.json'
+
+# Partition value for studies without a study_species row, as used by Hive
+UNKNOWN_SPECIES = '__HIVE_DEFAULT_PARTITION__'
+
+def id_type():
+    # IDs are dictionary-encoded: each distinct ID is stored once per file
+    return pa.dictionary(pa.int32(), pa.string())
+
+def table_schemas():
+    """
+    Get the Arrow schema of every exported table.
+
+    Returns:
+        dict: The schema of each table in EXPORT_TABLES. The species_id and study_id
+            columns are not stored in the files, they come from the partition directories.
+    """
+    return {
+        'run_genes': pa.schema([
+            ('gene_id', id_type()),
+            ('run_id', id_type()),
+            ('count_value', pa.float64()),
+            ('tpm_value', pa.float64()),
+        ]),
+        'differential_expression': pa.schema([
+            ('gene_id', id_type()),
+            ('log2FoldChange', pa.float64()),
+            ('adj_p_value', pa.float64()),
+            ('condition_1', id_type()),
+            ('condition_2', id_type()),
+        ]),
+    }
+
+def partition_path(export_dir, table, species_id, study_id):
+    """
+    Get the directory holding one study's file of an exported table.
+
+    Args:
+        export_dir (str): The export directory.
+        table (str): The table name.
+        species_id (str): The species of the study.
+        study_id (str): The study.
+
+    Returns:
+        str: The partition directory.
+    """
+    return os.path.join(export_dir, table, f"species_id={species_id}", f"study_id={study_id}")
+
+def read_manifest(export_dir):
+    """
+    Read the export manifest of an export directory.
+
+    Args:
+        export_dir (str): The export directory.
+
+    Returns:
+        dict: The manifest, with the format and an entry per exported study, or an empty manifest.
+    """
+    path = os.path.join(export_dir, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return {'format': None, 'studies': {}}
+    with open(path) as file:
+        return json.load(file)
+
+def write_manifest(export_dir, manifest):
+    # Write to a temporary file first, so a crash never leaves a truncated manifest
+    path = os.path.join(export_dir, MANIFEST_FILE)
+    with open(path + '.tmp', 'w') as file:
+        json.dump(manifest, file, indent=2)
+    os.replace(path + '.tmp', path)
+
+def study_species(conn):
+    """
+    Map every study to the species it is partitioned under.
+
+    Args:
+        conn (Connection): The SQLite connection.
+
+    Returns:
+        dict: The species_id of each study_id, UNKNOWN_SPECIES for studies without a study_species row.
+    """
+    rows = conn.execute('''
+        SELECT s.study_id, MIN(ss.species_id)
+        FROM studies s
+        LEFT JOIN study_species ss ON ss.study_id = s.study_id
+        GROUP BY s.study_id
+    ''').fetchall()
+    return {study_id: species_id or UNKNOWN_SPECIES for study_id, species_id in rows}
+
+def study_fingerprints(conn):
+    """
+    Fingerprint every study from the load_manifest records of its expression and DE files.
+
+    A study's fingerprint changes whenever one of its files is loaded again, so it tells
+    which studies changed since the last export without reading their rows.
+
+    Args:
+        conn (Connection): The SQLite connection.
+
+    Returns:
+        dict: The fingerprint of each study with load_manifest records. Studies loaded
+            without a manifest are missing, and are always exported.
+    """
+    return Load_manifest.unit_fingerprints(conn, SOURCE_LOADERS)
+
+def read_run_genes(conn, study_id):
+    """
+    Read one study's run_genes rows, whatever the layout and expression storage of the database.
+
+    Args:
+        conn (Connection): The SQLite connection.
+        study_id (str): The study to read.
+
+    Returns:
+        DataFrame: The gene_id, run_id, count_value and tpm_value of every value of the study.
+    """
+    if Schema_info.get_expression_storage(conn) in ('packed', 'sparse'):
+        # Both matrices share the gene and run order of the study, and the zeros left out by sparse storage are filled in
+        tpm, gene_ids, run_ids = Expression_queries.read_study_matrix(conn, study_id, 'tpm', np.float64)
+        counts, _, _ = Expression_queries.read_study_matrix(conn, study_id, 'count', np.float64)
+        return pd.DataFrame({
+            'gene_id': np.repeat(np.array(gene_ids, dtype=object), len(run_ids)),
+            'run_id': np.tile(np.array(run_ids, dtype=object), len(gene_ids)),
+            'count_value': counts.ravel().astype(np.float64),
+            'tpm_value': tpm.ravel().astype(np.float64),
+        })
+
+    if Schema_info.get_layout(conn) == 'keyed':
+        query = '''
+            SELECT g.gene_id, r.run_id, rg.count_value, rg.tpm_value
+            FROM runs r
+            JOIN run_genes rg ON rg.run_key = r.run_key
+            JOIN genes g ON g.gene_key = rg.gene_key
+            WHERE r.study_id = ?
+        '''
+    else:
+        query = '''
+            SELECT rg.gene_id, rg.run_id, rg.count_value, rg.tpm_value
+            FROM runs r
+            JOIN run_genes rg ON rg.run_id = r.run_id
+            WHERE r.study_id = ?
+        '''
+    df = pd.read_sql_query(query, conn, params=(study_id,))
+    # Decode "compact" values, stored as integers
+    df['count_value'] = df['count_value'].astype(np.float64)
+    df['tpm_value'] = Schema_info.decode_tpm(df['tpm_value'].astype(np.float64).to_numpy(), Schema_info.get_tpm_scale(conn))
+    return df
+
+def read_differential_expression(conn, study_id):
+    """
+    Read one study's differential_expression rows.
+
+    Args:
+        conn (Connection): The SQLite connection.
+        study_id (str): The study to read.
+
+    Returns:
+        DataFrame: The gene_id, log2FoldChange, adj_p_value, condition_1 and condition_2 of every row of the study.
+    """
+    if Schema_info.has_column(conn, 'differential_expression', 'gene_key'):
+        query = '''
+            SELECT g.gene_id, de.log2FoldChange, de.adj_p_value, c.condition_1, c.condition_2
+            FROM contrasts c
+            JOIN differential_expression de ON de.contrast_key = c.contrast_key
+            JOIN genes g ON g.gene_key = de.gene_key
+            WHERE c.study_id = ?
+        '''
+    elif Schema_info.has_column(conn, 'differential_expression', 'contrast_key'):
+        query = '''
+            SELECT de.gene_id, de.log2FoldChange, de.adj_p_value, c.condition_1, c.condition_2
+            FROM contrasts c
+            JOIN differential_expression de ON de.contrast_key = c.contrast_key
+            WHERE c.study_id = ?
+        '''
+    else:
+        query = '''
+            SELECT gene_id, log2FoldChange, adj_p_value, condition_1, condition_2
+            FROM differential_expression
+            WHERE study_id = ?
+        '''
+    return pd.read_sql_query(query, conn, params=(study_id,))
+
+# The function reading each exported table for one study
+TABLE_READERS = {
+    'run_genes': read_run_genes,
+    'differential_expression': read_differential_expression,
+}
+
+def to_arrow(df, schema):
+    """
+    Convert a table to Arrow, dictionary-encoding its ID columns with sorted dictionaries.
+
+    Sorted dictionaries mean the dictionary indices of gene_id and run_id are the
+    row and column positions of a sorted genes x runs matrix.
+
+    Args:
+        df (DataFrame): The table, with the columns of schema.
+        schema (Schema): The Arrow schema, see table_schemas.
+
+    Returns:
+        Table: The Arrow table.
+    """
+    columns = []
+    for field in schema:
+        values = df[field.name]
+        if pa.types.is_dictionary(field.type):
+            # pandas sorts the categories it infers from strings
+            categorical = pd.Categorical(values.astype(str).where(values.notna(), None))
+            columns.append(pa.DictionaryArray.from_arrays(
+                pa.array(categorical.codes, type=pa.int32(), mask=categorical.codes < 0),
+                pa.array(list(categorical.categories), type=pa.string()),
+            ))
+        else:
+            columns.append(pa.array(values.to_numpy(dtype=np.float64), type=field.type, from_pandas=True))
+    return pa.Table.from_arrays(columns, schema=schema)
+
+def write_partition(table, path, export_format):
+    """
+    Write one study's table into its partition directory, replacing any previous file.
+
+    Args:
+        table (Table): The Arrow table.
+        path (str): The partition directory.
+        export_format (str): "parquet" or "arrow".
+
+    Returns:
+        str: The path to the written file.
+    """
+    os.makedirs(path, exist_ok=True)
+    file_path = os.path.join(path, 'part-0' + FORMATS[export_format])
+    temp_path = os.path.join(path, '.part-0.tmp')
+
+    if export_format == 'parquet':
+        pq.write_table(table, temp_path, compression='zstd')
+    else:
+        # Uncompressed, so the file can be memory-mapped and used without copying
+        feather.write_feather(table, temp_path, compression='uncompressed')
+
+    # Swap the new file in at once, so readers never see a partial file
+    os.replace(temp_path, file_path)
+    return file_path
+
+def remove_study(export_dir, species_id, study_id):
+    # Delete a study's partition of every table, e.g. when it moved to another species or was removed
+    for table in EXPORT_TABLES:
+        shutil.rmtree(partition_path(export_dir, table, species_id, study_id), ignore_errors=True)
+
+def export_database(db_path, export_dir, export_format='parquet', full=False):
+    """
+    Export the run_genes and differential_expression tables as a dataset partitioned by species and study.
+
+    Only studies whose files were loaded again since the last export into export_dir are written,
+    unless full is set or the format changed. Studies no longer in the database are removed.
+    The manifest is saved after every study, so an interrupted export resumes where it stopped.
+
+    Args:
+        db_path (str): The path to the SQLite database.
+        export_dir (str): The directory to write the dataset to.
+        export_format (str): "parquet" or "arrow", see FORMATS.
+        full (bool): Export every study, changed or not.
+
+    Returns:
+        dict: The study_ids that were exported, skipped as unchanged and removed.
+    """
+    if not HAVE_PYARROW:
+        raise ImportError("Exporting needs the pyarrow package")
+    if export_format not in FORMATS:
+        raise ValueError(f"Unknown export format: {export_format}")
+
+    os.makedirs(export_dir, exist_ok=True)
+    manifest = read_manifest(export_dir)
+    if manifest['format'] != export_format:
+        # Files of another format cannot be reused
+        full = True
+        for study_id, entry in manifest['studies'].items():
+            remove_study(export_dir, entry['species_id'], study_id)
+        manifest = {'format': export_format, 'studies': {}}
+
+    conn = sqlite3.connect(db_path)
+    summary = {'exported': [], 'skipped': [], 'removed': []}
+    schemas = table_schemas()
+
+    try:
+        species_of_study = study_species(conn)
+        fingerprints = study_fingerprints(conn)
+
+        for study_id in list(manifest['studies']):
+            if study_id not in species_of_study:
+                remove_study(export_dir, manifest['studies'].pop(study_id)['species_id'], study_id)
+                summary['removed'].append(study_id)
+
+        for study_id, species_id in sorted(species_of_study.items()):
+            fingerprint = fingerprints.get(study_id)
+            previous = manifest['studies'].get(study_id)
+            if not full and previous is not None and fingerprint is not None \
+                    and previous['fingerprint'] == fingerprint and previous['species_id'] == species_id:
+                summary['skipped'].append(study_id)
+                continue
+
+            if previous is not None and previous['species_id'] != species_id:
+                remove_study(export_dir, previous['species_id'], study_id)
+
+            rows = {}
+            for table in EXPORT_TABLES:
+                arrow_table = to_arrow(TABLE_READERS[table](conn, study_id), schemas[table])
+                write_partition(arrow_table, partition_path(export_dir, table, species_id, study_id), export_format)
+                rows[table] = arrow_table.num_rows
+
+            manifest['studies'][study_id] = {
+                'species_id': species_id,
+                'fingerprint': fingerprint,
+                'rows': rows,
+                'exported_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            }
+            write_manifest(export_dir, manifest)
+            summary['exported'].append(study_id)
+            print(f"Exported study {study_id}: {rows['run_genes']} run_genes rows, {rows['differential_expression']} differential_expression rows")
+    finally:
+        conn.close()
+
+    write_manifest(export_dir, manifest)
+    print(f"Exported {len(summary['exported'])} studies, {len(summary['skipped'])} unchanged, {len(summary['removed'])} removed.")
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export run_genes and differential_expression as a dataset partitioned by species and study.")
+    parser.add_argument("db_path", help="Path to the database.")
+    parser.add_argument("export_dir", help="Directory to write the dataset to.")
+    parser.add_argument("--format", choices=sorted(FORMATS), default="parquet",
+                        help="parquet: compressed files. arrow: uncompressed Arrow IPC files, memory-mapped without copying when read.")
+    parser.add_argument("--full", action="store_true", help="Export every study, not only those loaded again since the last export.")
+    args = parser.parse_args()
+
+    export_database(args.db_path, args.export_dir, args.format, args.full)
@@ -1,27 +1,29 @@
 import sqlite3
 
-# Connect to the SQLite database (or create it if it doesn't exist)
-conn = sqlite3.connect('database.db')
+from loaders import Finalize_database
 
-# Create a cursor object
-cursor = conn.cursor()
+# Path to the database to index. Run from the repository root: python -m extras.Adding_index2
+db_path = 'database.db'
 
-# List of SQL commands to create indexes
-index_commands = [
-    # Indexes for the species table
-    '''CREATE INDEX idx_species_name ON species (species_name);''',   
-    # Indexes for the differential_expression table
-    '''CREATE INDEX idx_gene_id ON differential_expression (gene_id);''',
-    '''CREATE INDEX idx_conditions ON differential_expression (condition_1, condition_2);''',
-    '''CREATE INDEX idx_study_id ON differential_expression (study_id);'''
+# Indexes this script created before the finalize stage existed. They duplicate idx_species_name,
+# idx_de_gene and idx_de_contrast_padj, so they are dropped.
+legacy_index_commands = [
+    '''DROP INDEX IF EXISTS idx_gene_id;''',
+    '''DROP INDEX IF EXISTS idx_conditions;''',
+    '''DROP INDEX IF EXISTS idx_study_id;'''
 ]
 
-# Execute each command in the index_commands list
-for command in index_commands:
-    cursor.execute(command)
+# Connect to the SQLite database
+conn = sqlite3.connect(db_path)
 
-# Commit the changes
-conn.commit()
+try:
+    for command in legacy_index_commands:
+        conn.execute(command)
+    conn.commit()
 
-# Close the connection
-conn.close()
+    # Populate_schema.py builds the same indexes after every load. Finalize_database defines them once,
+    # for the layout of the database (text or keyed), so running both never creates duplicates.
+    Finalize_database.build_indexes(conn)
+finally:
+    # Close the connection
+    conn.close()
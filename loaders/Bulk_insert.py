@@ -0,0 +1,50 @@
+import itertools
+
+# Number of rows sent to SQLite per executemany call
+BATCH_SIZE = 50000
+
+def batched(rows, batch_size=BATCH_SIZE):
+    """
+    Split an iterable of rows into lists of at most batch_size rows.
+
+    Args:
+        rows (Iterable[tuple]): The rows to split.
+        batch_size (int): The maximum number of rows per batch.
+
+    Returns:
+        Iterator[List[tuple]]: The batches, in order.
+    """
+    iterator = iter(rows)
+    while True:
+        batch = list(itertools.islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
+
+def insert_distinct(conn, table, columns, rows, batch_size=BATCH_SIZE):
+    """
+    Insert rows keyed on a unique column with batched INSERT OR IGNORE statements.
+
+    Rows whose key already exists in the table are left untouched, which replaces
+    a SELECT COUNT(*) probe followed by an INSERT for every row.
+
+    Args:
+        conn (Connection): The SQLite connection, committed by the caller.
+        table (str): The table to insert into.
+        columns (List[str]): The column names, in the order of the values in each row.
+        rows (List[tuple]): The rows to insert, with distinct keys.
+        batch_size (int): The number of rows per executemany call.
+
+    Returns:
+        Tuple[int, int]: The number of rows inserted and the number that already existed.
+    """
+    sql = f"INSERT OR IGNORE INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+    before = conn.total_changes
+
+    cursor = conn.cursor()
+    for batch in batched(rows, batch_size):
+        cursor.executemany(sql, batch)
+    cursor.close()
+
+    new = conn.total_changes - before
+    return new, len(rows) - new
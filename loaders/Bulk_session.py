@@ -0,0 +1,128 @@
+import os
+import sqlite3
+from contextlib import contextmanager
+
+# Journal and sync settings per session mode:
+#   "safe" - WAL journal with synchronous=NORMAL, so a crash loses at most the last transactions
+#            and never corrupts the database
+#   "fast" - in-memory rollback journal with synchronous=OFF for raw ingest speed. A crash or power
+#            loss during the load can corrupt the database, which must then be rebuilt.
+#            MEMORY is used rather than OFF because the loaders rely on ROLLBACK.
+SESSION_MODES = {
+    'safe': ['PRAGMA journal_mode = WAL', 'PRAGMA synchronous = NORMAL'],
+    'fast': ['PRAGMA journal_mode = MEMORY', 'PRAGMA synchronous = OFF'],
+}
+
+# Default page cache and memory map sizes for a session, in MB
+CACHE_SIZE_MB = 1024
+MMAP_SIZE_MB = 1024
+
+# The connection of the active bulk session, the database it belongs to, and how many
+# connect calls have not been released yet
+_session_conn = None
+_session_path = None
+_session_depth = 0
+
+def connect(db_path):
+    """
+    Connect to an SQLite database, reusing the bulk session connection when one is active for it.
+
+    Loaders call this instead of sqlite3.connect and hand the connection back with release.
+
+    Args:
+        db_path (str): The path to the SQLite database.
+
+    Returns:
+        Connection: The session connection, or a new connection.
+    """
+    global _session_depth
+
+    if _session_conn is not None and os.path.abspath(db_path) == _session_path:
+        _session_depth += 1
+        return _session_conn
+    return sqlite3.connect(db_path)
+
+def release(conn):
+    """
+    Hand back a connection obtained from connect.
+
+    A private connection is closed. The session connection stays open, but when the
+    outermost user releases it any uncommitted changes are rolled back, just as closing
+    the connection would have done. Helpers that borrow the session connection inside
+    a loader therefore never discard the loader's pending work.
+
+    Args:
+        conn (Connection): The connection to release.
+
+    Returns:
+        None
+    """
+    global _session_depth
+
+    if conn is _session_conn:
+        _session_depth -= 1
+        if _session_depth == 0:
+            conn.rollback()
+    else:
+        conn.close()
+
+def total_changes():
+    """
+    Get the number of rows changed through the bulk session connection since it opened.
+
+    Returns:
+        int: The rows inserted, updated or deleted, or None when no bulk session is active.
+    """
+    if _session_conn is None:
+        return None
+    return _session_conn.total_changes
+
+@contextmanager
+def bulk_session(db_path, mode='safe', cache_size_mb=CACHE_SIZE_MB, mmap_size_mb=MMAP_SIZE_MB):
+    """
+    Open one tuned connection that every loader shares for the duration of a load.
+
+    On exit the changes are committed, the WAL is checkpointed into the database
+    file and the journal mode the database had before the session is restored.
+
+    Args:
+        db_path (str): The path to the SQLite database.
+        mode (str): "safe" or "fast", see SESSION_MODES.
+        cache_size_mb (int): The page cache size in MB.
+        mmap_size_mb (int): The memory map size in MB.
+
+    Yields:
+        Connection: The session connection.
+    """
+    global _session_conn, _session_path, _session_depth
+
+    if mode not in SESSION_MODES:
+        raise ValueError(f"Unknown session mode: {mode}")
+    if _session_conn is not None:
+        raise RuntimeError("A bulk session is already active")
+
+    conn = sqlite3.connect(db_path)
+    original_journal_mode = conn.execute("PRAGMA journal_mode").fetchone()[0]
+
+    for pragma in SESSION_MODES[mode]:
+        conn.execute(pragma)
+    # A negative cache_size is in KiB rather than pages
+    conn.execute(f"PRAGMA cache_size = {-cache_size_mb * 1024}")
+    conn.execute(f"PRAGMA mmap_size = {mmap_size_mb * 1024 * 1024}")
+    conn.execute("PRAGMA temp_store = MEMORY")
+
+    _session_conn, _session_path, _session_depth = conn, os.path.abspath(db_path), 0
+    try:
+        yield conn
+        conn.commit()
+    finally:
+        _session_conn, _session_path = None, None
+        try:
+            conn.rollback()
+            # Fold the WAL back into the database file and restore the durable settings
+            if mode == 'safe':
+                conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            conn.execute(f"PRAGMA journal_mode = {original_journal_mode}")
+            conn.execute("PRAGMA synchronous = FULL")
+        finally:
+            conn.close()
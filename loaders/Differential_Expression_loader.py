@@ -1,141 +1,252 @@
+import contextlib
 from pathlib import Path
+import numpy as np
 import pandas as pd
-import sqlite3
 import os
+import time
 
-def split_dataframe(df_de, group_size=2):
+from loaders import Bulk_session
+from loaders import Directory_catalog
+from loaders import Ingest_pipeline
+from loaders import Load_manifest
+from loaders import Schema_info
+from loaders import Tsv_reader
+
+# Name under which this loader records its source files in the load_manifest table
+LOADER_NAME = 'differential_expression'
+
+def reshape_contrasts(df_de):
     """
-    Split the DataFrame into smaller DataFrames based on column groups.
+    Reshape a wide DE table into one row per gene and contrast.
+
+    The columns come in pairs, log2 fold change then adjusted p-value, each pair named
+    "<condition_1> vs <condition_2>". The contrast names are split into a MultiIndex once,
+    and each measure is taken from every pair as one NumPy block and flattened row-major,
+    so the rows come out grouped by gene in file order without copying per contrast or sorting.
 
     Args:
-        df_de (DataFrame): The DataFrame to split.
-        group_size (int): The number of columns per split DataFrame.
+        df_de (DataFrame): The DE table, indexed by gene_id.
 
     Returns:
-        List[Tuple[str, DataFrame]]: A list of tuples, each containing the name and DataFrame.
+        DataFrame: The gene_id, log2FoldChange, adj_p_value, condition_1 and condition_2 columns.
     """
-    df_names = []
-    cols = df_de.columns
+    if len(df_de.columns) % 2:
+        print(f"Ignoring unpaired column '{df_de.columns[-1]}'")
+    pair_starts = np.arange(0, len(df_de.columns) - 1, 2)
 
-    for i in range(0, len(cols), group_size):
-        group_cols = cols[i:i + group_size]
-        new_df = df_de[group_cols].copy()  # Create a copy of the DataFrame for safe manipulation**
-        new_df.reset_index(inplace=True)   # Turn the index into a column**
-        df_name = f'df_de{i // group_size + 1}'
-        df_names.append((df_name, new_df))
-    
-    return df_names
+    # Split the name of the first column of each pair into its two conditions
+    names = pd.Series(df_de.columns[pair_starts], dtype=object)
+    parts = names.str.split(' vs ', regex=False)
+    valid = (parts.str.len() == 2).to_numpy()
+    for column_name in names[~valid]:
+        print(f"Column name '{column_name}' does not contain ' vs '")
+
+    contrasts = pd.MultiIndex.from_tuples(parts[valid].map(tuple).tolist(), names=['condition_1', 'condition_2'])
+    pair_starts = pair_starts[valid]
 
+    # genes x contrasts blocks, flattened so each gene's contrasts are adjacent
+    fold_changes = df_de.iloc[:, pair_starts].to_numpy()
+    p_values = df_de.iloc[:, pair_starts + 1].to_numpy()
+    n_genes, n_contrasts = fold_changes.shape
 
-def load_de_data(subdirectory_path):
+    return pd.DataFrame({
+        df_de.index.name: np.repeat(df_de.index.to_numpy(), n_contrasts),
+        'log2FoldChange': fold_changes.ravel(),
+        'adj_p_value': p_values.ravel(),
+        'condition_1': np.tile(contrasts.get_level_values('condition_1').to_numpy(), n_genes),
+        'condition_2': np.tile(contrasts.get_level_values('condition_2').to_numpy(), n_genes),
+    })
+
+
+def load_de_data(subdirectory_path, files=None):
     """
     Load DE data from a subdirectory.
 
     Args:
         subdirectory_path (Path): The path to the subdirectory.
+        files (dict, optional): The files of the subdirectory by type, from Directory_catalog. Scanned when omitted.
 
     Returns:
         DataFrame: The loaded and processed DE data, or None if the data could not be loaded.
     """
-    # Suppress SettingWithCopyWarning
-    pd.options.mode.chained_assignment = None  # default='warn'
-    
     all_dfs = []
     
-    # Find all files that match the pattern '*de.*.tsv'
-    files_to_find_de = list(Path(subdirectory_path).rglob('*de.*.tsv'))
+    # Take all files that match the pattern '*de.*.tsv' from the catalog
+    files = files or Directory_catalog.scan_study(subdirectory_path)
+    files_to_find_de = files['de']
     
     for file_path in files_to_find_de:
-        dfs_to_concat = []
-
         print(f"Processing file: {file_path}")
+        start_time = time.perf_counter()
 
-        # Find the row containing "gene_id" and record its index
-        with open(file_path, 'r') as file:
-            for i, line in enumerate(file):
-                if "gene_id" in line:
-                    print(f"Found 'gene_id' in file {file_path} at row {i}")
-                    # Read the file starting from the row with "gene_id"
-                    df_from_tsv = pd.read_csv(file_path, sep='\t', index_col=0, skiprows=i)
-
-                    split_dfs = split_dataframe(df_from_tsv, group_size=2)
-
-                    # Process each split DataFrame
-                    for name, df_temp in split_dfs:
-                        if df_temp.empty:
-                            print(f"Skipping empty DataFrame: {name}")
-                            continue
-                        # Retrieve the name of the first column from the current split DataFrame
-                        column_name = df_temp.columns[1]
-                        # Split the column name into two variables based on " vs "
-                        try:
-                            condition_1, condition_2 = column_name.split(' vs ')
-                        except ValueError:
-                            print(f"Column name '{column_name}' does not contain ' vs '")
-                            continue
-                        # Add new columns 'condition_1' and 'condition_2' to the current split DataFrame
-                        df_temp['condition_1'] = condition_1
-                        df_temp['condition_2'] = condition_2
-                        # Rename columns for clarity
-                        df_temp.rename(columns={
-                            df_temp.columns[1]: 'log2FoldChange',
-                            df_temp.columns[2]: 'adj_p_value'
-                        }, inplace=True)
-                        # Append the DataFrame to the list
-                        dfs_to_concat.append(df_temp)
-        
-        # Check if dfs_to_concat is empty before concatenation
-        if not dfs_to_concat:
+        # Read the file starting from the row with "gene_id"
+        df_from_tsv = Tsv_reader.read_tsv(file_path)
+        long_df = reshape_contrasts(df_from_tsv)
+
+        # Check if any contrast produced rows
+        if long_df.empty:
             print(f"No DataFrames to concatenate for file {file_path}")
             continue
 
-        # Concatenate the DataFrames for the current file
-        combined_df = pd.concat(dfs_to_concat)
-        # Sort the DataFrame by index 
-        sorted_df = combined_df.sort_index()
         # Add a column for the study_id
-        sorted_df['study_id'] = os.path.basename(os.path.dirname(file_path))
-        # Append the sorted DataFrame to the list
-        all_dfs.append(sorted_df)
-        print(f"Concatenated DataFrame for file {file_path} added to all_dfs")
+        long_df['study_id'] = os.path.basename(os.path.dirname(file_path))
+        # Append the DataFrame to the list
+        all_dfs.append(long_df)
+
+        elapsed = time.perf_counter() - start_time
+        rate = len(long_df) / elapsed if elapsed > 0 else float('inf')
+        print(f"Parsed {len(long_df)} rows from {file_path.name} in {elapsed:.3f}s ({rate:,.0f} rows/s)")
     return all_dfs
     
 
 
-def insert_data_to_database(all_dfs, db_path):
+CONTRAST_COLUMNS = ['study_id', 'condition_1', 'condition_2']
+
+def register_contrasts(conn, df):
+    """
+    Add the contrasts of a DE DataFrame to the contrasts table and look up their keys.
+
+    Args:
+        conn (Connection): The SQLite connection.
+        df (DataFrame): DE rows with study_id, condition_1 and condition_2 columns.
+
+    Returns:
+        Series: The contrast_key of each row, aligned with df.
+    """
+    df_contrasts = df[CONTRAST_COLUMNS].drop_duplicates()
+    conn.executemany(
+        "INSERT OR IGNORE INTO contrasts (study_id, condition_1, condition_2) VALUES (?, ?, ?)",
+        df_contrasts.itertuples(index=False, name=None)
+    )
+
+    placeholders = ', '.join('?' * df_contrasts['study_id'].nunique())
+    df_keys = pd.read_sql_query(
+        f"SELECT contrast_key, study_id, condition_1, condition_2 FROM contrasts WHERE study_id IN ({placeholders})",
+        conn, params=list(df_contrasts['study_id'].unique())
+    )
+    return df[CONTRAST_COLUMNS].merge(df_keys, how='left', on=CONTRAST_COLUMNS)['contrast_key'].set_axis(df.index)
+
+def delete_study(conn, study_id, keyed):
+    """
+    Delete the DE rows of a study, before it is loaded again.
+
+    The rows are found through the study's contrasts, or through the contrast index, which starts
+    with study_id, in databases whose DE rows hold their study as text.
+    The contrasts themselves are kept, so a reloaded contrast keeps its key.
+
+    Args:
+        conn (Connection): The SQLite connection.
+        study_id (str): The study.
+        keyed (bool): Whether DE rows refer to their contrast by contrast_key.
+
+    Returns:
+        None
+    """
+    if keyed:
+        conn.execute('''
+            DELETE FROM differential_expression
+            WHERE contrast_key IN (SELECT contrast_key FROM contrasts WHERE study_id = ?)
+        ''', (study_id,))
+    else:
+        conn.execute("DELETE FROM differential_expression WHERE study_id = ?", (study_id,))
+
+def prune_contrasts(conn, study_id, keep):
+    """
+    Delete the contrasts of a reloaded study that are no longer in its DE files.
+
+    Args:
+        conn (Connection): The SQLite connection.
+        study_id (str): The study.
+        keep (Set[int]): The contrast_keys of the study's new DE rows.
+
+    Returns:
+        None
+    """
+    stale = [key for (key,) in conn.execute("SELECT contrast_key FROM contrasts WHERE study_id = ?", (study_id,))
+             if key not in keep]
+    conn.executemany("DELETE FROM contrasts WHERE contrast_key = ?", ((key,) for key in stale))
+
+def insert_data_to_database(all_dfs, db_path, replace_study=None):
     """
     Insert the data from a list of DataFrames into an SQLite database.
 
+    Every contrast is recorded once in the contrasts table and the DE rows refer to it by contrast_key.
+    In the "keyed" layout the DE rows also refer to their gene by gene_key, and are inserted in primary key order.
+
     Args:
         df_combined (List[DataFrame]): The list of DataFrames containing the data to be inserted.
         db_path (str): The path to the SQLite database.
+        replace_study (str, optional): A study whose existing rows are deleted before inserting.
 
     Returns:
         None
     """
     if all_dfs:
         # Connect to the SQLite database
-        conn = sqlite3.connect(db_path)
-        
-        # Iterate through each DataFrame in the list
-        for x in all_dfs:
-            # Insert the data into the SQLite database
-            x.to_sql('differential_expression', conn, if_exists='append', index=False)
-        
-        # Commit the changes
-        conn.commit()
-        # Close the connection
-        conn.close()
+        conn = Bulk_session.connect(db_path)
+
+        try:
+            # Databases created before the contrasts table existed hold neither contrasts nor keyed DE rows,
+            # and older text databases hold contrasts but DE rows with their study and conditions as text
+            has_contrasts = Schema_info.has_table(conn, 'contrasts')
+            keyed = Schema_info.has_column(conn, 'differential_expression', 'contrast_key')
+            gene_keyed = Schema_info.has_column(conn, 'differential_expression', 'gene_key')
+
+            if replace_study:
+                delete_study(conn, replace_study, keyed)
+
+            gene_keys, registered = {}, set()
+            # Iterate through each DataFrame in the list
+            for x in all_dfs:
+                contrast_keys = None
+                if has_contrasts:
+                    contrast_keys = register_contrasts(conn, x)
+                    registered.update(contrast_keys.unique())
+
+                if gene_keyed:
+                    df_keyed = pd.DataFrame({
+                        'contrast_key': contrast_keys,
+                        'gene_key': Schema_info.translate_ids(conn, gene_keys, 'genes', 'gene_id', 'gene_key', x['gene_id']),
+                        'log2FoldChange': x['log2FoldChange'],
+                        'adj_p_value': x['adj_p_value'],
+                    }).sort_values(['contrast_key', 'gene_key'], kind='stable')
+                    # A gene listed twice for a contrast keeps its last row, like run_genes in this layout
+                    conn.executemany('''
+                        INSERT OR REPLACE INTO differential_expression (contrast_key, gene_key, log2FoldChange, adj_p_value)
+                        VALUES (?, ?, ?, ?)
+                    ''', df_keyed.itertuples(index=False, name=None))
+                elif keyed:
+                    # The "text" layout keeps the gene_id, while the study and conditions are in contrasts
+                    pd.DataFrame({
+                        'contrast_key': contrast_keys,
+                        'gene_id': x['gene_id'],
+                        'log2FoldChange': x['log2FoldChange'],
+                        'adj_p_value': x['adj_p_value'],
+                    }).to_sql('differential_expression', conn, if_exists='append', index=False)
+                else:
+                    # Insert the data into the SQLite database
+                    x.to_sql('differential_expression', conn, if_exists='append', index=False)
+
+            if replace_study and has_contrasts:
+                prune_contrasts(conn, replace_study, registered)
+
+            # Commit the changes
+            conn.commit()
+        finally:
+            # Close the connection
+            Bulk_session.release(conn)
     else:
         print("No data to insert into the database.")
 
-def process_subdirectory(subdirectory_path, db_path):
+def process_subdirectory(subdirectory_path, db_path, replace=False, files=None):
     """
     Process a subdirectory using two processing functions.
 
     Args:
         subdirectory_path (Path): The path to the subdirectory.
         db_path (str): The path to the SQLite database.
+        replace (bool): Delete the rows already loaded for this study first.
+        files (dict, optional): The files of the subdirectory by type, from Directory_catalog. Scanned when omitted.
 
     Returns:
         None
@@ -143,23 +254,78 @@ def process_subdirectory(subdirectory_path, db_path):
     print(f"Processing subdirectory: {subdirectory_path}")
     
     # Load de data
-    all_dfs = load_de_data(subdirectory_path)
+    all_dfs = load_de_data(subdirectory_path, files)
     
     # Insert data into database
-    insert_data_to_database(all_dfs, db_path)
+    insert_data_to_database(all_dfs, db_path, Path(subdirectory_path).name if replace else None)
+
+def source_files(subdirectory_path, files=None):
+    """
+    Find the files this loader reads from a subdirectory.
+
+    Args:
+        subdirectory_path (Path): The path to the subdirectory.
+        files (dict, optional): The files of the subdirectory by type, from Directory_catalog. Scanned when omitted.
+
+    Returns:
+        List[Path]: The *de.*.tsv files.
+    """
+    files = files or Directory_catalog.scan_study(subdirectory_path)
+    return list(files['de'])
 
-def process_folders_in_directory(species_path, db_path):
+def process_folders_in_directory(species_path, db_path, parsed_folders=None, catalog=None):
     """
     Opens each folder in the specified directory and applies two processing functions to the subdirectories.
 
+    Subdirectories whose files are unchanged since they were last fully loaded are skipped,
+    and subdirectories loaded before (even partially) have their rows replaced, using the load_manifest table.
+    The next subdirectories are parsed in a background thread while the current one is written, see Ingest_pipeline.
+
     Args:
         species_path (str): The path to the main directory containing subdirectories.
         db_path (str): The path to the SQLite database.
+        parsed_folders (dict, optional): Output of load_folders_in_directory for species_path.
+            Subdirectories found in it are inserted as-is instead of being read again.
+        catalog (dict, optional): The output of Directory_catalog.scan_species for species_path. Scanned when omitted.
 
     Returns:
         None
     """
+    catalog = catalog or Directory_catalog.scan_species(species_path)
+    studies = Ingest_pipeline.begin_studies(db_path, LOADER_NAME, catalog, source_files)
+
+    def parse(unit):
+        study, _ = unit
+        if parsed_folders is not None and study['path'].name in parsed_folders:
+            return parsed_folders[study['path'].name]
+        return load_de_data(study['path'], study['files'])
+
+    # Iterate through each subdirectory in the main directory, parsed ahead of the writer
+    with contextlib.closing(Ingest_pipeline.parse_ahead(studies, parse)) as parsed_studies:
+        for (study, replace), all_dfs in parsed_studies:
+            subdirectory = study['path']
+            print(f"Processing subdirectory: {subdirectory}")
+            insert_data_to_database(all_dfs, db_path, subdirectory.name if replace else None)
+            Load_manifest.complete(db_path, LOADER_NAME, subdirectory.name)
+
+def load_folders_in_directory(species_path, skip=(), catalog=None):
+    """
+    Load DE data from each subdirectory without writing to the database.
+
+    Args:
+        species_path (str): The path to the main directory containing subdirectories.
+        skip (Iterable[str]): Names of subdirectories not to load, e.g. ones unchanged since the last load.
+        catalog (dict, optional): The output of Directory_catalog.scan_species for species_path. Scanned when omitted.
+
+    Returns:
+        dict: The DE DataFrames for each subdirectory, keyed by subdirectory name.
+    """
+    catalog = catalog or Directory_catalog.scan_species(species_path)
+    parsed_folders = {}
     # Iterate through each subdirectory in the main directory
-    for subdirectory in Path(species_path).iterdir():
-        if subdirectory.is_dir():
-            process_subdirectory(subdirectory, db_path)
+    for name, study in catalog['studies'].items():
+        if name not in skip:
+            print(f"Processing subdirectory: {study['path']}")
+            parsed_folders[name] = load_de_data(study['path'], study['files'])
+
+    return parsed_folders
@@ -0,0 +1,167 @@
+import fnmatch
+import os
+from pathlib import Path
+
+# File name patterns of each file type in a study folder. A file is listed under every type it matches.
+FILE_TYPES = {
+    'counts': '*counts_per_run.tsv',
+    'tpm': '*tpm_per_run.tsv',
+    'metadata': '*metadata_per_run.tsv',
+    'de': '*de.*.tsv',
+}
+
+# Suffixes of gzip (or bgzip) compressed files. A compressed file is classified by its name without
+# the suffix, e.g. SRP1.tpm_per_run.tsv.gz as "tpm", and Tsv_reader decompresses it as it is parsed.
+COMPRESSED_SUFFIXES = ('.gz', '.bgz')
+
+def uncompressed_name(name):
+    """
+    Get a file name without its compression suffix.
+
+    Args:
+        name (str): The file name.
+
+    Returns:
+        str: The name without a suffix in COMPRESSED_SUFFIXES.
+    """
+    for suffix in COMPRESSED_SUFFIXES:
+        if name.endswith(suffix):
+            return name[:-len(suffix)]
+    return name
+
+def classify(path, files):
+    """
+    Add a file to the lists of every file type its name matches.
+
+    Args:
+        path (Path): The path to the file.
+        files (dict): Lists of paths by file type, updated in place.
+
+    Returns:
+        None
+    """
+    name = uncompressed_name(path.name)
+    for file_type, pattern in FILE_TYPES.items():
+        if fnmatch.fnmatchcase(name, pattern):
+            files[file_type].append(path)
+
+def drop_compressed_copies(files):
+    """
+    Drop compressed files that sit next to their uncompressed copy, so each file is loaded once.
+
+    Args:
+        files (dict): Lists of paths by file type, updated in place.
+
+    Returns:
+        dict: files.
+    """
+    for file_type, paths in files.items():
+        uncompressed = {str(path) for path in paths}
+        files[file_type] = [
+            path for path in paths
+            if path.name == uncompressed_name(path.name) or str(path.with_name(uncompressed_name(path.name))) not in uncompressed
+        ]
+    return files
+
+def walk_files(directory):
+    """
+    List every file below a directory with os.scandir, which gets the file type from the
+    directory listing itself instead of a stat call per entry.
+
+    Args:
+        directory (str): The directory to walk.
+
+    Yields:
+        Path: The path to each file, depth first.
+    """
+    with os.scandir(directory) as entries:
+        entries = list(entries)
+    for entry in entries:
+        if entry.is_dir():
+            yield from walk_files(entry.path)
+        elif entry.is_file():
+            yield Path(entry.path)
+
+def scan_study(study_path):
+    """
+    Classify the files of one study folder by type.
+
+    Args:
+        study_path (Path): The path to the study folder.
+
+    Returns:
+        dict: The paths of each file type in FILE_TYPES, in directory order.
+    """
+    files = {file_type: [] for file_type in FILE_TYPES}
+    for path in walk_files(study_path):
+        classify(path, files)
+    return drop_compressed_copies(files)
+
+def scan_species(species_path):
+    """
+    Scan a species folder once and classify its files by study and type.
+
+    Every folder in the species folder is a study. The loaders take their files from
+    the catalog instead of searching the file system again.
+
+    Args:
+        species_path (str): The path to the species folder.
+
+    Returns:
+        dict: The catalog, with:
+            "path": the species folder,
+            "studies_json": the path to <species_name>.studies.json (or .studies.json.gz), or None if it does not exist,
+            "studies": for each study folder name, its "path" and its "files" by type (see scan_study),
+            "files": the files of each type directly in the species folder.
+    """
+    species_name = os.path.basename(species_path).rsplit('_', 1)[0]
+    catalog = {
+        'path': species_path,
+        'studies_json': None,
+        'studies': {},
+        'files': {file_type: [] for file_type in FILE_TYPES},
+    }
+
+    with os.scandir(species_path) as entries:
+        entries = list(entries)
+    for entry in entries:
+        if entry.is_dir():
+            catalog['studies'][entry.name] = {'path': Path(entry.path), 'files': scan_study(entry.path)}
+        elif entry.is_file():
+            # An uncompressed studies.json is used over a compressed copy
+            if uncompressed_name(entry.name) == species_name + '.studies.json':
+                if catalog['studies_json'] is None or entry.name == species_name + '.studies.json':
+                    catalog['studies_json'] = entry.path
+            classify(Path(entry.path), catalog['files'])
+
+    drop_compressed_copies(catalog['files'])
+    return catalog
+
+def species_files(catalog, file_type):
+    """
+    List the files of one type across a whole species folder.
+
+    Args:
+        catalog (dict): The output of scan_species.
+        file_type (str): A key of FILE_TYPES.
+
+    Returns:
+        List[Path]: The files in the species folder itself, then those of each study.
+    """
+    paths = list(catalog['files'][file_type])
+    for study in catalog['studies'].values():
+        paths.extend(study['files'][file_type])
+    return paths
+
+def first_file(files, file_type):
+    """
+    Get the first file of a type in a study.
+
+    Args:
+        files (dict): The files of a study by type, see scan_study.
+        file_type (str): A key of FILE_TYPES.
+
+    Returns:
+        Path: The first file of that type, or None if there is none.
+    """
+    return next(iter(files[file_type]), None)
@@ -0,0 +1,130 @@
+from loaders import Bulk_session
+from loaders import Schema_info
+
+# Indexes for the hot lookup paths shared by both schema layouts.
+# They are built once after the bulk load rather than maintained row by row while loading,
+# and IF NOT EXISTS makes the stage safe to run again after every load.
+index_commands = [
+    '''CREATE INDEX IF NOT EXISTS idx_species_name ON species (species_name)''',
+    '''CREATE INDEX IF NOT EXISTS idx_study_species_study ON study_species (study_id, species_id)''',
+    '''CREATE INDEX IF NOT EXISTS idx_study_species_species ON study_species (species_id, study_id)''',
+    '''CREATE INDEX IF NOT EXISTS idx_genes_species ON genes (species_id)''',
+    '''CREATE INDEX IF NOT EXISTS idx_runs_study ON runs (study_id, condition)''',
+]
+
+# Indexes for differential_expression rows keyed by contrast_key and holding their gene_id as text ("text" layout).
+# The contrast index is ordered by adjusted p-value within a contrast and covers the result columns,
+# so the top genes of a contrast are read in order from the index alone, without a sort.
+text_de_index_commands = [
+    '''CREATE INDEX IF NOT EXISTS idx_de_contrast_padj ON differential_expression
+       (contrast_key, adj_p_value, log2FoldChange, gene_id)''',
+    '''CREATE INDEX IF NOT EXISTS idx_de_gene ON differential_expression (gene_id)''',
+]
+
+# The same indexes for databases created before DE rows had a contrast_key, which hold their study and conditions as text
+legacy_de_index_commands = [
+    '''CREATE INDEX IF NOT EXISTS idx_de_contrast_padj ON differential_expression
+       (study_id, condition_1, condition_2, adj_p_value, log2FoldChange, gene_id)''',
+    '''CREATE INDEX IF NOT EXISTS idx_de_gene ON differential_expression (gene_id)''',
+]
+
+# Indexes for differential_expression rows keyed by contrast_key and gene_key ("keyed" layout).
+# The table is clustered by contrast and gene; the same covering index gives the top genes of a contrast.
+keyed_de_index_commands = [
+    '''CREATE INDEX IF NOT EXISTS idx_de_contrast_padj ON differential_expression
+       (contrast_key, adj_p_value, log2FoldChange, gene_key)''',
+    '''CREATE INDEX IF NOT EXISTS idx_de_gene ON differential_expression (gene_key)''',
+]
+
+# Indexes for run_genes in the "text" layout. The by-gene index covers the value columns,
+# so per-gene lookups never touch the table itself.
+text_index_commands = [
+    '''CREATE INDEX IF NOT EXISTS idx_run_genes_gene ON run_genes (gene_id, run_id, count_value, tpm_value)''',
+    '''CREATE INDEX IF NOT EXISTS idx_run_genes_run ON run_genes (run_id)''',
+]
+
+# Indexes for run_genes in the "keyed" layout. The table is already clustered by gene,
+# so only the by-run path needs an index.
+keyed_index_commands = [
+    '''CREATE INDEX IF NOT EXISTS idx_run_genes_run ON run_genes (run_key)''',
+]
+
+# Index for finding runs by a metadata value. The table is clustered by run, and a WITHOUT ROWID
+# index carries the run column too, so "key = ? AND value = ?" lookups are covered by the index alone.
+run_metadata_index_commands = [
+    '''CREATE INDEX IF NOT EXISTS idx_run_metadata_key_value ON run_metadata (key, value)''',
+]
+
+# Index for the stats of a gene across studies. Stats for a gene in one study are a seek on the primary key.
+gene_condition_stats_index_commands = [
+    '''CREATE INDEX IF NOT EXISTS idx_gene_condition_stats_gene ON gene_condition_stats (gene_id)''',
+]
+
+# Index for finding the studies of a gene with "packed" or "sparse" expression storage
+study_genes_index_commands = [
+    '''CREATE INDEX IF NOT EXISTS idx_study_genes_gene ON study_genes (gene_id, study_id)''',
+]
+
+def build_indexes(conn):
+    """
+    Build the indexes for the layout of the database, skipping any that already exist.
+
+    Args:
+        conn (Connection): The SQLite connection.
+
+    Returns:
+        None
+    """
+    commands = index_commands
+    if Schema_info.get_layout(conn) == 'keyed':
+        commands = commands + keyed_index_commands
+    else:
+        commands = commands + text_index_commands
+    # Databases created before DE rows had a contrast_key store their study and conditions as text
+    if Schema_info.has_column(conn, 'differential_expression', 'gene_key'):
+        commands = commands + keyed_de_index_commands
+    elif Schema_info.has_column(conn, 'differential_expression', 'contrast_key'):
+        commands = commands + text_de_index_commands
+    else:
+        commands = commands + legacy_de_index_commands
+    # Databases created before run_metadata existed do not have the table
+    if Schema_info.has_table(conn, 'run_metadata'):
+        commands = commands + run_metadata_index_commands
+    if Schema_info.has_table(conn, 'gene_condition_stats'):
+        commands = commands + gene_condition_stats_index_commands
+    if Schema_info.has_table(conn, 'study_genes'):
+        commands = commands + study_genes_index_commands
+
+    for command in commands:
+        conn.execute(command)
+    conn.commit()
+
+def finalize_database(db_path, vacuum=False):
+    """
+    Finish a load by building the indexes, refreshing the query planner statistics
+    with ANALYZE and optionally compacting the file with VACUUM.
+
+    Args:
+        db_path (str): The path to the SQLite database.
+        vacuum (bool): Whether to VACUUM the database, which rewrites the whole file.
+
+    Returns:
+        None
+    """
+    # Connect to the SQLite database
+    conn = Bulk_session.connect(db_path)
+
+    try:
+        print("     Building indexes...")
+        build_indexes(conn)
+
+        print("     Analyzing tables...")
+        conn.execute("ANALYZE")
+        conn.commit()
+
+        if vacuum:
+            print("     Vacuuming database...")
+            conn.execute("VACUUM")
+    finally:
+        # Close the connection
+        Bulk_session.release(conn)
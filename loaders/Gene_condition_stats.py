@@ -0,0 +1,190 @@
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from loaders import Bulk_session
+from loaders import Schema_info
+from loaders import Study_matrix
+
+# A run expresses a gene when its TPM is at least this value
+EXPRESSED_TPM = 1.0
+
+# The columns of gene_condition_stats after study_id, gene_id and condition
+STAT_COLUMNS = ['n_runs', 'mean_tpm', 'median_tpm', 'sd_tpm', 'min_tpm', 'max_tpm', 'fraction_expressed']
+
+def condition_stats(matrix, gene_ids, run_conditions):
+    """
+    Summarize the TPM of every gene over the runs of each condition.
+
+    Every statistic is computed for all genes of a condition at once, along the run axis.
+    Missing values (NaN) are left out, and a gene without values in a condition gets no row.
+
+    Args:
+        matrix (ndarray): The genes x runs TPM matrix of a study.
+        gene_ids (List[str]): The gene_id of each matrix row.
+        run_conditions (List[str]): The condition of each matrix column, None for runs without one.
+
+    Returns:
+        DataFrame: One row per gene and condition, with gene_id, condition and STAT_COLUMNS.
+    """
+    gene_ids = np.asarray(gene_ids, dtype=object)
+    run_conditions = np.asarray(run_conditions, dtype=object)
+    frames = []
+
+    for condition in sorted({condition for condition in run_conditions if condition is not None}):
+        block = matrix[:, run_conditions == condition].astype(np.float64, copy=False)
+        n_runs = np.count_nonzero(~np.isnan(block), axis=1)
+
+        # All-NaN genes give NaN with a warning; their rows are dropped below
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            stats = {
+                'mean_tpm': np.nanmean(block, axis=1),
+                'median_tpm': np.nanmedian(block, axis=1),
+                'sd_tpm': np.nanstd(block, axis=1, ddof=1),
+                'min_tpm': np.nanmin(block, axis=1),
+                'max_tpm': np.nanmax(block, axis=1),
+                'fraction_expressed': np.count_nonzero(block >= EXPRESSED_TPM, axis=1) / n_runs,
+            }
+
+        frame = pd.DataFrame({'gene_id': gene_ids, 'condition': condition, 'n_runs': n_runs, **stats})
+        frames.append(frame[n_runs > 0])
+
+    if not frames:
+        return pd.DataFrame(columns=['gene_id', 'condition'] + STAT_COLUMNS)
+    return pd.concat(frames, ignore_index=True)
+
+def start_study(conn, study_id):
+    """
+    Delete the gene_condition_stats rows of a study whose expression data is about to be written.
+
+    The loaders call this, then add_rows or add_matrix, in the transaction that writes the study,
+    so the stats are built from the values in memory and the study is not read back.
+
+    Args:
+        conn (Connection): The SQLite connection, committed by the caller.
+        study_id (str): The study.
+
+    Returns:
+        dict: The condition of each run of the study, passed on to add_rows and add_matrix.
+            None if there is no study_id or the database was created before gene_condition_stats
+            existed, and the stats are left out.
+    """
+    if study_id is None or not Schema_info.has_table(conn, 'gene_condition_stats'):
+        return None
+
+    conn.execute("DELETE FROM gene_condition_stats WHERE study_id = ?", (study_id,))
+    return dict(conn.execute("SELECT run_id, condition FROM runs WHERE study_id = ?", (study_id,)))
+
+def add_matrix(conn, study_id, matrix, gene_ids, run_ids, conditions):
+    """
+    Summarize the TPM values of some genes of a study and insert their gene_condition_stats rows.
+
+    Args:
+        conn (Connection): The SQLite connection, committed by the caller.
+        study_id (str): The study.
+        matrix (ndarray): The genes x runs TPM matrix of the genes, with every run of the study.
+        gene_ids (List[str]): The gene_id of each matrix row.
+        run_ids (List[str]): The run_id of each matrix column.
+        conditions (dict): The output of start_study. Nothing is inserted when it is None.
+
+    Returns:
+        int: The number of rows inserted.
+    """
+    if conditions is None:
+        return 0
+
+    df_stats = condition_stats(matrix, gene_ids, [conditions.get(run_id) for run_id in run_ids])
+    # NULL rather than NaN, e.g. for the standard deviation of a single run
+    rows = df_stats.astype(object).where(df_stats.notna(), None).itertuples(index=False, name=None)
+    conn.executemany(f'''
+        INSERT INTO gene_condition_stats (study_id, gene_id, condition, {', '.join(STAT_COLUMNS)})
+        VALUES (?, {', '.join('?' for _ in range(len(STAT_COLUMNS) + 2))})
+    ''', ((study_id, *row) for row in rows))
+    return len(df_stats)
+
+def add_rows(conn, study_id, df, conditions, tpm_scale=None):
+    """
+    Summarize long-format rows holding every run of their genes, see add_matrix.
+
+    A streamed batch or a whole study both qualify, since genes are summarized independently.
+
+    Args:
+        conn (Connection): The SQLite connection, committed by the caller.
+        study_id (str): The study.
+        df (DataFrame): The rows, with gene_id, run_id and tpm_value columns.
+        conditions (dict): The output of start_study. Nothing is inserted when it is None.
+        tpm_scale (int, optional): Round the TPM values as the "compact" value encoding stores them,
+            so the stats match the ones refresh_study computes from the stored values.
+
+    Returns:
+        int: The number of rows inserted.
+    """
+    if conditions is None:
+        return 0
+
+    tpm = Schema_info.decode_tpm(Schema_info.encode_tpm(df['tpm_value'].to_numpy(), tpm_scale), tpm_scale)
+    # A gene listed twice keeps its last values, like the keyed layout stores it
+    df = df.assign(tpm_value=tpm).drop_duplicates(['gene_id', 'run_id'], keep='last')
+    df_wide = df.pivot(index='gene_id', columns='run_id', values='tpm_value')
+    return add_matrix(conn, study_id, df_wide.to_numpy(dtype=np.float64), list(df_wide.index), list(df_wide.columns), conditions)
+
+def report_study(study_id, n_rows):
+    # Print how many stats rows a study got
+    print(f"Summarized {n_rows} gene x condition rows for study {study_id}.")
+
+def refresh_study(db_path, study_id, chunk_size=None):
+    """
+    Recompute the gene_condition_stats rows of one study from its stored TPM values.
+
+    Used when the run conditions change without the expression data being reloaded, e.g. after
+    an edit to studies.json. The study is read in slices of genes with Study_matrix.iter_study_matrix,
+    so the memory used is bounded by chunk_size and not by the size of the study.
+    The study's previous rows are replaced in one transaction.
+    Databases created before gene_condition_stats existed are left unchanged.
+
+    Args:
+        db_path (str): The path to the SQLite database.
+        study_id (str): The study to summarize.
+        chunk_size (int, optional): The number of gene x run values read at a time, Study_matrix.SLICE_SIZE by default.
+
+    Returns:
+        int: The number of rows written.
+    """
+    # Connect to the SQLite database
+    conn = Bulk_session.connect(db_path)
+
+    # The slices are read in gene order, which SQLite sorts. Bulk sessions keep temporary
+    # data in memory, so the sort is allowed to spill to a temporary file instead.
+    temp_store = conn.execute("PRAGMA temp_store").fetchone()[0]
+    conn.execute("PRAGMA temp_store = FILE")
+
+    try:
+        conditions = start_study(conn, study_id)
+        if conditions is None:
+            return 0
+
+        slices = Study_matrix.iter_study_matrix(conn, study_id, 'tpm', chunk_size or Study_matrix.SLICE_SIZE, np.float64)
+        n_rows = sum(add_matrix(conn, study_id, matrix, gene_ids, run_ids, conditions) for matrix, gene_ids, run_ids in slices)
+        conn.commit()
+        report_study(study_id, n_rows)
+        return n_rows
+    finally:
+        conn.execute(f"PRAGMA temp_store = {temp_store}")
+        # Close the connection, which rolls back if the refresh failed
+        Bulk_session.release(conn)
+
+def refresh_studies(db_path, study_ids, chunk_size=None):
+    """
+    Recompute the gene_condition_stats rows of several studies, see refresh_study.
+
+    Args:
+        db_path (str): The path to the SQLite database.
+        study_ids (Iterable[str]): The studies to summarize.
+        chunk_size (int, optional): The number of gene x run values read at a time.
+
+    Returns:
+        int: The number of rows written.
+    """
+    return sum(refresh_study(db_path, study_id, chunk_size) for study_id in study_ids)
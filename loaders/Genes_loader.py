@@ -1,60 +1,109 @@
-import sqlite3
 import os
-import glob
 
-def load_genes(species_path, db_path):
+from loaders import Bulk_session
+from loaders import Directory_catalog
+from loaders import Bulk_insert
+from loaders import Load_manifest
+from loaders import Tsv_reader
+
+# Name under which this loader records its source files in the load_manifest table
+LOADER_NAME = 'genes'
+
+def source_files(species_path, catalog=None):
+    """
+    Find every *.counts_per_run.tsv file in a species folder.
+
+    Args:
+        species_path (str): The path to the species folder.
+        catalog (dict, optional): The output of Directory_catalog.scan_species for species_path. Scanned when omitted.
+
+    Returns:
+        List[Path]: The paths to the counts files.
+    """
+    catalog = catalog or Directory_catalog.scan_species(species_path)
+    return Directory_catalog.species_files(catalog, 'counts')
+
+def read_gene_ids(species_path, catalog=None):
+    """
+    Read the gene IDs from every *.counts_per_run.tsv file in a species folder.
+
+    Args:
+        species_path (str): The path to the species folder.
+        catalog (dict, optional): The output of Directory_catalog.scan_species for species_path. Scanned when omitted.
+
+    Returns:
+        List[str]: The gene IDs in file order, empty if no counts files were found.
+    """
+    # Take all *.counts_per_run.tsv files in the directory from the catalog
+    all_CPR = source_files(species_path, catalog)
+
+    # Check if any files are found
+    if not all_CPR:
+        print("No *.counts_per_run.tsv files found in the directory.")
+        return []
+
+    gene_ids = []
+    # Process each file
+    for path_to_file in all_CPR:
+        # Read only the gene_id column (index 0), as text
+        df_genes = Tsv_reader.read_tsv(path_to_file, usecols=[0], index_dtype=str)
+        gene_ids.extend(df_genes.index)
+
+    return gene_ids
+
+def insert_genes(gene_ids, species_id, db_path):
+    """
+    Register the distinct gene IDs of a species in the genes table in bulk.
+
+    Gene IDs repeat across every study of a species, so they are de-duplicated in
+    memory first and IDs already in the table are skipped with INSERT OR IGNORE.
+
+    Args:
+        gene_ids (List[str]): The gene IDs to insert, duplicates allowed.
+        species_id (str): The species the genes belong to.
+        db_path (str): The path to the SQLite database.
+
+    Returns:
+        Tuple[int, int]: The number of new genes and the number that already existed.
+
+    Raises:
+        sqlite3.Error: If the insert failed. Nothing is committed.
+    """
+    # Keep the first occurrence of each gene_id, in file order
+    rows = [(gene_id, species_id) for gene_id in dict.fromkeys(gene_ids)]
+
+    # Connect to the SQLite database
+    conn = Bulk_session.connect(db_path)
+
+    try:
+        new, existing = Bulk_insert.insert_distinct(conn, 'genes', ['gene_id', 'species_id'], rows)
+        # Commit changes to the database
+        conn.commit()
+        print(f"Registered {new} new genes, {existing} already existed.")
+        return new, existing
+    finally:
+        # Close the connection
+        Bulk_session.release(conn)
+
+def load_genes(species_path, db_path, gene_ids=None, catalog=None):
+    # gene_ids and catalog may be passed in when read_gene_ids or Directory_catalog.scan_species already ran elsewhere
     # Extract species ID from the file name
     name_id = os.path.basename(species_path)
     splitted = name_id.rsplit('_', 1)
     species_id = str(splitted[-1])
 
-    # Change the current working directory to the species folder
-    original_directory = os.getcwd()
-    os.chdir(species_path)
+    # Gene registration is idempotent, so a species only needs checking against the load_manifest table
+    catalog = catalog or Directory_catalog.scan_species(species_path)
+    state = Load_manifest.begin(db_path, LOADER_NAME, name_id, source_files(species_path, catalog))
+    if state == Load_manifest.CURRENT:
+        print(f"Skipping genes of {name_id} (unchanged since the last load)")
+        return
 
-    try:
-        # Search for all *.counts_per_run.tsv files in the directory
-        all_CPR = glob.glob('**/*.counts_per_run.tsv', recursive=True)
-
-        # Check if any files are found
-        if not all_CPR:
-            print("No *.counts_per_run.tsv files found in the directory.")
-            return
-
-        # Connect to the SQLite database
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-
-        try:
-            # Process each file
-            for path_to_file in all_CPR:
-                with open(path_to_file, 'r') as file:
-                    next(file)  # Skip the header row
-                    # Iterate over each line in the file
-                    for line in file:
-                        # Split the line into columns
-                        columns = line.strip().split('\t')
-                        # Extract the desired column (e.g., column index 0)
-                        column_value = columns[0]
-
-                        # Check if the column value already exists in the table
-                        cursor.execute("SELECT COUNT(*) FROM genes WHERE gene_id = ?", (column_value,))
-                        count = cursor.fetchone()[0]
-
-                        # Insert the column value and species_id into the table if it does not exist
-                        if count == 0:
-                            cursor.execute("INSERT INTO genes (gene_id, species_id) VALUES (?, ?)", (column_value, species_id))
-
-                    # Commit changes to the database after processing each file
-                    conn.commit()
-        except sqlite3.Error as e:
-            print(f"SQLite error: {e}")
-        finally:
-            # Close the cursor and the connection
-            cursor.close()
-            conn.close()
-    except Exception as e:
-        print(f"Error occurred: {e}")
-    finally:
-        # Change back to the original working directory
-        os.chdir(original_directory)
+    if gene_ids is None:
+        gene_ids = read_gene_ids(species_path, catalog)
+    if gene_ids:
+        # A failed insert raises out of load_genes, so the species is not recorded as loaded,
+        # populate_species marks the stage failed and the next load retries it
+        insert_genes(gene_ids, species_id, db_path)
+
+    Load_manifest.complete(db_path, LOADER_NAME, name_id)
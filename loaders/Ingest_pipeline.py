@@ -0,0 +1,133 @@
+import queue
+import threading
+
+from loaders import Load_manifest
+
+# Default number of parsed items (studies, or batches of a streamed study) held ready for the writer.
+# The parser blocks once this many are waiting, so memory stays bounded whatever the release size.
+# 0 parses and writes strictly one after the other.
+DEPTH = 2
+
+# How long a blocked parser waits before checking whether the writer stopped, in seconds
+POLL_SECONDS = 0.1
+
+def set_depth(depth):
+    """
+    Set how many parsed items are held ready for the writer, for every later load.
+
+    Args:
+        depth (int): The queue size, 0 to parse and write sequentially.
+
+    Returns:
+        None
+    """
+    global DEPTH
+    DEPTH = max(0, depth)
+
+def prefetch(items, depth=None):
+    """
+    Produce the items of an iterator in a background thread while the caller consumes them.
+
+    The thread runs ahead of the caller by at most depth items through a bounded queue,
+    so parsing the next study (or batch) overlaps writing the current one and a fast parser
+    waits for the writer instead of filling memory. Items come out in order. An exception
+    raised by the iterator is raised to the caller at the point it would have been raised
+    sequentially. Only the caller should use the database connection: SQLite connections
+    belong to the thread that opened them.
+
+    Args:
+        items (Iterable): The items to produce, e.g. a generator that parses one study per item.
+        depth (int, optional): The queue size, DEPTH when omitted. 0 iterates in the calling thread.
+
+    Yields:
+        The items, in order.
+    """
+    depth = DEPTH if depth is None else depth
+    if depth <= 0:
+        yield from items
+        return
+
+    buffer = queue.Queue(maxsize=depth)
+    stopped = threading.Event()
+    done = object()
+
+    def put(entry):
+        # Wait for a free slot, unless the writer stopped consuming
+        while not stopped.is_set():
+            try:
+                buffer.put(entry, timeout=POLL_SECONDS)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        iterator = iter(items)
+        try:
+            for item in iterator:
+                if not put((item, None)):
+                    return
+        except Exception as e:
+            put((done, e))
+            return
+        finally:
+            # Close a generator the writer stopped part-way, e.g. to close the files it reads
+            if hasattr(iterator, 'close'):
+                iterator.close()
+        put((done, None))
+
+    producer = threading.Thread(target=produce, name='ingest-parser', daemon=True)
+    producer.start()
+    try:
+        while True:
+            item, error = buffer.get()
+            if item is done:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        # The writer finished or failed: release a blocked parser and wait for it to exit
+        stopped.set()
+        producer.join()
+
+def parse_ahead(units, parse, depth=None):
+    """
+    Parse units in a background thread while the caller writes them, see prefetch.
+
+    Args:
+        units (Iterable): The units to parse, e.g. studies.
+        parse (Callable): Called with each unit in the background thread; must not use the database.
+        depth (int, optional): The number of parsed units held ready, DEPTH when omitted.
+
+    Yields:
+        Tuple: Each unit and its parsed data, in order.
+    """
+    return prefetch(((unit, parse(unit)) for unit in units), depth)
+
+def begin_studies(db_path, loader, catalog, source_files):
+    """
+    Start loading every study of a species folder that is not CURRENT, see Load_manifest.begin.
+
+    The studies are begun before any is parsed, so the parser can run ahead of the writer.
+    A study begun but not completed when a load fails is CHANGED on the next load and replaced.
+
+    Args:
+        db_path (str): The path to the SQLite database.
+        loader (str): The loader name, e.g. "metadata".
+        catalog (dict): The output of Directory_catalog.scan_species for the species folder.
+        source_files (Callable): The loader's source_files function.
+
+    Returns:
+        List[Tuple[dict, bool]]: Each study to load, from catalog['studies'], and whether it replaces rows of an earlier load.
+    """
+    studies = []
+    for study in catalog['studies'].values():
+        subdirectory, files = study['path'], study['files']
+
+        state = Load_manifest.begin(db_path, loader, subdirectory.name, source_files(subdirectory, files))
+        if state == Load_manifest.CURRENT:
+            print(f"Skipping subdirectory: {subdirectory} (unchanged since the last load)")
+            continue
+        studies.append((study, state == Load_manifest.CHANGED))
+    return studies
@@ -0,0 +1,61 @@
+import gzip
+import json
+import os
+
+from loaders import Load_report
+from loaders import Tsv_reader
+
+# Optional dependency: orjson parses large JSON files several times faster than the json module
+try:
+    import orjson
+    HAVE_ORJSON = True
+except ImportError:
+    HAVE_ORJSON = False
+
+def read_json(path):
+    """
+    Parse a JSON file, with orjson when it is installed. A gzip compressed file is decompressed first.
+
+    Args:
+        path (str): The path to the file.
+
+    Returns:
+        The parsed JSON value.
+    """
+    with open(path, 'rb') as file:
+        content = file.read()
+    if content.startswith(Tsv_reader.GZIP_MAGIC):
+        content = gzip.decompress(content)
+    data = orjson.loads(content) if HAVE_ORJSON else json.loads(content)
+    # A list counts as one row per record
+    Load_report.record_read(path, len(data) if isinstance(data, list) else 1)
+    return data
+
+def read_studies_json(species_path, catalog=None):
+    """
+    Parse the <species_name>.studies.json file of a species folder.
+
+    The path is built from species_path, so the working directory does not matter.
+
+    Args:
+        species_path (str): The path to the species folder.
+        catalog (dict, optional): The output of Directory_catalog.scan_species for species_path.
+
+    Returns:
+        List[dict]: The studies in the file, or None if the file does not exist.
+    """
+    species_name = os.path.basename(species_path).rsplit('_', 1)[0]
+    json_file = species_name + '.studies.json'
+
+    if catalog is not None:
+        path = catalog['studies_json']
+    else:
+        # The uncompressed file is used over a compressed copy
+        candidates = [os.path.join(species_path, json_file + suffix) for suffix in ('', '.gz')]
+        path = next((candidate for candidate in candidates if os.path.exists(candidate)), None)
+
+    if path is None:
+        print(f"File {json_file} does not exist.")
+        return None
+
+    return read_json(path)
@@ -0,0 +1,232 @@
+import hashlib
+import json
+import os
+from datetime import datetime, timezone
+
+from loaders import Bulk_session
+
+# States returned by check and begin:
+#   NEW     - the unit was never loaded, so there is nothing to replace
+#   CHANGED - the unit was loaded (or started loading) before and its files differ, so its rows must be replaced
+#   CURRENT - the unit was fully loaded from identical files and can be skipped
+NEW = 'new'
+CHANGED = 'changed'
+CURRENT = 'current'
+
+# Records every source file a loader consumed. A unit is what a loader loads in one go:
+# a study folder, or a species folder for the species-wide loaders.
+manifest_table_command = '''
+    CREATE TABLE IF NOT EXISTS load_manifest (
+        loader TEXT NOT NULL,
+        unit TEXT NOT NULL,
+        path TEXT NOT NULL,
+        size INTEGER,
+        mtime REAL,
+        content_hash TEXT,
+        status TEXT NOT NULL,
+        loaded_at TEXT,
+        PRIMARY KEY (loader, unit, path)
+    )
+    '''
+
+# Content hashes already computed in this process, keyed by (path, size, mtime)
+_hash_cache = {}
+
+def file_hash(path, size, mtime):
+    """
+    Compute the SHA-256 of a file, reusing the result for an unchanged file.
+
+    Args:
+        path (str): The path to the file.
+        size (int): The file size, part of the cache key.
+        mtime (float): The file modification time, part of the cache key.
+
+    Returns:
+        str: The hex digest.
+    """
+    key = (path, size, mtime)
+    if key not in _hash_cache:
+        digest = hashlib.sha256()
+        with open(path, 'rb') as file:
+            for block in iter(lambda: file.read(1024 * 1024), b''):
+                digest.update(block)
+        _hash_cache[key] = digest.hexdigest()
+    return _hash_cache[key]
+
+def fingerprint(path, previous):
+    """
+    Fingerprint a source file by size, mtime and content hash.
+
+    The file is only read when its size or mtime differ from the previous record,
+    so unchanged files cost a stat call.
+
+    Args:
+        path (str): The path to the file.
+        previous (dict): The previous manifest rows of the unit, keyed by path.
+
+    Returns:
+        Tuple[int, float, str]: The size, mtime and content hash.
+    """
+    stat = os.stat(path)
+    recorded = previous.get(path)
+    if recorded is not None and recorded[0] == stat.st_size and recorded[1] == stat.st_mtime:
+        return recorded[:3]
+    return stat.st_size, stat.st_mtime, file_hash(path, stat.st_size, stat.st_mtime)
+
+def _check(conn, loader, unit, paths):
+    conn.execute(manifest_table_command)
+    previous = {
+        path: (size, mtime, content_hash, status)
+        for path, size, mtime, content_hash, status in conn.execute(
+            "SELECT path, size, mtime, content_hash, status FROM load_manifest WHERE loader = ? AND unit = ?",
+            (loader, unit)
+        )
+    }
+    fingerprints = {str(path): fingerprint(str(path), previous) for path in paths}
+
+    if not previous:
+        return NEW, fingerprints
+
+    # Compare by file name, so moving the release directory does not force a reload
+    def contents(rows):
+        return sorted((os.path.basename(path), row[0], row[2]) for path, row in rows.items())
+
+    complete = all(row[3] == 'complete' for row in previous.values())
+    if complete and contents(previous) == contents(fingerprints):
+        return CURRENT, fingerprints
+    return CHANGED, fingerprints
+
+def check(db_path, loader, unit, paths):
+    """
+    Check whether a unit must be loaded, without recording anything.
+
+    Args:
+        db_path (str): The path to the SQLite database.
+        loader (str): The loader name, e.g. "run_genes_count_tpm".
+        unit (str): The study or species folder name.
+        paths (List[str]): The source files of the unit.
+
+    Returns:
+        str: NEW, CHANGED or CURRENT.
+    """
+    conn = Bulk_session.connect(db_path)
+    try:
+        state, _ = _check(conn, loader, unit, paths)
+    finally:
+        Bulk_session.release(conn)
+    return state
+
+def begin(db_path, loader, unit, paths):
+    """
+    Start loading a unit unless it is CURRENT.
+
+    The unit's files are recorded with status "loading" and committed before any data
+    is written, so after a crash the unit is reported as CHANGED and its partial rows get replaced.
+
+    Args:
+        db_path (str): The path to the SQLite database.
+        loader (str): The loader name, e.g. "run_genes_count_tpm".
+        unit (str): The study or species folder name.
+        paths (List[str]): The source files of the unit.
+
+    Returns:
+        str: NEW, CHANGED or CURRENT.
+    """
+    conn = Bulk_session.connect(db_path)
+    try:
+        state, fingerprints = _check(conn, loader, unit, paths)
+        if state != CURRENT:
+            conn.execute("DELETE FROM load_manifest WHERE loader = ? AND unit = ?", (loader, unit))
+            conn.executemany(
+                "INSERT INTO load_manifest (loader, unit, path, size, mtime, content_hash, status) VALUES (?, ?, ?, ?, ?, ?, 'loading')",
+                [(loader, unit, path, size, mtime, content_hash) for path, (size, mtime, content_hash) in fingerprints.items()]
+            )
+            conn.commit()
+    finally:
+        Bulk_session.release(conn)
+    return state
+
+def complete(db_path, loader, unit):
+    """
+    Mark a unit started with begin as fully loaded.
+
+    Args:
+        db_path (str): The path to the SQLite database.
+        loader (str): The loader name.
+        unit (str): The study or species folder name.
+
+    Returns:
+        None
+    """
+    conn = Bulk_session.connect(db_path)
+    try:
+        conn.execute(
+            "UPDATE load_manifest SET status = 'complete', loaded_at = ? WHERE loader = ? AND unit = ?",
+            (datetime.now(timezone.utc).isoformat(timespec='seconds'), loader, unit)
+        )
+        conn.commit()
+    finally:
+        Bulk_session.release(conn)
+
+def invalidate(db_path, loader, unit):
+    """
+    Force a unit to be reloaded, replacing its rows, by the next begin.
+
+    The unit's records are marked "loading", as after a crash. A unit without records
+    gets a placeholder record, so its rows are still deleted before it is loaded again.
+
+    Args:
+        db_path (str): The path to the SQLite database.
+        loader (str): The loader name.
+        unit (str): The study or species folder name.
+
+    Returns:
+        None
+    """
+    conn = Bulk_session.connect(db_path)
+    try:
+        conn.execute(manifest_table_command)
+        updated = conn.execute(
+            "UPDATE load_manifest SET status = 'loading' WHERE loader = ? AND unit = ?", (loader, unit)
+        ).rowcount
+        if not updated:
+            conn.execute(
+                "INSERT INTO load_manifest (loader, unit, path, status) VALUES (?, ?, '', 'loading')", (loader, unit)
+            )
+        conn.commit()
+    finally:
+        Bulk_session.release(conn)
+
+def unit_fingerprints(conn, loaders, unit=None):
+    """
+    Fingerprint units from their manifest records, to tell whether data derived from them is stale.
+
+    A unit's fingerprint changes whenever one of its files is loaded again, or a load
+    of it starts or completes, without reading any of the loaded rows.
+
+    Args:
+        conn (Connection): The SQLite connection.
+        loaders (List[str]): The loaders whose records make up the fingerprint, e.g. ["run_genes_count_tpm"].
+        unit (str, optional): Only fingerprint this study or species folder.
+
+    Returns:
+        dict: The fingerprint of each unit with manifest records. Units loaded before
+            the manifest existed are missing.
+    """
+    if not conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'load_manifest'").fetchone():
+        return {}
+
+    query = f'''
+        SELECT unit, loader, path, content_hash, status, loaded_at
+        FROM load_manifest
+        WHERE loader IN ({', '.join('?' for _ in loaders)})
+    '''
+    params = list(loaders)
+    if unit is not None:
+        query += ' AND unit = ?'
+        params.append(unit)
+
+    digests = {}
+    for row_unit, *record in conn.execute(query + ' ORDER BY unit, loader, path', params):
+        digests.setdefault(row_unit, hashlib.sha256()).update(json.dumps(record).encode())
+    return {row_unit: digest.hexdigest() for row_unit, digest in digests.items()}
@@ -0,0 +1,284 @@
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from loaders import Bulk_session
+
+# The resource module only exists on Unix; peak memory is not reported elsewhere
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Counters of the stages being measured, innermost last. The shared readers add the
+# rows and bytes they read to every active stage, see record_read.
+_active = []
+
+# Functions called with the metrics of every stage as soon as it finishes, see add_listener
+_listeners = []
+
+# Fields of the stage metrics that are added up in the release totals
+SUM_FIELDS = ['wall_seconds', 'cpu_seconds', 'rows_parsed', 'rows_written', 'bytes_read']
+
+def peak_rss_mb(who=None):
+    """
+    Get the peak resident set size so far.
+
+    Args:
+        who (int, optional): resource.RUSAGE_SELF (the default) or resource.RUSAGE_CHILDREN.
+
+    Returns:
+        float: The peak RSS in MB, or None where the resource module is not available.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF if who is None else who).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in KB elsewhere
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+def add_listener(listener):
+    """
+    Register a function to call with the metrics of each stage when it finishes.
+
+    This lets a scheduler follow a load as it runs instead of waiting for the report.
+    An error raised by a listener is printed and does not stop the load.
+
+    Args:
+        listener (Callable[[dict], None]): Called with the stage metrics, see measure.
+
+    Returns:
+        None
+    """
+    _listeners.append(listener)
+
+def remove_listener(listener):
+    """
+    Unregister a function registered with add_listener.
+
+    Args:
+        listener (Callable[[dict], None]): The registered function.
+
+    Returns:
+        None
+    """
+    _listeners.remove(listener)
+
+def record_read(path=None, rows=0):
+    """
+    Add rows and the size of a source file to the stages being measured.
+
+    Called by Tsv_reader and Json_reader, so every loader is counted without changes of its own.
+
+    Args:
+        path (str, optional): The file read, whose size is added to bytes_read.
+        rows (int): The number of rows (or JSON records) parsed.
+
+    Returns:
+        None
+    """
+    if not _active:
+        return
+    size = os.path.getsize(path) if path is not None else 0
+    for metrics in _active:
+        metrics['rows_parsed'] += rows
+        metrics['bytes_read'] += size
+
+def record_study(study_id, **fields):
+    """
+    Add per-study counts to the stages being measured, under their "studies" field.
+
+    Args:
+        study_id (str): The study.
+        **fields: The counts to add, e.g. rows_stored and zero_rows_omitted.
+
+    Returns:
+        None
+    """
+    for metrics in _active:
+        study = metrics.setdefault('studies', {}).setdefault(study_id, {})
+        for field, value in fields.items():
+            study[field] = study.get(field, 0) + value
+
+def new_report(**fields):
+    """
+    Create an empty report for measure to add stages to.
+
+    Args:
+        **fields: Fields describing what is measured, e.g. species and species_path.
+
+    Returns:
+        dict: The report, with the given fields and an empty stages list.
+    """
+    return {**fields, 'started': datetime.now(timezone.utc).isoformat(timespec='seconds'), 'stages': []}
+
+@contextmanager
+def measure(report, stage, phase='load'):
+    """
+    Measure one stage of a load and add its metrics to a report.
+
+    The metrics are:
+        wall_seconds, cpu_seconds: Elapsed and CPU time of this process.
+        rows_parsed, bytes_read: Rows and source file bytes read through Tsv_reader and Json_reader.
+        rows_written: Rows inserted, replaced or deleted through the bulk session connection,
+            or None when no bulk session is active.
+        peak_rss_mb, peak_rss_delta_mb: The peak RSS of the process after the stage and how much
+            the stage raised it, or None where it cannot be measured.
+        status, error: "ok", or "error" with the exception text. The exception is re-raised.
+
+    Args:
+        report (dict): The report from new_report, or None to only notify the listeners.
+        stage (str): The stage name.
+        phase (str): "parse" for the parsing done in a worker process, "load" otherwise.
+
+    Yields:
+        dict: The metrics of the stage, filled in when it ends.
+    """
+    metrics = {
+        'species': report.get('species') if report is not None else None,
+        'stage': stage,
+        'phase': phase,
+        'status': 'ok',
+        'error': None,
+        'rows_parsed': 0,
+        'bytes_read': 0,
+    }
+    changes_before = Bulk_session.total_changes()
+    rss_before = peak_rss_mb()
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    _active.append(metrics)
+
+    try:
+        yield metrics
+    except Exception as e:
+        metrics['status'] = 'error'
+        metrics['error'] = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _active.remove(metrics)
+        metrics['wall_seconds'] = round(time.perf_counter() - wall_start, 4)
+        metrics['cpu_seconds'] = round(time.process_time() - cpu_start, 4)
+        changes_after = Bulk_session.total_changes()
+        metrics['rows_written'] = None if changes_before is None or changes_after is None else changes_after - changes_before
+        rss_after = peak_rss_mb()
+        metrics['peak_rss_mb'] = None if rss_after is None else round(rss_after, 1)
+        metrics['peak_rss_delta_mb'] = None if rss_after is None else round(rss_after - rss_before, 1)
+
+        if report is not None:
+            report['stages'].append(metrics)
+        _notify(metrics)
+
+def _notify(metrics):
+    # Hand finished stage metrics to every listener
+    for listener in list(_listeners):
+        try:
+            listener(metrics)
+        except Exception as e:
+            print(f"Error in load report listener: {e}")
+
+def add_stages(report, stages):
+    """
+    Add stages measured elsewhere, e.g. in a worker process, to a report and notify the listeners.
+
+    Args:
+        report (dict): The report from new_report.
+        stages (Iterable[dict]): Stage metrics from measure.
+
+    Returns:
+        None
+    """
+    for metrics in stages:
+        report['stages'].append(metrics)
+        _notify(metrics)
+
+def skip(report, stage, reason):
+    """
+    Add a stage that was not run, e.g. because its files are unchanged, to a report.
+
+    Args:
+        report (dict): The report from new_report.
+        stage (str): The stage name.
+        reason (str): Why the stage was skipped.
+
+    Returns:
+        None
+    """
+    report['stages'].append({'species': report.get('species'), 'stage': stage, 'phase': 'load',
+                             'status': 'skipped', 'error': reason})
+
+def totals(stages):
+    """
+    Add up the metrics of stages per phase and stage name.
+
+    Args:
+        stages (Iterable[dict]): Stage metrics from measure.
+
+    Returns:
+        dict: For each "<phase>:<stage>", the summed SUM_FIELDS, the highest peak_rss_mb
+            and the number of runs and errors.
+    """
+    rollup = {}
+    for metrics in stages:
+        if metrics['status'] == 'skipped':
+            continue
+        total = rollup.setdefault(f"{metrics['phase']}:{metrics['stage']}",
+                                  {**{field: 0 for field in SUM_FIELDS}, 'peak_rss_mb': None, 'runs': 0, 'errors': 0})
+        total['runs'] += 1
+        total['errors'] += metrics['status'] == 'error'
+        for field in SUM_FIELDS:
+            if metrics[field] is not None:
+                total[field] = round(total[field] + metrics[field], 4)
+        if metrics['peak_rss_mb'] is not None:
+            total['peak_rss_mb'] = max(total['peak_rss_mb'] or 0, metrics['peak_rss_mb'])
+        # Per-study counts, e.g. the zero rows left out with sparse storage
+        for study in metrics.get('studies', {}).values():
+            for field, value in study.items():
+                total[field] = total.get(field, 0) + value
+    return rollup
+
+def finish(report, wall_start, cpu_start):
+    """
+    Record the total time of a report and the totals of its stages.
+
+    Args:
+        report (dict): The report from new_report. A release report also has a species_reports list.
+        wall_start (float): time.perf_counter() when the report started.
+        cpu_start (float): time.process_time() when the report started.
+
+    Returns:
+        dict: The report.
+    """
+    report['wall_seconds'] = round(time.perf_counter() - wall_start, 4)
+    report['cpu_seconds'] = round(time.process_time() - cpu_start, 4)
+    rss = peak_rss_mb()
+    report['peak_rss_mb'] = None if rss is None else round(rss, 1)
+
+    stages = list(report['stages'])
+    if 'species_reports' in report:
+        # Worker processes parse species in parallel, so their memory is reported separately
+        children = peak_rss_mb(resource.RUSAGE_CHILDREN) if resource is not None else None
+        report['peak_rss_workers_mb'] = None if children is None else round(children, 1)
+        for species_report in report['species_reports']:
+            stages.extend(species_report['stages'])
+    report['totals'] = totals(stages)
+    return report
+
+def write_report(report, path):
+    """
+    Write a report to a JSON file, creating its directory if needed.
+
+    Args:
+        report (dict): The report.
+        path (str): The path to the JSON file.
+
+    Returns:
+        None
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, 'w') as file:
+        json.dump(report, file, indent=2)
@@ -1,47 +1,73 @@
-import sqlite3
+import contextlib
 import json
-from pathlib import Path
 import pandas as pd
 
-def load_metadata_to_database(species_path):
+from loaders import Bulk_session
+from loaders import Directory_catalog
+from loaders import Ingest_pipeline
+from loaders import Load_manifest
+from loaders import Schema_info
+from loaders import Tsv_reader
+
+# Name under which this loader records its source files in the load_manifest table
+LOADER_NAME = 'metadata'
+
+def load_metadata_to_database(species_path, files=None):
     """
     Load metadata from a TSV file into a DataFrame.
 
     Args:
         species_path (str): The path to the directory containing the metadata file.
+        files (dict, optional): The files of the directory by type, from Directory_catalog. Scanned when omitted.
 
     Returns:
         df_transformed (DataFrame): DataFrame containing 'run_id' and 'metadata' columns.
     """
-    # Search for the study metadata_per_run.tsv file in subdirectories
-    file_to_find_metadata = next(Path(species_path).rglob('*metadata_per_run.tsv'), None)
+    # Take the study metadata_per_run.tsv file from the catalog
+    files = files or Directory_catalog.scan_study(species_path)
+    file_to_find_metadata = Directory_catalog.first_file(files, 'metadata')
     
     if file_to_find_metadata is None:
         print(f"Metadata file not found in {species_path}.")
         return None
 
     # Read the TSV file as a DataFrame
-    df = pd.read_csv(file_to_find_metadata, delimiter='\t')
+    df = Tsv_reader.read_tsv(file_to_find_metadata, marker=None, index_col=None)
 
-    # Function to create dictionary from row excluding the first column
-    def row_to_dict(row):
-        return row[1:].to_dict()
+    # Build one dictionary per row from every column but the first, in a single call
+    run_ids = df.iloc[:, 0]
+    df_transformed = pd.DataFrame({
+        'run_id': run_ids.astype(object).where(run_ids.notna(), None),
+        'metadata': df.iloc[:, 1:].to_dict('records'),
+    })
 
-    # Apply the function to each row and create new DataFrame
-    df['metadata'] = df.apply(row_to_dict, axis=1)
-    # Rename the first column to 'run_id'
-    df.rename(columns={df.columns[0]: 'run_id'}, inplace=True)
-    # Keep only the 'run_id' and 'metadata' columns
-    df_transformed = df[['run_id', 'metadata']]
+    return df_transformed
 
-    df_transformed = df_transformed.map(lambda x: None if pd.isna(x) else x)
+def metadata_rows(df_transformed):
+    """
+    Normalize the metadata dictionaries into (run_id, key, value) rows, leaving out missing values.
 
-    return df_transformed
+    Args:
+        df_transformed (DataFrame): The output of load_metadata_to_database.
+
+    Returns:
+        List[Tuple[str, str, object]]: One row per run and metadata key.
+    """
+    return [
+        (run_id, key, value)
+        for run_id, metadata in zip(df_transformed['run_id'], df_transformed['metadata'])
+        for key, value in metadata.items()
+        if not pd.isna(value)
+    ]
 
 def insert_data_to_database(df_transformed, db_path):
     """
     Insert the data from a DataFrame into an SQLite database.
 
+    The JSON metadata column of runs and the run_metadata key/value table are both
+    written with batched statements in one transaction. Run IDs not in the runs table
+    are ignored. A run's previous run_metadata rows are replaced, so reloading is idempotent.
+
     Args:
         df_transformed (DataFrame): The DataFrame containing the data to be inserted.
         db_path (str): The path to the SQLite database.
@@ -54,28 +80,45 @@ def insert_data_to_database(df_transformed, db_path):
         return
 
     # Connect to SQLite database
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-
-    # Update existing record if run_id exists
-    for _, row in df_transformed.iterrows():
-        run_id = row['run_id']
-        metadata = json.dumps(row['metadata'])
-        cursor.execute("UPDATE runs SET metadata = ? WHERE run_id = ?", (metadata, run_id))
-
-    # Commit changes and close the connection
-    conn.commit()
-    conn.close()
+    conn = Bulk_session.connect(db_path)
+
+    try:
+        # Update existing records if run_id exists
+        conn.executemany(
+            "UPDATE runs SET metadata = ? WHERE run_id = ?",
+            ((json.dumps(metadata), run_id) for run_id, metadata in zip(df_transformed['run_id'], df_transformed['metadata']))
+        )
+
+        if Schema_info.has_table(conn, 'run_metadata'):
+            # run_metadata refers to runs by run_key in the "keyed" layout and by run_id otherwise
+            run_column = 'run_key' if Schema_info.get_layout(conn) == 'keyed' else 'run_id'
+            conn.executemany(
+                f"DELETE FROM run_metadata WHERE {run_column} IN (SELECT {run_column} FROM runs WHERE run_id = ?)",
+                ((run_id,) for run_id in df_transformed['run_id'])
+            )
+            conn.executemany(
+                f"INSERT OR REPLACE INTO run_metadata ({run_column}, key, value) SELECT {run_column}, ?, ? FROM runs WHERE run_id = ?",
+                ((key, value, run_id) for run_id, key, value in metadata_rows(df_transformed))
+            )
+        else:
+            print("No run_metadata table in the database, only the runs metadata column was updated.")
+
+        # Commit changes
+        conn.commit()
+    finally:
+        # Close the connection
+        Bulk_session.release(conn)
 
     print("Data has been successfully inserted into the database.")
 
-def process_subdirectory(subdirectory_path, db_path):
+def process_subdirectory(subdirectory_path, db_path, files=None):
     """
     Process a subdirectory using processing functions.
 
     Args:
         subdirectory_path (Path): The path to the subdirectory.
         db_path (str): The path to the SQLite database.
+        files (dict, optional): The files of the subdirectory by type, from Directory_catalog. Scanned when omitted.
 
     Returns:
         None
@@ -83,23 +126,79 @@ def process_subdirectory(subdirectory_path, db_path):
     print(f"Processing subdirectory: {subdirectory_path}")
     
     # Load metadata to database
-    df_transformed = load_metadata_to_database(subdirectory_path)
+    df_transformed = load_metadata_to_database(subdirectory_path, files)
     
     # Insert data into database
     insert_data_to_database(df_transformed, db_path)
 
-def process_folders_in_directory(species_path, db_path):
+def source_files(subdirectory_path, files=None):
+    """
+    Find the files this loader reads from a subdirectory.
+
+    Args:
+        subdirectory_path (Path): The path to the subdirectory.
+        files (dict, optional): The files of the subdirectory by type, from Directory_catalog. Scanned when omitted.
+
+    Returns:
+        List[Path]: The metadata_per_run.tsv file, if it exists.
+    """
+    files = files or Directory_catalog.scan_study(subdirectory_path)
+    file_to_find_metadata = Directory_catalog.first_file(files, 'metadata')
+    return [file_to_find_metadata] if file_to_find_metadata else []
+
+def process_folders_in_directory(species_path, db_path, parsed_folders=None, catalog=None):
     """
     Opens each folder in the specified directory and applies processing functions to the subdirectories.
 
+    Subdirectories whose files are unchanged since they were last fully loaded are skipped,
+    using the load_manifest table. Updating the runs metadata is idempotent, so changed
+    subdirectories are simply loaded again. The next subdirectories are parsed in a
+    background thread while the current one is written, see Ingest_pipeline.
+
     Args:
         species_path (str): The path to the main directory containing subdirectories.
         db_path (str): The path to the SQLite database.
+        parsed_folders (dict, optional): Output of load_folders_in_directory for species_path.
+            Subdirectories found in it are inserted as-is instead of being read again.
+        catalog (dict, optional): The output of Directory_catalog.scan_species for species_path. Scanned when omitted.
 
     Returns:
         None
     """
+    catalog = catalog or Directory_catalog.scan_species(species_path)
+    studies = Ingest_pipeline.begin_studies(db_path, LOADER_NAME, catalog, source_files)
+
+    def parse(unit):
+        study, _ = unit
+        if parsed_folders is not None and study['path'].name in parsed_folders:
+            return parsed_folders[study['path'].name]
+        return load_metadata_to_database(study['path'], study['files'])
+
+    # Iterate through each subdirectory in the main directory, parsed ahead of the writer
+    with contextlib.closing(Ingest_pipeline.parse_ahead(studies, parse)) as parsed_studies:
+        for (study, _), df_transformed in parsed_studies:
+            print(f"Processing subdirectory: {study['path']}")
+            insert_data_to_database(df_transformed, db_path)
+            Load_manifest.complete(db_path, LOADER_NAME, study['path'].name)
+
+def load_folders_in_directory(species_path, skip=(), catalog=None):
+    """
+    Load metadata from each subdirectory without writing to the database.
+
+    Args:
+        species_path (str): The path to the main directory containing subdirectories.
+        skip (Iterable[str]): Names of subdirectories not to load, e.g. ones unchanged since the last load.
+        catalog (dict, optional): The output of Directory_catalog.scan_species for species_path. Scanned when omitted.
+
+    Returns:
+        dict: The transformed metadata for each subdirectory, keyed by subdirectory name.
+    """
+    catalog = catalog or Directory_catalog.scan_species(species_path)
+    parsed_folders = {}
     # Iterate through each subdirectory in the main directory
-    for subdirectory in Path(species_path).iterdir():
-        if subdirectory.is_dir():
-            process_subdirectory(subdirectory, db_path)
+    for name, study in catalog['studies'].items():
+        if name not in skip:
+            print(f"Processing subdirectory: {study['path']}")
+            parsed_folders[name] = load_metadata_to_database(study['path'], study['files'])
+
+    return parsed_folders
@@ -1,9 +1,18 @@
-import sqlite3
+import contextlib
+import itertools
 from pathlib import Path
+import numpy as np
 import pandas as pd
 import logging
-import logging
-import os
+
+from loaders import Bulk_session
+from loaders import Directory_catalog
+from loaders import Gene_condition_stats
+from loaders import Ingest_pipeline
+from loaders import Load_manifest
+from loaders import Load_report
+from loaders import Schema_info
+from loaders import Tsv_reader
 
 # Process_folders_in_directory function calls the process_subdirectory function for each subdirectory in the main directory (species_path folder), 
 # which in turn calls the load_gene_data function to load gene data from the tpm_per_run.tsv and counts_per_run.tsv files and the insert_data_to_database function to insert the data into the SQLite database.
@@ -11,30 +20,46 @@ import os
 # The insert_data_to_database function inserts the data from the DataFrame into the SQLite database. The process_subdirectory function processes a single subdirectory by calling the load_gene_data and 
 # insert_data_to_database functions. 
 # The process_folders_in_directory function processes all subdirectories in the main directory by calling the process_subdirectory function for each subdirectory.
+# In streaming mode (chunk_size set), process_subdirectory calls stream_data_to_database instead, which reads both files in aligned row chunks
+# through iter_gene_data and inserts each long-format batch as it is produced, so memory use depends on chunk_size rather than on the study size.
+# The gene_condition_stats rows are summarized from the same batches (or the whole study, or its packed vectors) in the same transaction,
+# so a study is never read back to compute them.
+# Parsing runs ahead of writing in a background thread (see Ingest_pipeline): the next studies, or the next batches of a streamed study,
+# are parsed while the current one is inserted.
+
+# Default maximum number of gene x run values held in memory per batch in streaming mode
+CHUNK_SIZE = 1000000
 
-def load_gene_data(species_path):
+# Name under which this loader records its source files in the load_manifest table
+LOADER_NAME = 'run_genes_count_tpm'
+
+class UnalignedFilesError(ValueError):
+    """
+    Raised when the TPM and counts files of a study do not list the same genes in the same order,
+    so they cannot be read chunk by chunk and have to be paired by gene_id instead.
+    """
+
+def load_gene_data(species_path, dtype=None, files=None):
     """
     Load gene data from tpm_per_run.tsv and counts_per_run.tsv files.
 
     Args:
         species_path (str): The path to the directory containing the files.
+        dtype (optional): The dtype to parse the values as, e.g. np.float32, inferred when omitted.
+        files (dict, optional): The files of the directory by type, from Directory_catalog. Scanned when omitted.
 
     Returns:
         df_combined (DataFrame): Combined DataFrame containing gene data from both tpm_per_run.tsv and counts_per_run.tsv files.
     """
-    # Search for the study tpm_per_run.tsv file in subdirectories and count_per_run.tsv file
-    file_to_find_tpm = next(Path(species_path).rglob('*tpm_per_run.tsv'), None)
-    file_to_find_counts = next(Path(species_path).rglob('*counts_per_run.tsv'), None)
+    # Take the study tpm_per_run.tsv and count_per_run.tsv files from the catalog
+    files = files or Directory_catalog.scan_study(species_path)
+    file_to_find_tpm = Directory_catalog.first_file(files, 'tpm')
+    file_to_find_counts = Directory_catalog.first_file(files, 'counts')
 
     if file_to_find_tpm:
         try:
-            # Find the row containing "gene_id" and read the file from that row
-            with open(file_to_find_tpm, 'r') as file:
-                for i, line in enumerate(file):
-                    if "gene_id" in line:
-                        break
-
-            df_tpm = pd.read_csv(file_to_find_tpm, sep='\t', index_col=0, skiprows=i)
+            # Read the file from the row containing "gene_id"
+            df_tpm = Tsv_reader.read_tsv(file_to_find_tpm, dtype=dtype)
 
         except pd.errors.ParserError as e:
             logging.error(f"Error reading TPM file {file_to_find_tpm}: {e}")
@@ -48,7 +73,7 @@ def load_gene_data(species_path):
 
     if file_to_find_counts:
         try:
-            df_counts = pd.read_csv(file_to_find_counts, sep='\t', index_col=0)
+            df_counts = Tsv_reader.read_tsv(file_to_find_counts, dtype=dtype)
         except pd.errors.ParserError as e:
             logging.error(f"Error reading counts file {file_to_find_counts}: {e}")
             return None
@@ -71,60 +96,560 @@ def load_gene_data(species_path):
     return df_combined
 
 
-def insert_data_to_database(df_combined, db_path):
+def get_expression_storage(db_path):
+    """
+    Get the expression storage of a database, see Schema_info.get_expression_storage.
+
+    Args:
+        db_path (str): The path to the SQLite database.
+
+    Returns:
+        str: "long", "packed" or "sparse".
+    """
+    conn = Bulk_session.connect(db_path)
+    storage = Schema_info.get_expression_storage(conn)
+    Bulk_session.release(conn)
+    return storage
+
+def insert_batch(conn, batch, layout, key_maps, sparse=False, tpm_scale=None):
+    """
+    Insert a long-format batch of gene data into the run_genes table.
+
+    With the "keyed" layout, gene_id and run_id are translated to gene_key and run_key
+    through the key_maps dictionaries and the rows are inserted in clustered key order.
+
+    Args:
+        conn (Connection): The SQLite connection, committed by the caller.
+        batch (DataFrame): Gene data with gene_id, run_id, tpm_value and count_value columns.
+        layout (str): The schema layout, from Schema_info.get_layout.
+        key_maps (dict): ID to key dictionaries for "genes" and "runs", reused across the batches of a study.
+        sparse (bool): Leave out rows whose count and TPM are both zero ("sparse" expression storage).
+        tpm_scale (int, optional): Store TPM values as fixed-point integers of this scale ("compact" value encoding).
+
+    Returns:
+        int: The number of rows left out.
+    """
+    if layout == 'keyed':
+        # IDs are registered before zero rows are left out, so the genes table is the same with sparse storage
+        rows = pd.DataFrame({
+            'gene_key': Schema_info.translate_ids(conn, key_maps['genes'], 'genes', 'gene_id', 'gene_key', batch['gene_id']),
+            'run_key': Schema_info.translate_ids(conn, key_maps['runs'], 'runs', 'run_id', 'run_key', batch['run_id']),
+            'count_value': batch['count_value'],
+            'tpm_value': batch['tpm_value'],
+        })
+    else:
+        rows = batch[['gene_id', 'run_id', 'tpm_value', 'count_value']]
+
+    n_rows = len(rows)
+    if sparse:
+        # Missing values (NaN) are not zero, so their rows are kept
+        rows = rows[(rows['count_value'] != 0) | (rows['tpm_value'] != 0)]
+    if tpm_scale is not None:
+        # Integral counts need no conversion: the INTEGER column stores them as integers
+        rows = rows.assign(tpm_value=Schema_info.encode_tpm(rows['tpm_value'].to_numpy(), tpm_scale))
+
+    if layout == 'keyed':
+        # (gene_key, run_key) is the primary key, so reloading a study replaces its rows
+        conn.executemany(
+            "INSERT OR REPLACE INTO run_genes (gene_key, run_key, count_value, tpm_value) VALUES (?, ?, ?, ?)",
+            rows.sort_values(['gene_key', 'run_key']).itertuples(index=False, name=None)
+        )
+    else:
+        conn.executemany(
+            "INSERT INTO run_genes (gene_id, run_id, tpm_value, count_value) VALUES (?, ?, ?, ?)",
+            rows.itertuples(index=False, name=None)
+        )
+    return n_rows - len(rows)
+
+def write_study_axes(conn, study_id, gene_ids, run_ids):
+    """
+    Record the genes and runs of a study's expression files ("sparse" expression storage).
+
+    run_genes only holds the non-zero values, so these lists tell which missing values are zeros.
+
+    Args:
+        conn (Connection): The SQLite connection, committed by the caller.
+        study_id (str): The study.
+        gene_ids (Iterable[str]): The genes of the files, in file order.
+        run_ids (Iterable[str]): The runs of the files.
+
+    Returns:
+        None
+    """
+    conn.execute("DELETE FROM study_genes WHERE study_id = ?", (study_id,))
+    conn.executemany(
+        "INSERT INTO study_genes (study_id, gene_position, gene_id) VALUES (?, ?, ?)",
+        ((study_id, position, gene_id) for position, gene_id in enumerate(gene_ids))
+    )
+    conn.execute("DELETE FROM study_runs WHERE study_id = ?", (study_id,))
+    conn.executemany("INSERT OR IGNORE INTO study_runs (study_id, run_id) VALUES (?, ?)", ((study_id, run_id) for run_id in run_ids))
+
+def report_sparse_study(study_id, n_rows, n_omitted):
+    # Print and record how much of the study sparse storage left out
+    percent = 100 * n_omitted / n_rows if n_rows else 0
+    print(f"Left out {n_omitted} zero rows of {n_rows} ({percent:.1f}%) in study {study_id}.")
+    Load_report.record_study(study_id, rows_stored=n_rows - n_omitted, zero_rows_omitted=n_omitted)
+
+def delete_study_rows(conn, study_id, run_ids=()):
+    """
+    Delete the run_genes rows of a study's runs, so the study can be loaded again.
+
+    The runs are found through the runs index on study_id and their rows through the
+    run_genes index on the run, both built by Finalize_database, so only the study's rows are read.
+
+    Args:
+        conn (Connection): The SQLite connection, committed by the caller.
+        study_id (str): The study whose rows are deleted.
+        run_ids (Iterable[str]): The runs of the new data. Their rows are deleted too, so runs
+            missing from the runs table (or listed under another study) are not loaded twice.
+
+    Returns:
+        None
+    """
+    if Schema_info.get_layout(conn) == 'keyed':
+        conn.execute("DELETE FROM run_genes WHERE run_key IN (SELECT run_key FROM runs WHERE study_id = ?)", (study_id,))
+        conn.executemany("DELETE FROM run_genes WHERE run_key IN (SELECT run_key FROM runs WHERE run_id = ?)",
+                         ((run_id,) for run_id in run_ids))
+    else:
+        conn.execute("DELETE FROM run_genes WHERE run_id IN (SELECT run_id FROM runs WHERE study_id = ?)", (study_id,))
+        conn.executemany("DELETE FROM run_genes WHERE run_id = ?", ((run_id,) for run_id in run_ids))
+
+def insert_data_to_database(df_combined, db_path, replace_study=None, study_id=None):
     """
     Insert the data from a DataFrame into an SQLite database.
 
     Args:
         df_combined (DataFrame): The DataFrame containing the data to be inserted.
         db_path (str): The path to the SQLite database.
+        replace_study (str, optional): A study whose existing rows are deleted before inserting.
+        study_id (str, optional): The study of the data, needed with "sparse" expression storage. replace_study when omitted.
 
     Returns:
         None
     """
     if df_combined is not None:
         # Connect to the SQLite database
-        conn = sqlite3.connect(db_path)
-        # Insert the data into the SQLite database
-        df_combined.to_sql('run_genes', conn, if_exists='append', index=False)
+        conn = Bulk_session.connect(db_path)
+        try:
+            # The old rows are deleted and the new ones inserted in one transaction,
+            # so readers see either version of the study and a failed insert keeps the old one
+            if replace_study:
+                delete_study_rows(conn, replace_study, pd.unique(df_combined['run_id']))
+            study_id = study_id or replace_study
+            # Summarize the study from the data in memory, in the same transaction
+            tpm_scale = Schema_info.get_tpm_scale(conn)
+            conditions = Gene_condition_stats.start_study(conn, study_id)
+            n_stats = Gene_condition_stats.add_rows(conn, study_id, df_combined, conditions, tpm_scale)
+            # Insert the data into the SQLite database
+            sparse = Schema_info.get_expression_storage(conn) == 'sparse'
+            n_omitted = insert_batch(conn, df_combined, Schema_info.get_layout(conn), {'genes': {}, 'runs': {}}, sparse, tpm_scale)
+            if sparse:
+                write_study_axes(conn, study_id, pd.unique(df_combined['gene_id']), pd.unique(df_combined['run_id']))
+                report_sparse_study(study_id, len(df_combined), n_omitted)
+            # Commit the changes
+            conn.commit()
+            if conditions is not None:
+                Gene_condition_stats.report_study(study_id, n_stats)
+        finally:
+            # Close the connection, which rolls back if the insert failed
+            Bulk_session.release(conn)
+    else:
+        print("No data to insert into the database.")
+
+def wide_to_long(df_tpm, df_counts):
+    """
+    Turn aligned wide TPM and counts chunks into one long-format DataFrame.
+
+    The two chunks must have the same gene_id rows and run columns in the same order,
+    so the values are paired by position instead of through a merge on (gene_id, run_id).
+
+    Args:
+        df_tpm (DataFrame): TPM values, genes as rows and runs as columns.
+        df_counts (DataFrame): Count values with the same shape and labels as df_tpm.
+
+    Returns:
+        DataFrame: One row per gene and run with gene_id, run_id, tpm_value and count_value columns.
+    """
+    n_genes, n_runs = df_tpm.shape
+    # Flatten column by column, which gives the same row order as melt
+    return pd.DataFrame({
+        'gene_id': np.tile(df_tpm.index.to_numpy(), n_runs),
+        'run_id': np.repeat(df_tpm.columns.to_numpy(), n_genes),
+        'tpm_value': df_tpm.to_numpy().ravel(order='F'),
+        'count_value': df_counts.to_numpy().ravel(order='F'),
+    })
+
+def iter_gene_chunks(subdirectory_path, chunk_size=CHUNK_SIZE, dtype=None, files=None):
+    """
+    Read tpm_per_run.tsv and counts_per_run.tsv files in aligned wide row chunks.
+
+    Both files are read chunk by chunk, so neither full matrix is held in memory.
+
+    Args:
+        subdirectory_path (Path): The path to the directory containing the files.
+        chunk_size (int): The maximum number of gene x run values per chunk.
+        dtype (optional): The dtype to parse the values as, e.g. np.float32, inferred when omitted.
+        files (dict, optional): The files of the directory by type, from Directory_catalog. Scanned when omitted.
+
+    Yields:
+        Tuple[DataFrame, DataFrame]: TPM and counts chunks with the same gene_id rows and run columns.
+
+    Raises:
+        UnalignedFilesError: If the two files do not list the same genes in the same order.
+    """
+    files = files or Directory_catalog.scan_study(subdirectory_path)
+    file_to_find_tpm = Directory_catalog.first_file(files, 'tpm')
+    file_to_find_counts = Directory_catalog.first_file(files, 'counts')
+
+    if not file_to_find_tpm:
+        print(f"TPM File not found in {subdirectory_path}.")
+        return
+    if not file_to_find_counts:
+        print(f"Counts File not found in {subdirectory_path}.")
+        return
+
+    # Size the chunks from the number of runs so every batch holds about chunk_size values.
+    # Both files use the same rows per chunk, so aligned files give aligned chunks.
+    n_runs = len(Tsv_reader.read_header(file_to_find_tpm)) - 1
+    rows_per_chunk = max(1, chunk_size // max(1, n_runs))
+
+    tpm_reader = Tsv_reader.iter_tsv(file_to_find_tpm, rows_per_chunk, dtype=dtype)
+    counts_reader = Tsv_reader.iter_tsv(file_to_find_counts, rows_per_chunk, dtype=dtype)
+
+    with contextlib.closing(tpm_reader), contextlib.closing(counts_reader):
+        for df_tpm, df_counts in itertools.zip_longest(tpm_reader, counts_reader):
+            if df_tpm is None or df_counts is None or not df_tpm.index.equals(df_counts.index):
+                raise UnalignedFilesError(f"Genes in {file_to_find_tpm} and {file_to_find_counts} are not aligned")
+
+            # Keep only the runs present in both files, as the merge did, in TPM column order
+            if not df_tpm.columns.equals(df_counts.columns):
+                run_ids = df_tpm.columns.intersection(df_counts.columns, sort=False)
+                df_tpm, df_counts = df_tpm[run_ids], df_counts[run_ids]
+
+            yield df_tpm, df_counts
+
+def iter_gene_data(subdirectory_path, chunk_size=CHUNK_SIZE, files=None):
+    """
+    Stream gene data from tpm_per_run.tsv and counts_per_run.tsv files as long-format batches.
+
+    Args:
+        subdirectory_path (Path): The path to the directory containing the files.
+        chunk_size (int): The maximum number of gene x run values per batch.
+        files (dict, optional): The files of the directory by type, from Directory_catalog. Scanned when omitted.
+
+    Yields:
+        DataFrame: A batch with gene_id, run_id, tpm_value and count_value columns.
+
+    Raises:
+        UnalignedFilesError: If the two files do not list the same genes in the same order.
+    """
+    for df_tpm, df_counts in iter_gene_chunks(subdirectory_path, chunk_size, files=files):
+        yield wide_to_long(df_tpm, df_counts)
+
+def stream_data_to_database(subdirectory_path, db_path, chunk_size=CHUNK_SIZE, replace_study=None, files=None, study_id=None):
+    """
+    Stream gene data from a subdirectory into an SQLite database batch by batch.
+
+    All batches are inserted in a single transaction. If the TPM and counts files
+    turn out not to be row-aligned, the transaction is rolled back and the
+    subdirectory is loaded in memory with load_gene_data instead.
+
+    Args:
+        subdirectory_path (Path): The path to the subdirectory.
+        db_path (str): The path to the SQLite database.
+        chunk_size (int): The maximum number of gene x run values per batch.
+        replace_study (str, optional): A study whose existing rows are deleted in the same transaction.
+        files (dict, optional): The files of the subdirectory by type, from Directory_catalog. Scanned when omitted.
+        study_id (str, optional): The study of the data, needed with "sparse" expression storage. replace_study when omitted.
+
+    Returns:
+        None
+    """
+    # Connect to the SQLite database
+    conn = Bulk_session.connect(db_path)
+    layout = Schema_info.get_layout(conn)
+    sparse = Schema_info.get_expression_storage(conn) == 'sparse'
+    tpm_scale = Schema_info.get_tpm_scale(conn)
+    key_maps = {'genes': {}, 'runs': {}}
+    files = files or Directory_catalog.scan_study(subdirectory_path)
+    study_id = study_id or replace_study
+    # The genes and runs of the files, and the rows read and left out, for sparse storage
+    gene_ids, run_ids, n_rows, n_omitted = [], [], 0, 0
+    aligned = True
+    try:
+        if replace_study:
+            # The run_ids are the columns of the TPM file after gene_id
+            tpm_file = Directory_catalog.first_file(files, 'tpm')
+            delete_study_rows(conn, replace_study, Tsv_reader.read_header(tpm_file)[1:] if tpm_file else ())
+        conditions = Gene_condition_stats.start_study(conn, study_id)
+        n_stats = 0
+        # The next batches are parsed while this one is inserted
+        with contextlib.closing(Ingest_pipeline.prefetch(iter_gene_data(subdirectory_path, chunk_size, files))) as batches:
+            for batch in batches:
+                # Each batch holds every run of a block of genes, so its stats are final
+                n_stats += Gene_condition_stats.add_rows(conn, study_id, batch, conditions, tpm_scale)
+                n_omitted += insert_batch(conn, batch, layout, key_maps, sparse, tpm_scale)
+                if sparse:
+                    if len(run_ids) == 0:
+                        run_ids = pd.unique(batch['run_id'])
+                    gene_ids.extend(pd.unique(batch['gene_id']))
+                    n_rows += len(batch)
+        if sparse:
+            write_study_axes(conn, study_id, pd.unique(np.asarray(gene_ids, dtype=object)), run_ids)
+            report_sparse_study(study_id, n_rows, n_omitted)
         # Commit the changes
         conn.commit()
+        if conditions is not None:
+            Gene_condition_stats.report_study(study_id, n_stats)
+    except UnalignedFilesError as e:
+        conn.rollback()
+        print(f"{e}, loading {subdirectory_path} in memory instead.")
+        aligned = False
+    finally:
         # Close the connection
-        conn.close()
-    else:
-        print("No data to insert into the database.")
+        Bulk_session.release(conn)
+
+    if not aligned:
+        insert_data_to_database(load_gene_data(subdirectory_path, files=files), db_path, replace_study, study_id)
+
+def load_gene_vectors(subdirectory_path, chunk_size=CHUNK_SIZE, files=None):
+    """
+    Load gene data from tpm_per_run.tsv and counts_per_run.tsv files as float32 per-run vectors.
+
+    Args:
+        subdirectory_path (Path): The path to the directory containing the files.
+        chunk_size (int): The maximum number of gene x run values read at a time.
+        files (dict, optional): The files of the directory by type, from Directory_catalog. Scanned when omitted.
+
+    Returns:
+        Tuple[List[str], List[str], ndarray, ndarray]: The gene_ids, the run_ids, and the counts and TPM
+            matrices with one row per run and one column per gene, or None if the data could not be loaded.
+    """
+    gene_ids, run_ids, count_parts, tpm_parts = [], [], [], []
+    files = files or Directory_catalog.scan_study(subdirectory_path)
+    try:
+        for df_tpm, df_counts in iter_gene_chunks(subdirectory_path, chunk_size, Schema_info.VECTOR_DTYPE, files):
+            run_ids = list(df_tpm.columns)
+            gene_ids.extend(df_tpm.index)
+            count_parts.append(df_counts.to_numpy(dtype=Schema_info.VECTOR_DTYPE).T)
+            tpm_parts.append(df_tpm.to_numpy(dtype=Schema_info.VECTOR_DTYPE).T)
+    except UnalignedFilesError as e:
+        print(f"{e}, pairing them by gene_id instead.")
+        df_combined = load_gene_data(subdirectory_path, Schema_info.VECTOR_DTYPE, files)
+        if df_combined is None:
+            return None
+        df_wide = df_combined.pivot(index='run_id', columns='gene_id')
+        return (list(df_wide['tpm_value'].columns), list(df_wide.index),
+                df_wide['count_value'].to_numpy(dtype=Schema_info.VECTOR_DTYPE),
+                df_wide['tpm_value'].to_numpy(dtype=Schema_info.VECTOR_DTYPE))
+
+    if not gene_ids:
+        return None
+
+    return gene_ids, run_ids, np.hstack(count_parts), np.hstack(tpm_parts)
+
+def insert_vectors_to_database(study_id, gene_vectors, db_path):
+    """
+    Insert the output of load_gene_vectors into the packed study_genes and run_vectors tables.
 
-def process_subdirectory(subdirectory_path, db_path):
+    Any rows already stored for the study are replaced.
+
+    Args:
+        study_id (str): The study the vectors belong to.
+        gene_vectors (tuple): The output of load_gene_vectors.
+        db_path (str): The path to the SQLite database.
+
+    Returns:
+        None
+    """
+    gene_ids, run_ids, counts, tpm = gene_vectors
+
+    # Connect to the SQLite database
+    conn = Bulk_session.connect(db_path)
+
+    try:
+        # Summarize the study from the vectors in memory, in the same transaction
+        conditions = Gene_condition_stats.start_study(conn, study_id)
+        n_stats = Gene_condition_stats.add_matrix(conn, study_id, tpm.T, gene_ids, run_ids, conditions)
+
+        # Store the gene order the vectors are aligned to
+        conn.execute("DELETE FROM study_genes WHERE study_id = ?", (study_id,))
+        conn.executemany(
+            "INSERT INTO study_genes (study_id, gene_position, gene_id) VALUES (?, ?, ?)",
+            ((study_id, position, gene_id) for position, gene_id in enumerate(gene_ids))
+        )
+
+        # Store one row per run with its packed counts and TPM vectors
+        conn.execute("DELETE FROM run_vectors WHERE study_id = ?", (study_id,))
+        conn.executemany(
+            "INSERT OR REPLACE INTO run_vectors (run_id, study_id, run_position, count_vector, tpm_vector) VALUES (?, ?, ?, ?, ?)",
+            ((run_id, study_id, position, counts[position].tobytes(), tpm[position].tobytes()) for position, run_id in enumerate(run_ids))
+        )
+
+        # Commit the changes
+        conn.commit()
+        if conditions is not None:
+            Gene_condition_stats.report_study(study_id, n_stats)
+    finally:
+        # Close the connection, which rolls back if the insert failed
+        Bulk_session.release(conn)
+
+def source_files(subdirectory_path, files=None):
+    """
+    Find the files this loader reads from a subdirectory.
+
+    Args:
+        subdirectory_path (Path): The path to the subdirectory.
+        files (dict, optional): The files of the subdirectory by type, from Directory_catalog. Scanned when omitted.
+
+    Returns:
+        List[Path]: The tpm_per_run.tsv and counts_per_run.tsv files that exist.
+    """
+    files = files or Directory_catalog.scan_study(subdirectory_path)
+    found = [Directory_catalog.first_file(files, 'tpm'), Directory_catalog.first_file(files, 'counts')]
+    return [file for file in found if file is not None]
+
+def parse_subdirectory(subdirectory_path, storage, chunk_size=None, files=None):
+    """
+    Read the files of a subdirectory into the data write_subdirectory inserts, without touching the database.
+
+    Args:
+        subdirectory_path (Path): The path to the subdirectory.
+        storage (str): The expression storage of the database.
+        chunk_size (int, optional): Stream the files in batches of at most this many values
+            instead of loading them whole.
+        files (dict, optional): The files of the subdirectory by type, from Directory_catalog. Scanned when omitted.
+
+    Returns:
+        The output of load_gene_vectors for "packed" storage, of load_gene_data for whole studies,
+        or None for a streamed study, which write_subdirectory reads itself.
+    """
+    files = files or Directory_catalog.scan_study(subdirectory_path)
+    if storage == 'packed':
+        return load_gene_vectors(subdirectory_path, chunk_size or CHUNK_SIZE, files)
+    if chunk_size:
+        return None
+    return load_gene_data(subdirectory_path, files=files)
+
+def write_subdirectory(subdirectory_path, data, db_path, storage, chunk_size=None, replace=False, files=None):
+    """
+    Insert the output of parse_subdirectory, or stream the files of a subdirectory, into the database.
+
+    Args:
+        subdirectory_path (Path): The path to the subdirectory.
+        data: The output of parse_subdirectory, or gene data from load_folders_in_directory.
+        db_path (str): The path to the SQLite database.
+        storage (str): The expression storage of the database.
+        chunk_size (int, optional): Stream the files in batches of at most this many values when data is None.
+        replace (bool): Delete the rows already loaded for this study first.
+        files (dict, optional): The files of the subdirectory by type, from Directory_catalog. Scanned when omitted.
+
+    Returns:
+        None
+    """
+    study_id = Path(subdirectory_path).name
+    replace_study = study_id if replace else None
+
+    if storage == 'packed':
+        if data is None:
+            print("No data to insert into the database.")
+            return
+        # The packed tables always replace the study's rows
+        insert_vectors_to_database(study_id, data, db_path)
+        return
+
+    if data is None and chunk_size:
+        stream_data_to_database(subdirectory_path, db_path, chunk_size, replace_study, files, study_id)
+        return
+
+    # Insert data into database
+    insert_data_to_database(data, db_path, replace_study, study_id)
+
+def process_subdirectory(subdirectory_path, db_path, chunk_size=None, storage=None, replace=False, files=None):
     """
     Process a subdirectory using two processing functions.
 
     Args:
         subdirectory_path (Path): The path to the subdirectory.
         db_path (str): The path to the SQLite database.
+        chunk_size (int, optional): Stream the files in batches of at most this many values
+            instead of loading them whole.
+        storage (str, optional): The expression storage of the database, read from it when omitted.
+        replace (bool): Delete the rows already loaded for this study first.
+        files (dict, optional): The files of the subdirectory by type, from Directory_catalog. Scanned when omitted.
 
     Returns:
         None
     """
     print(f"Processing subdirectory: {subdirectory_path}")
-    
+
+    files = files or Directory_catalog.scan_study(subdirectory_path)
+    if storage is None:
+        storage = get_expression_storage(db_path)
+
     # Load gene data
-    df_combined = load_gene_data(subdirectory_path)
-    
+    data = parse_subdirectory(subdirectory_path, storage, chunk_size, files)
+
     # Insert data into database
-    insert_data_to_database(df_combined, db_path)
+    write_subdirectory(subdirectory_path, data, db_path, storage, chunk_size, replace, files)
 
-def process_folders_in_directory(species_path, db_path):
+def process_folders_in_directory(species_path, db_path, parsed_folders=None, chunk_size=None, catalog=None):
     """
     Opens each folder in the specified directory and applies two processing functions to the subdirectories.
 
+    Subdirectories whose files are unchanged since they were last fully loaded are skipped,
+    and subdirectories loaded before (even partially) have their rows replaced, using the load_manifest table.
+    The gene_condition_stats rows of every loaded subdirectory are written with its expression data. The next subdirectories
+    are parsed in a background thread while the current one is written, see Ingest_pipeline.
+
     Args:
         species_path (str): The path to the main directory containing subdirectories.
         db_path (str): The path to the SQLite database.
+        parsed_folders (dict, optional): Output of load_folders_in_directory for species_path.
+            Subdirectories found in it are inserted as-is instead of being read again.
+            Ignored with "packed" expression storage, which reads the files itself.
+        chunk_size (int, optional): Stream each subdirectory in batches of at most this many values.
+        catalog (dict, optional): The output of Directory_catalog.scan_species for species_path. Scanned when omitted.
 
     Returns:
         None
     """
+    storage = get_expression_storage(db_path)
+    catalog = catalog or Directory_catalog.scan_species(species_path)
+    studies = Ingest_pipeline.begin_studies(db_path, LOADER_NAME, catalog, source_files)
+
+    def parse(unit):
+        study, _ = unit
+        if parsed_folders is not None and storage != 'packed' and study['path'].name in parsed_folders:
+            return parsed_folders[study['path'].name]
+        return parse_subdirectory(study['path'], storage, chunk_size, study['files'])
+
+    # Iterate through each subdirectory in the main directory, parsed ahead of the writer
+    with contextlib.closing(Ingest_pipeline.parse_ahead(studies, parse)) as parsed_studies:
+        for (study, replace), data in parsed_studies:
+            subdirectory, files = study['path'], study['files']
+            print(f"Processing subdirectory: {subdirectory}")
+            write_subdirectory(subdirectory, data, db_path, storage, chunk_size, replace, files)
+            Load_manifest.complete(db_path, LOADER_NAME, subdirectory.name)
+
+def load_folders_in_directory(species_path, skip=(), catalog=None):
+    """
+    Load gene data from each subdirectory without writing to the database.
+
+    Args:
+        species_path (str): The path to the main directory containing subdirectories.
+        skip (Iterable[str]): Names of subdirectories not to load, e.g. ones unchanged since the last load.
+        catalog (dict, optional): The output of Directory_catalog.scan_species for species_path. Scanned when omitted.
+
+    Returns:
+        dict: The combined gene data for each subdirectory, keyed by subdirectory name.
+    """
+    catalog = catalog or Directory_catalog.scan_species(species_path)
+    parsed_folders = {}
     # Iterate through each subdirectory in the main directory
-    for subdirectory in Path(species_path).iterdir():
-        if subdirectory.is_dir():
-            process_subdirectory(subdirectory, db_path)
+    for name, study in catalog['studies'].items():
+        if name not in skip:
+            print(f"Processing subdirectory: {study['path']}")
+            parsed_folders[name] = load_gene_data(study['path'], files=study['files'])
+
+    return parsed_folders
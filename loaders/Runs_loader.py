@@ -1,62 +1,62 @@
-import json
 import sqlite3
-import os
-
-def load_runs(species_path, db_path):
-    # Extract species name and ID from the file name
-    name_id = os.path.basename(species_path)
-    splitted = name_id.rsplit('_', 1)
-    species_name = splitted[0]
-    species_id = splitted[-1]
-    # Change the current working directory to the species folder
-    original_directory = os.getcwd()
-    os.chdir(species_path)
 
+from loaders import Bulk_session
+from loaders import Bulk_insert
+from loaders import Json_reader
+
+def insert_runs(conn, data, replace=False):
+    """
+    Register the runs of a parsed studies.json file in one batch.
+
+    Args:
+        conn (Connection): The SQLite connection, committed by the caller.
+        data (List[dict]): The parsed studies.json file.
+        replace (bool): Update the condition and study of existing runs with the values from the file,
+            instead of keeping the existing rows. The rest of the row, e.g. run_key and metadata, is kept.
+
+    Returns:
+        Tuple[int, int]: The number of new runs and the number that already existed.
+    """
+    # Collect the distinct runs in memory, keeping the first occurrence of each run_id
+    rows = {}
+    for item in data:
+        for run in item.get('runs', []):
+            if run['run_id'] not in rows:
+                rows[run['run_id']] = (run['run_id'], run.get('condition', None), item['study_id'])
+
+    if replace:
+        # An upsert rather than INSERT OR REPLACE, which would give the run a new run_key in the keyed layout
+        conn.executemany('''
+            INSERT INTO runs (run_id, condition, study_id) VALUES (?, ?, ?)
+            ON CONFLICT (run_id) DO UPDATE SET condition = excluded.condition, study_id = excluded.study_id
+        ''', list(rows.values()))
+        print(f"Wrote {len(rows)} runs, updating existing ones.")
+        return len(rows), 0
+
+    # Insert them in batches, skipping run_ids that already exist
+    new, existing = Bulk_insert.insert_distinct(conn, 'runs', ['run_id', 'condition', 'study_id'], list(rows.values()))
+
+    print(f"Registered {new} new runs, {existing} already existed.")
+    return new, existing
+
+def load_runs(species_path, db_path, catalog=None):
     try:
         # Read JSON file if it exists
-        json_file = species_name + '.studies.json'
-        if os.path.exists(json_file):
-            with open(json_file) as file:
-                data = json.load(file)
-
-            # Connect to the SQLite database
-            conn = sqlite3.connect(db_path)
-            cursor = conn.cursor()
-
-            try:
-                # Execute the appropriate SQL query
-                for item in data:
-                    for run in item['runs']:
-                        # Check if run_id already exists
-                        cursor.execute('SELECT COUNT(*) FROM runs WHERE run_id = ?', (run['run_id'],))
-                        if cursor.fetchone()[0] == 0:
-                            condition = run.get('condition', None)
-                            cursor.execute('''
-                                INSERT INTO runs (run_id, condition, study_id)
-                                VALUES (?, ?, ?)
-                            ''', (run['run_id'], condition, item['study_id']))
-                        else:
-                            print(f"Duplicate run_id found: {run['run_id']}")
-                    
-                    # Commit the changes to the database
-                    conn.commit()
-            except sqlite3.Error as e:
-                print(f"SQLite error: {e}")
-            finally:
-                # Close the cursor and the connection
-                cursor.close()
-                conn.close()
-        else:
-            print(f"JSON file not found: {json_file}")
+        data = Json_reader.read_studies_json(species_path, catalog)
+        if data is None:
+            return
+
+        # Connect to the SQLite database
+        conn = Bulk_session.connect(db_path)
+
+        try:
+            insert_runs(conn, data)
+            # Commit the changes to the database
+            conn.commit()
+        except sqlite3.Error as e:
+            print(f"SQLite error: {e}")
+        finally:
+            # Close the connection
+            Bulk_session.release(conn)
     except Exception as e:
         print(f"Error occurred: {e}")
-    finally:
-        # Change back to the original working directory
-        os.chdir(original_directory)
-
-
-
-
-
-
-
@@ -0,0 +1,190 @@
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+from loaders import Bulk_insert
+
+# Number of IDs per "IN (...)" lookup, kept well below SQLite's bound parameter limit
+LOOKUP_BATCH_SIZE = 500
+
+# Element type of the packed run_vectors BLOBs: little-endian float32
+VECTOR_DTYPE = np.dtype('<f4')
+
+def read_schema_info(conn):
+    """
+    Read the settings recorded in the schema_info table by Create_db_and_tables.py.
+
+    Args:
+        conn (Connection): The SQLite connection.
+
+    Returns:
+        dict: The settings by key, empty for databases created before schema_info existed.
+    """
+    try:
+        return dict(conn.execute("SELECT key, value FROM schema_info"))
+    except sqlite3.OperationalError:
+        return {}
+
+def get_layout(conn):
+    """
+    Get the schema layout of a database.
+
+    Args:
+        conn (Connection): The SQLite connection.
+
+    Returns:
+        str: "keyed" for integer surrogate keys, otherwise "text".
+    """
+    return read_schema_info(conn).get('layout', 'text')
+
+def get_expression_storage(conn):
+    """
+    Get how expression values are stored in a database.
+
+    Args:
+        conn (Connection): The SQLite connection.
+
+    Returns:
+        str: "packed" for per-run BLOB vectors, "sparse" for run_genes without zero rows, otherwise "long".
+    """
+    return read_schema_info(conn).get('expression_storage', 'long')
+
+def get_tpm_scale(conn):
+    """
+    Get the fixed-point scale of the TPM values stored in run_genes.
+
+    Args:
+        conn (Connection): The SQLite connection.
+
+    Returns:
+        int: The scale of "compact" value encoding, None when TPM values are stored as REAL.
+    """
+    info = read_schema_info(conn)
+    if info.get('value_encoding') == 'compact':
+        return int(info['tpm_scale'])
+    return None
+
+def encode_tpm(values, tpm_scale):
+    """
+    Encode TPM values as the fixed-point integers of "compact" value encoding.
+
+    Args:
+        values (ndarray): The TPM values.
+        tpm_scale (int): The scale, from get_tpm_scale. None leaves the values as they are.
+
+    Returns:
+        ndarray: The values times tpm_scale, rounded; float64 so missing values stay NaN (stored as NULL).
+    """
+    if tpm_scale is None:
+        return values
+    return np.rint(np.asarray(values, dtype=np.float64) * tpm_scale)
+
+def decode_tpm(values, tpm_scale):
+    """
+    Decode TPM values read from run_genes, see encode_tpm.
+
+    Args:
+        values (ndarray): The stored values.
+        tpm_scale (int): The scale, from get_tpm_scale. None leaves the values as they are.
+
+    Returns:
+        ndarray: The TPM values.
+    """
+    if tpm_scale is None:
+        return values
+    return np.asarray(values, dtype=np.float64) / tpm_scale
+
+def get_load_generation(conn):
+    """
+    Get the number of loads run on a database, see bump_load_generation.
+
+    Args:
+        conn (Connection): The SQLite connection.
+
+    Returns:
+        int: The load generation, 0 for databases never loaded since it was introduced.
+    """
+    return int(read_schema_info(conn).get('load_generation', 0))
+
+def bump_load_generation(conn):
+    """
+    Count one more load of a database, so caches of query results know their results may be stale.
+
+    Args:
+        conn (Connection): The SQLite connection, committed by the caller.
+
+    Returns:
+        int: The new load generation.
+    """
+    # Databases created before schema_info existed get the table
+    conn.execute("CREATE TABLE IF NOT EXISTS schema_info (key TEXT PRIMARY KEY, value TEXT)")
+    conn.execute('''
+        INSERT INTO schema_info (key, value) VALUES ('load_generation', '1')
+        ON CONFLICT (key) DO UPDATE SET value = CAST(value AS INTEGER) + 1
+    ''')
+    return get_load_generation(conn)
+
+def has_table(conn, table):
+    """
+    Check whether a table exists, for tables added after older databases were created.
+
+    Args:
+        conn (Connection): The SQLite connection.
+        table (str): The table name.
+
+    Returns:
+        bool: True if the table exists.
+    """
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone() is not None
+
+def has_column(conn, table, column):
+    """
+    Check whether a table has a column, for tables whose shape changed after older databases were created.
+
+    Args:
+        conn (Connection): The SQLite connection.
+        table (str): The table name.
+        column (str): The column name.
+
+    Returns:
+        bool: True if the column exists.
+    """
+    return any(row[1] == column for row in conn.execute(f"PRAGMA table_info({table})"))
+
+def translate_ids(conn, key_map, table, id_column, key_column, ids):
+    """
+    Translate text IDs into integer surrogate keys through an in-memory dictionary.
+
+    IDs missing from key_map are fetched from the table in batches and added to it,
+    so a dictionary reused across batches only queries each ID once. IDs not yet in
+    the table are registered with INSERT OR IGNORE, leaving their other columns NULL,
+    so no expression row is dropped for lack of a key.
+
+    Args:
+        conn (Connection): The SQLite connection.
+        key_map (dict): The ID to key dictionary, updated in place.
+        table (str): The table holding the keys, e.g. "genes".
+        id_column (str): The text ID column, e.g. "gene_id".
+        key_column (str): The integer key column, e.g. "gene_key".
+        ids (Series): The IDs to translate.
+
+    Returns:
+        Series: The integer key of each ID, aligned with ids.
+    """
+    missing = [i for i in pd.unique(ids) if i not in key_map]
+
+    if missing:
+        for batch in Bulk_insert.batched(missing, LOOKUP_BATCH_SIZE):
+            placeholders = ', '.join('?' * len(batch))
+            key_map.update(conn.execute(
+                f"SELECT {id_column}, {key_column} FROM {table} WHERE {id_column} IN ({placeholders})", batch
+            ))
+
+        unregistered = [i for i in missing if i not in key_map]
+        if unregistered:
+            print(f"Registering {len(unregistered)} {id_column} values missing from {table}.")
+            Bulk_insert.insert_distinct(conn, table, [id_column], [(i,) for i in unregistered])
+            return translate_ids(conn, key_map, table, id_column, key_column, ids)
+
+    return ids.map(key_map)
@@ -1,7 +1,9 @@
-import sqlite3
 import os
 
-def load_species_data(species_path, db_path):
+from loaders import Bulk_session
+
+def load_species_data(species_path, db_path, replace=False):
+    # With replace=True the species may already be loaded, so an existing row is kept instead of failing
     # Extract the current directory name
     name_id = os.path.basename(species_path)
     # split everything before and after the last underscore in the species_id
@@ -14,15 +16,18 @@ def load_species_data(species_path, db_path):
     print(f"Loading species: {species_name} with ID: {species_id}")
 
     # Connect to the SQLite database
-    conn = sqlite3.connect(db_path)
+    conn = Bulk_session.connect(db_path)
     # Create a cursor object to execute SQL queries
     cursor = conn.cursor()
 
-    # Execute the appropriate SQL query
-    cursor.execute("INSERT INTO species (species_id, species_name, alternative_species_id) VALUES (?, ?, ?)", (species_id, species_name, None))
+    try:
+        # Execute the appropriate SQL query
+        verb = "INSERT OR IGNORE" if replace else "INSERT"
+        cursor.execute(f"{verb} INTO species (species_id, species_name, alternative_species_id) VALUES (?, ?, ?)", (species_id, species_name, None))
 
-    # Commit the changes to the database
-    conn.commit()
-    # Close the cursor and the connection
-    cursor.close()
-    conn.close()
+        # Commit the changes to the database
+        conn.commit()
+    finally:
+        # Close the cursor and the connection
+        cursor.close()
+        Bulk_session.release(conn)
@@ -0,0 +1,47 @@
+import os
+
+from loaders import Bulk_session
+from loaders import Json_reader
+from loaders import Studies_loader
+from loaders import Runs_loader
+from loaders import Studies_species_loader
+
+def load_studies_json(species_path, db_path, replace=False, catalog=None):
+    """
+    Load the studies, runs and study_species tables from a species' studies.json file.
+
+    The file is parsed once and the three tables are written in a single transaction,
+    so either all of them or none of them hold the file's contents.
+
+    Args:
+        species_path (str): The path to the species folder.
+        db_path (str): The path to the SQLite database.
+        replace (bool): Replace the rows loaded from a previous version of the file,
+            see the replace arguments of the three loaders.
+        catalog (dict, optional): The output of Directory_catalog.scan_species for species_path.
+
+    Returns:
+        None
+    """
+    # Extract species ID from the folder name
+    name_id = os.path.basename(species_path)
+    species_id = str(name_id.rsplit('_', 1)[-1])
+
+    # Read JSON file if it exists
+    data = Json_reader.read_studies_json(species_path, catalog)
+    if data is None:
+        return
+
+    # Connect to the SQLite database
+    conn = Bulk_session.connect(db_path)
+
+    try:
+        Studies_loader.insert_studies(conn, data, replace)
+        Runs_loader.insert_runs(conn, data, replace)
+        Studies_species_loader.insert_studies_species(conn, data, species_id, replace)
+        # Commit the changes to the database
+        conn.commit()
+        print("Data committed to the database.")
+    finally:
+        # Close the connection, which rolls back if any insert failed
+        Bulk_session.release(conn)
@@ -1,63 +1,63 @@
 import json
-import sqlite3
-import os
-
-def load_studies(species_path, db_path):
-    # Extract species name and ID from the file name
-    name_id = os.path.basename(species_path)
-    splitted = name_id.rsplit('_', 1)
-    species_name = str(splitted[0])
-    species_id = str(splitted[-1])
-    
-    # Change the current working directory to the species folder
-    original_directory = os.getcwd()
-    os.chdir(species_path)
+
+from loaders import Bulk_session
+from loaders import Bulk_insert
+from loaders import Json_reader
+
+def insert_studies(conn, data, replace=False):
+    """
+    Insert the studies of a parsed studies.json file in one batch.
+
+    Args:
+        conn (Connection): The SQLite connection, committed by the caller.
+        data (List[dict]): The parsed studies.json file.
+        replace (bool): Overwrite existing studies with the values from the file,
+            instead of keeping the existing rows.
+
+    Returns:
+        Tuple[int, int]: The number of studies written and the number skipped because they already existed.
+    """
+    rows = []
+    for item in data:
+        study_id = item.get('study_id', '')
+        study_title = item.get('study_title', '')
+        study_category = item.get('study_category', '')
+
+        # Convert the attributes dictionary to a JSON string
+        attributes = item.get('attributes', {})
+        attributes_json = json.dumps(attributes)  # Ensure attributes are a dictionary
+
+        rows.append((study_id, study_title, study_category, attributes_json))
+
+    if replace:
+        conn.executemany('''
+            INSERT OR REPLACE INTO studies (study_id, study_name, study_category, link)
+            VALUES (?, ?, ?, ?)
+        ''', rows)
+        print(f"Wrote {len(rows)} studies, replacing existing ones.")
+        return len(rows), 0
+
+    new, existing = Bulk_insert.insert_distinct(conn, 'studies', ['study_id', 'study_name', 'study_category', 'link'], rows)
+    print(f"Registered {new} new studies, {existing} already existed.")
+    return new, existing
+
+def load_studies(species_path, db_path, replace=False, catalog=None):
+    # With replace=True existing studies are overwritten with the values from the JSON file
+    # Read JSON file if it exists
+    data = Json_reader.read_studies_json(species_path, catalog)
+    if data is None:
+        return
+
+    # Connect to the SQLite database
+    conn = Bulk_session.connect(db_path)
 
     try:
-        # Read JSON file if it exists
-        json_file = species_name + '.studies.json'
-        if os.path.exists(json_file):
-            with open(json_file) as file:
-                data = json.load(file)
-                
-                # Connect to the SQLite database
-                conn = sqlite3.connect(db_path)
-                cursor = conn.cursor()
-                
-                # Debug print to check connection
-                print("Connected to the database.")
-                
-                # Iterate over each study in the data list
-                for item in data:
-                    study_id = item.get('study_id', '')
-                    study_title = item.get('study_title', '')
-                    study_category = item.get('study_category', '')
-                    
-                    # Convert the attributes dictionary to a JSON string
-                    attributes = item.get('attributes', {})
-                    attributes_json = json.dumps(attributes)  # Ensure attributes are a dictionary
-                    
-                                       
-                    try:
-                        # Execute the SQL query to insert the study into the table
-                        cursor.execute('''
-                            INSERT INTO studies (study_id, study_name, study_category, link)
-                            VALUES (?, ?, ?, ?)
-                        ''', (study_id, study_title, study_category, attributes_json))
-                    except sqlite3.Error as e:
-                        print(f"Error executing SQL query: {e}")
-                    
-                # Commit the changes to the database after the loop
-                conn.commit()
-                print("Data committed to the database.")
-
-                # Close the cursor and the connection
-                cursor.close()
-                conn.close()
-        else:
-            print(f"File {json_file} does not exist.")
+        insert_studies(conn, data, replace)
+        # Commit the changes to the database
+        conn.commit()
+        print("Data committed to the database.")
     except Exception as e:
         print(f"An error occurred: {e}")
     finally:
-        # Change back to the original working directory
-        os.chdir(original_directory)
+        # Close the connection
+        Bulk_session.release(conn)
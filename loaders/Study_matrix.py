@@ -0,0 +1,266 @@
+import numpy as np
+import pandas as pd
+
+from loaders import Schema_info
+
+# The number of gene x run values per slice of iter_study_matrix
+SLICE_SIZE = 1000000
+
+def read_packed_matrix(conn, study_id, value='tpm'):
+    """
+    Read a study matrix from the packed run_vectors table.
+
+    The run vectors are joined into one buffer and viewed as a matrix, so there is
+    no Python work per gene.
+
+    Args:
+        conn (Connection): The SQLite connection.
+        study_id (str): The study to read.
+        value (str): "tpm" or "count".
+
+    Returns:
+        Tuple[ndarray, List[str], List[str]]: The genes x runs float32 matrix, its gene_ids and its run_ids.
+    """
+    gene_ids = [gene_id for (gene_id,) in conn.execute(
+        "SELECT gene_id FROM study_genes WHERE study_id = ? ORDER BY gene_position", (study_id,)
+    )]
+    rows = conn.execute(
+        f"SELECT run_id, {value}_vector FROM run_vectors WHERE study_id = ? ORDER BY run_position", (study_id,)
+    ).fetchall()
+
+    run_ids = [run_id for run_id, _ in rows]
+    buffer = b''.join(vector for _, vector in rows)
+    matrix = np.frombuffer(buffer, dtype=Schema_info.VECTOR_DTYPE).reshape(len(run_ids), len(gene_ids)).T
+
+    return matrix, gene_ids, run_ids
+
+def long_matrix_query(conn, value, order_by_gene=False):
+    """
+    Build the query of a study's stored rows in the long or sparse storage.
+
+    Args:
+        conn (Connection): The SQLite connection.
+        value (str): "tpm" or "count".
+        order_by_gene (bool): Sort the rows by gene_id.
+
+    Returns:
+        str: A query of gene_id, run_id and value, taking the study_id as its parameter.
+    """
+    if Schema_info.get_layout(conn) == 'keyed':
+        query = f'''
+            SELECT g.gene_id, r.run_id, rg.{value}_value AS value
+            FROM runs r
+            JOIN run_genes rg ON rg.run_key = r.run_key
+            JOIN genes g ON g.gene_key = rg.gene_key
+            WHERE r.study_id = ?
+        '''
+    else:
+        query = f'''
+            SELECT rg.gene_id, rg.run_id, rg.{value}_value AS value
+            FROM runs r
+            JOIN run_genes rg ON rg.run_id = r.run_id
+            WHERE r.study_id = ?
+        '''
+    # The unary + keeps SQLite from walking a whole gene index to avoid the sort,
+    # so it still finds the study's rows through its runs
+    return query + ' ORDER BY +gene_id' if order_by_gene else query
+
+def read_long_matrix(conn, study_id, value='tpm', dtype=np.float32):
+    """
+    Read a study matrix from the long run_genes table, or from its non-zero rows with "sparse" storage.
+
+    TPM values stored as fixed-point integers ("compact" value encoding) are decoded.
+
+    Args:
+        conn (Connection): The SQLite connection.
+        study_id (str): The study to read.
+        value (str): "tpm" or "count".
+        dtype: The dtype of the matrix, float32 by default like the packed storage.
+
+    Returns:
+        Tuple[ndarray, List[str], List[str]]: The genes x runs matrix, its gene_ids and its run_ids,
+            both sorted.
+    """
+    df = pd.read_sql_query(long_matrix_query(conn, value), conn, params=(study_id,))
+    if value == 'tpm':
+        df['value'] = Schema_info.decode_tpm(df['value'].to_numpy(), Schema_info.get_tpm_scale(conn))
+    if Schema_info.get_expression_storage(conn) == 'sparse':
+        return fill_sparse_matrix(conn, study_id, df, dtype)
+    df_wide = df.pivot(index='gene_id', columns='run_id', values='value')
+
+    return df_wide.to_numpy(dtype=dtype), list(df_wide.index), list(df_wide.columns)
+
+def fill_sparse_matrix(conn, study_id, df, dtype=np.float32):
+    """
+    Build a study matrix from the non-zero rows of the "sparse" storage, filling in the zeros.
+
+    The genes and runs of the study's files are read from study_genes and study_runs,
+    so genes and runs without any non-zero value are still part of the matrix.
+
+    Args:
+        conn (Connection): The SQLite connection.
+        study_id (str): The study to read.
+        df (DataFrame): The stored rows of the study, with gene_id, run_id and value columns.
+        dtype: The dtype of the matrix.
+
+    Returns:
+        Tuple[ndarray, List[str], List[str]]: The genes x runs matrix, its gene_ids and its run_ids,
+            both sorted.
+    """
+    # Like the long storage, only the runs listed under the study in the runs table
+    run_ids = [run_id for (run_id,) in conn.execute('''
+        SELECT sr.run_id FROM study_runs sr
+        JOIN runs r ON r.run_id = sr.run_id
+        WHERE sr.study_id = ? AND r.study_id = ?
+        ORDER BY sr.run_id
+    ''', (study_id, study_id))]
+    gene_ids = [gene_id for (gene_id,) in conn.execute(
+        "SELECT gene_id FROM study_genes WHERE study_id = ? ORDER BY gene_id", (study_id,)
+    )] if run_ids else []
+
+    return scatter_rows(df, gene_ids, run_ids, dtype)
+
+def read_study_matrix(conn, study_id, value='tpm', dtype=np.float32):
+    """
+    Read the genes x runs expression matrix of a study.
+
+    Args:
+        conn (Connection): The SQLite connection.
+        study_id (str): The study to read.
+        value (str): "tpm" or "count".
+        dtype: The dtype of a matrix read from the long or sparse storage. Packed values are always float32.
+
+    Returns:
+        Tuple[ndarray, List[str], List[str]]: The genes x runs matrix, its gene_ids and its run_ids.
+    """
+    if value not in ('tpm', 'count'):
+        raise ValueError(f"Unknown expression value: {value}")
+
+    if Schema_info.get_expression_storage(conn) == 'packed':
+        return read_packed_matrix(conn, study_id, value)
+    return read_long_matrix(conn, study_id, value, dtype)
+
+def iter_study_matrix(conn, study_id, value='tpm', chunk_size=SLICE_SIZE, dtype=np.float32):
+    """
+    Read the expression matrix of a study in slices of consecutive genes.
+
+    Each slice holds about chunk_size values, so a large study is never held in memory at once.
+    The slices have the values read_study_matrix gives. With the long storage, each slice only
+    has the runs with a value for one of its genes, as read_study_matrix only has the runs with a value.
+
+    Args:
+        conn (Connection): The SQLite connection.
+        study_id (str): The study to read.
+        value (str): "tpm" or "count".
+        chunk_size (int): The number of gene x run values per slice.
+        dtype: The dtype of a matrix read from the long or sparse storage. Packed values are always float32.
+
+    Yields:
+        Tuple[ndarray, List[str], List[str]]: The genes x runs matrix of a slice, its gene_ids and its run_ids.
+    """
+    if value not in ('tpm', 'count'):
+        raise ValueError(f"Unknown expression value: {value}")
+
+    storage = Schema_info.get_expression_storage(conn)
+    if storage == 'packed':
+        yield from iter_packed_matrix(conn, study_id, value, chunk_size)
+    elif storage == 'sparse':
+        yield from iter_sparse_matrix(conn, study_id, value, chunk_size, dtype)
+    else:
+        yield from iter_long_matrix(conn, study_id, value, chunk_size, dtype)
+
+def iter_packed_matrix(conn, study_id, value, chunk_size):
+    # Slices of the packed vectors, cut out of every run's BLOB with substr
+    gene_ids = [gene_id for (gene_id,) in conn.execute(
+        "SELECT gene_id FROM study_genes WHERE study_id = ? ORDER BY gene_position", (study_id,)
+    )]
+    run_ids = [run_id for (run_id,) in conn.execute(
+        "SELECT run_id FROM run_vectors WHERE study_id = ? ORDER BY run_position", (study_id,)
+    )]
+    if not run_ids:
+        return
+
+    width = Schema_info.VECTOR_DTYPE.itemsize
+    genes_per_slice = max(1, chunk_size // len(run_ids))
+    for start in range(0, len(gene_ids), genes_per_slice):
+        slice_ids = gene_ids[start:start + genes_per_slice]
+        buffer = b''.join(vector for (vector,) in conn.execute(
+            f"SELECT substr({value}_vector, ?, ?) FROM run_vectors WHERE study_id = ? ORDER BY run_position",
+            (start * width + 1, len(slice_ids) * width, study_id)
+        ))
+        matrix = np.frombuffer(buffer, dtype=Schema_info.VECTOR_DTYPE).reshape(len(run_ids), len(slice_ids)).T
+        yield matrix, slice_ids, run_ids
+
+def iter_long_matrix(conn, study_id, value, chunk_size, dtype):
+    # Slices of the long storage, from its rows streamed in gene order and cut between two genes
+    tpm_scale = Schema_info.get_tpm_scale(conn) if value == 'tpm' else None
+    chunks = pd.read_sql_query(long_matrix_query(conn, value, order_by_gene=True), conn,
+                               params=(study_id,), chunksize=chunk_size)
+    carry = None
+    for df in chunks:
+        if df.empty:
+            continue
+        if carry is not None:
+            df = pd.concat([carry, df], ignore_index=True)
+        # The rows of the last gene may go on in the next chunk
+        last = df['gene_id'].to_numpy() == df['gene_id'].iloc[-1]
+        carry = df[last]
+        if not last.all():
+            yield pivot_rows(df[~last], tpm_scale, dtype)
+    if carry is not None and len(carry):
+        yield pivot_rows(carry, tpm_scale, dtype)
+
+def pivot_rows(df, tpm_scale, dtype):
+    # The genes x runs matrix of some long rows, decoding compact TPM values
+    df_wide = df.assign(value=Schema_info.decode_tpm(df['value'].to_numpy(), tpm_scale)).pivot(index='gene_id', columns='run_id', values='value')
+    return df_wide.to_numpy(dtype=dtype), list(df_wide.index), list(df_wide.columns)
+
+def iter_sparse_matrix(conn, study_id, value, chunk_size, dtype):
+    # Slices of the sparse storage: the recorded genes in slices, each filled from the stored rows up to its last gene
+    run_ids = [run_id for (run_id,) in conn.execute('''
+        SELECT sr.run_id FROM study_runs sr
+        JOIN runs r ON r.run_id = sr.run_id
+        WHERE sr.study_id = ? AND r.study_id = ?
+        ORDER BY sr.run_id
+    ''', (study_id, study_id))]
+    if not run_ids:
+        return
+
+    tpm_scale = Schema_info.get_tpm_scale(conn) if value == 'tpm' else None
+    genes = conn.execute("SELECT gene_id FROM study_genes WHERE study_id = ? ORDER BY gene_id", (study_id,))
+    chunks = pd.read_sql_query(long_matrix_query(conn, value, order_by_gene=True), conn,
+                               params=(study_id,), chunksize=chunk_size)
+    pending = None
+    genes_per_slice = max(1, chunk_size // len(run_ids))
+    while True:
+        gene_ids = [gene_id for (gene_id,) in genes.fetchmany(genes_per_slice)]
+        if not gene_ids:
+            return
+
+        # Take the stored rows up to the slice's last gene; SQLite sorts text like Python does
+        parts = []
+        while True:
+            if pending is None:
+                pending = next(chunks, None)
+                if pending is None:
+                    break
+            through = pending['gene_id'].to_numpy() <= gene_ids[-1]
+            parts.append(pending[through])
+            if not through.all():
+                pending = pending[~through]
+                break
+            pending = None
+
+        df = pd.concat(parts, ignore_index=True) if parts else pd.DataFrame(columns=['gene_id', 'run_id', 'value'])
+        df['value'] = Schema_info.decode_tpm(df['value'].to_numpy(), tpm_scale)
+        yield scatter_rows(df, gene_ids, run_ids, dtype)
+
+def scatter_rows(df, gene_ids, run_ids, dtype):
+    # A matrix of zeros for the given genes and runs, with the stored rows put in
+    rows = pd.Index(gene_ids).get_indexer(df['gene_id'])
+    columns = pd.Index(run_ids).get_indexer(df['run_id'])
+    # Rows outside the recorded genes and runs (-1) are left out
+    found = (rows >= 0) & (columns >= 0)
+    matrix = np.zeros((len(gene_ids), len(run_ids)), dtype=dtype)
+    matrix[rows[found], columns[found]] = df['value'].to_numpy()[found]
+    return matrix, gene_ids, run_ids
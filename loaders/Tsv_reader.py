@@ -0,0 +1,260 @@
+from contextlib import contextmanager
+import gzip
+import os
+import threading
+
+import pandas as pd
+
+from loaders import Load_report
+
+# Optional dependency: pyarrow parses whole files with multiple threads
+try:
+    import pyarrow  # noqa: F401
+    HAVE_PYARROW = True
+except ImportError:
+    HAVE_PYARROW = False
+
+# Parser engines: "c" is pandas' own parser, "pyarrow" needs the pyarrow package.
+# Chunked reads always use "c", as the pyarrow engine cannot read in chunks.
+ENGINES = ('c', 'pyarrow')
+
+# Engine used when a read does not ask for one, see set_engine
+ENGINE = 'c'
+
+# Text that identifies the header row of the WBPS expression and DE files
+HEADER_MARKER = 'gene_id'
+
+# The first bytes of a gzip file. bgzip files are gzip files too, made of many members.
+GZIP_MAGIC = b'\x1f\x8b'
+
+# Bytes decompressed at a time by the background thread feeding the parser
+DECOMPRESS_BLOCK_SIZE = 1024 * 1024
+
+def set_engine(engine):
+    """
+    Set the default parser engine for every read in this process.
+
+    Falls back to "c" with a message when pyarrow is requested but not installed.
+
+    Args:
+        engine (str): "c" or "pyarrow".
+
+    Returns:
+        str: The engine now in use.
+    """
+    global ENGINE
+
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown TSV engine: {engine}")
+    if engine == 'pyarrow' and not HAVE_PYARROW:
+        print("pyarrow is not installed, using the c engine instead.")
+        engine = 'c'
+
+    ENGINE = engine
+    return ENGINE
+
+def seek_header(handle, marker=HEADER_MARKER):
+    """
+    Move a binary file handle to the start of the first line containing marker.
+
+    Only the preamble is read, one line at a time, so the data after the header is
+    left for the parser to read from the same handle.
+
+    Args:
+        handle (BinaryIO): The open file, positioned at its start.
+        marker (str): The text the header row contains, or None if the first line is the header.
+
+    Returns:
+        List[str]: The column names of the header row. If no line contains marker,
+            the handle is moved back to the start and the first line's names are returned.
+    """
+    if marker is not None:
+        marker_bytes = marker.encode()
+        while True:
+            offset = handle.tell()
+            line = handle.readline()
+            if not line:
+                break
+            if marker_bytes in line:
+                handle.seek(offset)
+                return line.decode().rstrip('\r\n').split('\t')
+
+    # No header marker, so the file starts with its header
+    handle.seek(0)
+    names = handle.readline().decode().rstrip('\r\n').split('\t')
+    handle.seek(0)
+    return names
+
+def is_gzip(path):
+    """
+    Check whether a file is gzip (or bgzip) compressed, from its first bytes rather than its name.
+
+    Args:
+        path (str): The path to the file.
+
+    Returns:
+        bool: True if the file is compressed.
+    """
+    with open(path, 'rb') as handle:
+        return handle.read(len(GZIP_MAGIC)) == GZIP_MAGIC
+
+@contextmanager
+def decompress_in_background(handle):
+    """
+    Decompress the rest of a gzip file in a background thread, feeding the parser through a pipe.
+
+    zlib releases the GIL while it inflates, so decompressing the next block overlaps parsing
+    the current one. The pipe holds little data, so the thread waits for the parser instead
+    of decompressing the whole file into memory. A decompression error, e.g. a truncated file,
+    is raised once the parser is done, so partial data is never taken for the whole file.
+
+    Args:
+        handle (GzipFile): The open compressed file, positioned where the parser should start.
+
+    Yields:
+        BinaryIO: The read end of the pipe.
+    """
+    read_fd, write_fd = os.pipe()
+    errors = []
+
+    def pump():
+        try:
+            with open(write_fd, 'wb') as pipe:
+                for block in iter(lambda: handle.read(DECOMPRESS_BLOCK_SIZE), b''):
+                    pipe.write(block)
+        except BrokenPipeError:
+            # The parser stopped reading early, e.g. a chunked read that was closed
+            pass
+        except Exception as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=pump, name='tsv-decompress', daemon=True)
+    thread.start()
+    try:
+        with open(read_fd, 'rb') as stream:
+            yield stream
+    finally:
+        # Closing the read end above releases a thread blocked on a full pipe
+        thread.join()
+        if errors:
+            raise errors[0]
+
+@contextmanager
+def open_tsv(path, marker=HEADER_MARKER, background=True):
+    """
+    Open a TSV file positioned at its header row.
+
+    gzip and bgzip compressed files (e.g. .tsv.gz) are decompressed as they are read. The header
+    is found on the decompressed data, and the rest of the file is decompressed in a background thread.
+
+    Args:
+        path (str): The path to the file.
+        marker (str): The text the header row contains, or None if the first line is the header.
+        background (bool): Decompress in a background thread, False when only the header is needed.
+
+    Yields:
+        Tuple[BinaryIO, List[str]]: The open file and the column names of its header row.
+    """
+    if not is_gzip(path):
+        with open(path, 'rb') as handle:
+            yield handle, seek_header(handle, marker)
+        return
+
+    # Seeking back to the header only decompresses the preamble again
+    with gzip.open(path, 'rb') as handle:
+        names = seek_header(handle, marker)
+        if not background:
+            yield handle, names
+            return
+        with decompress_in_background(handle) as stream:
+            yield stream, names
+
+def column_dtypes(names, index_col, dtype, index_dtype):
+    """
+    Build the per-column dtype argument of pd.read_csv.
+
+    Args:
+        names (List[str]): The column names of the header row.
+        index_col (int): The position of the ID column, or None.
+        dtype: The dtype of the value columns, e.g. np.float32, or None to infer it.
+        index_dtype: The dtype of the ID column, e.g. "category" or str, or None to infer it.
+
+    Returns:
+        dict: The dtype of each column, or None if nothing was requested.
+    """
+    if dtype is None and index_dtype is None:
+        return None
+
+    dtypes = {}
+    for position, name in enumerate(names):
+        column_dtype = index_dtype if position == index_col else dtype
+        if column_dtype is not None:
+            dtypes[name] = column_dtype
+    return dtypes
+
+def read_tsv(path, marker=HEADER_MARKER, index_col=0, dtype=None, index_dtype=None, engine=None, **kwargs):
+    """
+    Read a TSV file in a single pass, skipping any preamble before its header row.
+
+    Args:
+        path (str): The path to the file.
+        marker (str): The text the header row contains, or None if the first line is the header.
+        index_col (int): The position of the ID column to use as the index, or None.
+        dtype: The dtype of the value columns, e.g. np.float32, or None to infer it.
+        index_dtype: The dtype of the ID column, e.g. "category" or str, or None to infer it.
+        engine (str): "c" or "pyarrow", ENGINE when omitted.
+        **kwargs: Passed on to pd.read_csv.
+
+    Returns:
+        DataFrame: The file contents.
+    """
+    engine = engine or ENGINE
+    if engine == 'pyarrow' and 'nrows' in kwargs:
+        engine = 'c'
+
+    with open_tsv(path, marker) as (handle, names):
+        # The pyarrow engine only takes column names in usecols
+        if kwargs.get('usecols') is not None:
+            kwargs['usecols'] = [names[column] if isinstance(column, int) else column for column in kwargs['usecols']]
+        df = pd.read_csv(handle, sep='\t', index_col=index_col, engine=engine,
+                         dtype=column_dtypes(names, index_col, dtype, index_dtype), **kwargs)
+    Load_report.record_read(path, len(df))
+    return df
+
+def read_header(path, marker=HEADER_MARKER):
+    """
+    Read only the column names of a TSV file, e.g. to size its chunks before reading it.
+
+    Args:
+        path (str): The path to the file.
+        marker (str): The text the header row contains, or None if the first line is the header.
+
+    Returns:
+        List[str]: The column names of the header row.
+    """
+    with open_tsv(path, marker, background=False) as (_, names):
+        return names
+
+def iter_tsv(path, rows_per_chunk, marker=HEADER_MARKER, index_col=0, dtype=None, index_dtype=None, **kwargs):
+    """
+    Read a TSV file in a single pass as chunks of rows_per_chunk rows.
+
+    Args:
+        path (str): The path to the file.
+        rows_per_chunk (int): The number of rows per chunk.
+        marker (str): The text the header row contains, or None if the first line is the header.
+        index_col (int): The position of the ID column to use as the index, or None.
+        dtype: The dtype of the value columns, e.g. np.float32, or None to infer it.
+        index_dtype: The dtype of the ID column, e.g. "category" or str, or None to infer it.
+        **kwargs: Passed on to pd.read_csv.
+
+    Yields:
+        DataFrame: The next chunk of rows.
+    """
+    with open_tsv(path, marker) as (handle, names):
+        with pd.read_csv(handle, sep='\t', index_col=index_col, engine='c', chunksize=rows_per_chunk,
+                         dtype=column_dtypes(names, index_col, dtype, index_dtype), **kwargs) as reader:
+            Load_report.record_read(path)
+            for chunk in reader:
+                Load_report.record_read(rows=len(chunk))
+                yield chunk
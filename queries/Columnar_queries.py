@@ -0,0 +1,130 @@
+import glob
+import os
+
+import numpy as np
+
+from exporters import Columnar_export
+
+# Optional dependency: pyarrow reads the exported files
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+    HAVE_PYARROW = True
+except ImportError:
+    HAVE_PYARROW = False
+
+def find_study_file(export_dir, table, study_id):
+    """
+    Find the file of one study in an exported table.
+
+    Args:
+        export_dir (str): The export directory written by Columnar_export.export_database.
+        table (str): "run_genes" or "differential_expression".
+        study_id (str): The study.
+
+    Returns:
+        str: The path to the file.
+    """
+    entry = Columnar_export.read_manifest(export_dir)['studies'].get(study_id)
+    if entry is not None:
+        paths = glob.glob(os.path.join(Columnar_export.partition_path(export_dir, table, entry['species_id'], study_id), 'part-0.*'))
+    else:
+        # Without a manifest entry, look for the study under every species
+        paths = glob.glob(os.path.join(export_dir, table, 'species_id=*', f'study_id={study_id}', 'part-0.*'))
+
+    if not paths:
+        raise FileNotFoundError(f"Study {study_id} is not in the {table} export in {export_dir}")
+    return paths[0]
+
+def read_study_table(export_dir, table, study_id):
+    """
+    Read the rows of one study from an exported table, memory-mapping the file.
+
+    Arrow files are used in place: the columns point into the mapped file and nothing
+    is copied or decoded. Parquet files are mapped too, but their pages are decompressed.
+
+    Args:
+        export_dir (str): The export directory written by Columnar_export.export_database.
+        table (str): "run_genes" or "differential_expression".
+        study_id (str): The study.
+
+    Returns:
+        Table: The Arrow table, with dictionary-encoded ID columns.
+    """
+    if not HAVE_PYARROW:
+        raise ImportError("Reading an export needs the pyarrow package")
+
+    path = find_study_file(export_dir, table, study_id)
+    if path.endswith(Columnar_export.FORMATS['arrow']):
+        return pa.ipc.open_file(pa.memory_map(path, 'r')).read_all()
+    return pq.read_table(path, memory_map=True)
+
+def read_study_frame(export_dir, table, study_id):
+    """
+    Read the rows of one study from an exported table as a DataFrame.
+
+    Args:
+        export_dir (str): The export directory written by Columnar_export.export_database.
+        table (str): "run_genes" or "differential_expression".
+        study_id (str): The study.
+
+    Returns:
+        DataFrame: The rows, with the ID columns as categoricals.
+    """
+    return read_study_table(export_dir, table, study_id).to_pandas()
+
+def read_study_matrix(export_dir, study_id, value='tpm'):
+    """
+    Read the genes x runs expression matrix of a study from the run_genes export.
+
+    The dictionaries of gene_id and run_id are sorted, so their indices are the matrix
+    positions of each value and the matrix is filled without a pivot. With an Arrow
+    export the indices and values are read straight from the mapped file.
+
+    Args:
+        export_dir (str): The export directory written by Columnar_export.export_database.
+        study_id (str): The study.
+        value (str): "tpm" or "count".
+
+    Returns:
+        Tuple[ndarray, List[str], List[str]]: The genes x runs float32 matrix (NaN where a
+            value is missing), its sorted gene_ids and its sorted run_ids.
+    """
+    if value not in ('tpm', 'count'):
+        raise ValueError(f"Unknown expression value: {value}")
+
+    table = read_study_table(export_dir, 'run_genes', study_id)
+    genes = table.column('gene_id').combine_chunks()
+    runs = table.column('run_id').combine_chunks()
+    values = table.column(f'{value}_value').combine_chunks()
+
+    gene_ids = genes.dictionary.to_pylist()
+    run_ids = runs.dictionary.to_pylist()
+    matrix = np.full((len(gene_ids), len(run_ids)), np.nan, dtype=np.float32)
+    matrix[genes.indices.to_numpy(zero_copy_only=False), runs.indices.to_numpy(zero_copy_only=False)] = \
+        values.to_numpy(zero_copy_only=False)
+
+    return matrix, gene_ids, run_ids
+
+def open_dataset(export_dir, table):
+    """
+    Open an exported table as one dataset over every species and study.
+
+    species_id and study_id are columns derived from the partition directories, so filters
+    on them only read the matching files, e.g.
+    open_dataset(export_dir, 'run_genes').to_table(filter=ds.field('species_id') == 'prjna1000').
+
+    Args:
+        export_dir (str): The export directory written by Columnar_export.export_database.
+        table (str): "run_genes" or "differential_expression".
+
+    Returns:
+        Dataset: The pyarrow dataset.
+    """
+    if not HAVE_PYARROW:
+        raise ImportError("Reading an export needs the pyarrow package")
+
+    export_format = Columnar_export.read_manifest(export_dir)['format'] or 'parquet'
+    return ds.dataset(os.path.join(export_dir, table), format='ipc' if export_format == 'arrow' else 'parquet',
+                      partitioning='hive')
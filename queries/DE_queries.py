@@ -0,0 +1,112 @@
+import pandas as pd
+
+from loaders import Schema_info
+
+def list_contrasts(conn, study_id=None):
+    """
+    List the DE contrasts of one study, or of every study.
+
+    Args:
+        conn (Connection): The SQLite connection.
+        study_id (str, optional): Only list the contrasts of this study.
+
+    Returns:
+        DataFrame: The contrast_key, study_id, condition_1 and condition_2 of each contrast.
+    """
+    query = 'SELECT contrast_key, study_id, condition_1, condition_2 FROM contrasts'
+    params = []
+
+    if study_id is not None:
+        query += ' WHERE study_id = ?'
+        params.append(study_id)
+
+    return pd.read_sql_query(query + ' ORDER BY study_id, condition_1, condition_2', conn, params=params)
+
+def find_contrast(conn, study_id, condition_1, condition_2):
+    """
+    Find the key of a contrast, e.g. "L3" vs "adult" in a study.
+
+    Args:
+        conn (Connection): The SQLite connection.
+        study_id (str): The study.
+        condition_1 (str): The first condition, as in the DE file column name.
+        condition_2 (str): The second condition.
+
+    Returns:
+        int: The contrast_key, None if the study has no such contrast.
+    """
+    row = conn.execute(
+        "SELECT contrast_key FROM contrasts WHERE study_id = ? AND condition_1 = ? AND condition_2 = ?",
+        (study_id, condition_1, condition_2)
+    ).fetchone()
+    return row[0] if row else None
+
+def contrast_query(conn, where):
+    """
+    Build the query for the DE rows of one contrast, ordered by adjusted p-value.
+
+    In every layout the rows are a range of the idx_de_contrast_padj index built by Finalize_database,
+    read in order, so no rows outside the result are read and nothing is sorted.
+
+    Args:
+        conn (Connection): The SQLite connection.
+        where (str): Extra conditions on the de alias, e.g. "AND de.adj_p_value <= ?".
+
+    Returns:
+        str: The query, taking the contrast_key as its first parameter.
+    """
+    if Schema_info.has_column(conn, 'differential_expression', 'gene_key'):
+        return f'''
+            SELECT g.gene_id, de.log2FoldChange, de.adj_p_value
+            FROM differential_expression de
+            JOIN genes g ON g.gene_key = de.gene_key
+            WHERE de.contrast_key = ? AND de.adj_p_value IS NOT NULL {where}
+            ORDER BY de.adj_p_value
+        '''
+    if Schema_info.has_column(conn, 'differential_expression', 'contrast_key'):
+        return f'''
+            SELECT de.gene_id, de.log2FoldChange, de.adj_p_value
+            FROM differential_expression de
+            WHERE de.contrast_key = ? AND de.adj_p_value IS NOT NULL {where}
+            ORDER BY de.adj_p_value
+        '''
+    # Databases created before DE rows had a contrast_key hold their study and conditions as text
+    return f'''
+        SELECT de.gene_id, de.log2FoldChange, de.adj_p_value
+        FROM contrasts c
+        JOIN differential_expression de
+            ON de.study_id = c.study_id AND de.condition_1 = c.condition_1 AND de.condition_2 = c.condition_2
+        WHERE c.contrast_key = ? AND de.adj_p_value IS NOT NULL {where}
+        ORDER BY de.adj_p_value
+    '''
+
+def top_genes(conn, contrast_key, n=100):
+    """
+    Get the n genes with the lowest adjusted p-value in a contrast.
+
+    Args:
+        conn (Connection): The SQLite connection.
+        contrast_key (int): The contrast, e.g. from find_contrast.
+        n (int): The number of genes.
+
+    Returns:
+        DataFrame: The gene_id, log2FoldChange and adj_p_value of each gene, by increasing adj_p_value.
+    """
+    return pd.read_sql_query(contrast_query(conn, '') + ' LIMIT ?', conn, params=(contrast_key, n))
+
+def significant_genes(conn, contrast_key, max_adj_p_value=0.05, min_abs_log2_fold_change=1.0):
+    """
+    Get the genes of a contrast passing an adjusted p-value and a fold change threshold.
+
+    Args:
+        conn (Connection): The SQLite connection.
+        contrast_key (int): The contrast, e.g. from find_contrast.
+        max_adj_p_value (float): The highest adjusted p-value kept.
+        min_abs_log2_fold_change (float): The lowest absolute log2 fold change kept.
+
+    Returns:
+        DataFrame: The gene_id, log2FoldChange and adj_p_value of each gene, by increasing adj_p_value.
+    """
+    where = 'AND de.adj_p_value <= ? AND abs(de.log2FoldChange) >= ?'
+    return pd.read_sql_query(contrast_query(conn, where), conn,
+                             params=(contrast_key, max_adj_p_value, min_abs_log2_fold_change))
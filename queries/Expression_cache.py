@@ -0,0 +1,232 @@
+import argparse
+import json
+import logging
+import os
+import shutil
+import sqlite3
+
+import numpy as np
+
+from loaders import Load_manifest
+from loaders import Run_genes_count_tpm_loader
+from queries import Expression_queries
+
+# The cache of a database lives in a directory next to it, named after it with this suffix
+CACHE_SUFFIX = '.cube_cache'
+
+# The expression values cached for every study, each as a genes x runs float32 .npy file
+VALUES = ['tpm', 'count']
+
+# The loader whose load_manifest records tell whether a study was reloaded since it was cached
+SOURCE_LOADERS = [Run_genes_count_tpm_loader.LOADER_NAME]
+
+# How many times open_study_cube opens a cache replaced or deleted by another process meanwhile
+# before reading the study from the database instead
+OPEN_ATTEMPTS = 3
+
+def database_path(conn):
+    """
+    Get the file of the main database of a connection.
+
+    Args:
+        conn (Connection): The SQLite connection.
+
+    Returns:
+        str: The path to the database file.
+    """
+    for _, name, path in conn.execute("PRAGMA database_list"):
+        if name == 'main':
+            return path
+    return None
+
+def study_cache_dir(conn, study_id):
+    """
+    Get the cache directory of one study.
+
+    Args:
+        conn (Connection): The SQLite connection.
+        study_id (str): The study.
+
+    Returns:
+        str: The directory holding the study's cubes, gene and run order and metadata.
+    """
+    db_path = database_path(conn)
+    if not db_path:
+        raise ValueError("Expression cubes can only be cached for a database file, not an in-memory database")
+    return os.path.join(db_path + CACHE_SUFFIX, study_id)
+
+def read_ids(path):
+    # One ID per line
+    with open(path) as file:
+        return file.read().splitlines()
+
+def write_ids(path, ids):
+    with open(path, 'w') as file:
+        file.writelines(f"{id_}\n" for id_ in ids)
+
+def build_study_cube(conn, study_id, fingerprint=None):
+    """
+    Write the counts and TPM cubes of a study to its cache directory, replacing any previous cache.
+
+    The files are written to a temporary directory that is then renamed into place, after the
+    previous cache is renamed aside, so a reader never sees a partly written cache. A reader that
+    opens the files between the two renames finds none and tries again, see open_study_cube.
+
+    Args:
+        conn (Connection): The SQLite connection.
+        study_id (str): The study to cache.
+        fingerprint (str, optional): The study's load_manifest fingerprint the cubes are built from.
+
+    Returns:
+        str: The study's cache directory.
+    """
+    path = study_cache_dir(conn, study_id)
+    temp_path = f"{path}.tmp-{os.getpid()}"
+    shutil.rmtree(temp_path, ignore_errors=True)
+    os.makedirs(temp_path)
+
+    for value in VALUES:
+        matrix, gene_ids, run_ids = Expression_queries.read_study_matrix(conn, study_id, value)
+        # A C-ordered .npy file, so np.load can map it without knowing its shape and gene rows are contiguous
+        np.save(os.path.join(temp_path, f"{value}.npy"), np.ascontiguousarray(matrix, dtype=np.float32))
+
+    # Sidecar files with the gene order of the rows and the run order of the columns
+    write_ids(os.path.join(temp_path, 'genes.txt'), gene_ids)
+    write_ids(os.path.join(temp_path, 'runs.txt'), run_ids)
+    with open(os.path.join(temp_path, 'cache.json'), 'w') as file:
+        json.dump({'study_id': study_id, 'fingerprint': fingerprint, 'shape': [len(gene_ids), len(run_ids)]}, file)
+
+    # Move the previous cache aside rather than deleting it first, so the study is without
+    # a cache only between the two renames. Mapped files of it stay readable until they are closed.
+    old_path = f"{path}.old-{os.getpid()}"
+    shutil.rmtree(old_path, ignore_errors=True)
+    try:
+        os.rename(path, old_path)
+    except FileNotFoundError:
+        pass
+    try:
+        os.rename(temp_path, path)
+    except OSError:
+        # Another process put its cache in place meanwhile, built from the same study
+        if not os.path.isdir(path):
+            raise
+        shutil.rmtree(temp_path, ignore_errors=True)
+    shutil.rmtree(old_path, ignore_errors=True)
+    return path
+
+def is_current(path, fingerprint):
+    """
+    Check whether a study's cache exists and was built from the study's current load.
+
+    Args:
+        path (str): The study's cache directory.
+        fingerprint (str): The study's current load_manifest fingerprint, None if it has no records.
+
+    Returns:
+        bool: Whether the cache can be used.
+    """
+    try:
+        with open(os.path.join(path, 'cache.json')) as file:
+            return json.load(file)['fingerprint'] == fingerprint
+    except (OSError, ValueError, KeyError):
+        return False
+
+def open_study_cube(conn, study_id, value='tpm'):
+    """
+    Open the genes x runs expression matrix of a study as a read-only memory map.
+
+    The cube is built on the first call and rebuilt automatically once the study is
+    reloaded, as told by its load_manifest records. Otherwise opening it reads no
+    expression data: only the pages of the matrix that are used are read from disk.
+    A cache replaced or deleted by another process while it is opened is opened again,
+    or rebuilt, and after OPEN_ATTEMPTS tries the matrix is read from the database.
+
+    Args:
+        conn (Connection): The SQLite connection.
+        study_id (str): The study.
+        value (str): "tpm" or "count".
+
+    Returns:
+        Tuple[memmap, List[str], List[str]]: The genes x runs float32 matrix, its gene_ids and its run_ids,
+            in the order of Expression_queries.read_study_matrix.
+    """
+    if value not in VALUES:
+        raise ValueError(f"Unknown expression value: {value}")
+
+    path = study_cache_dir(conn, study_id)
+    fingerprint = Load_manifest.unit_fingerprints(conn, SOURCE_LOADERS, study_id).get(study_id)
+    for _ in range(OPEN_ATTEMPTS):
+        if not is_current(path, fingerprint):
+            logging.info(f"Building the expression cube cache of study {study_id}")
+            build_study_cube(conn, study_id, fingerprint)
+
+        try:
+            matrix = np.load(os.path.join(path, f"{value}.npy"), mmap_mode='r')
+            gene_ids, run_ids = read_ids(os.path.join(path, 'genes.txt')), read_ids(os.path.join(path, 'runs.txt'))
+        except FileNotFoundError:
+            # Another process replaced or deleted the cache after the check
+            continue
+        # Files of two builds, when the cache was replaced between reading them, do not fit together
+        if matrix.shape == (len(gene_ids), len(run_ids)):
+            return matrix, gene_ids, run_ids
+
+    logging.warning(f"The expression cube cache of study {study_id} keeps changing, reading the study from the database")
+    return Expression_queries.read_study_matrix(conn, study_id, value)
+
+def invalidate(conn, study_id=None):
+    """
+    Delete the cached cubes of one study, or of every study of the database.
+
+    Args:
+        conn (Connection): The SQLite connection.
+        study_id (str, optional): The study, every study when omitted.
+
+    Returns:
+        None
+    """
+    if study_id is None:
+        shutil.rmtree(database_path(conn) + CACHE_SUFFIX, ignore_errors=True)
+    else:
+        shutil.rmtree(study_cache_dir(conn, study_id), ignore_errors=True)
+
+def warm_cache(conn, study_ids=None):
+    """
+    Build the cubes of every study that has no current cache, e.g. right after a load.
+
+    Args:
+        conn (Connection): The SQLite connection.
+        study_ids (Iterable[str], optional): The studies to cache, every study in the studies table when omitted.
+
+    Returns:
+        List[str]: The studies whose cubes were built.
+    """
+    if study_ids is None:
+        study_ids = [study_id for (study_id,) in conn.execute("SELECT study_id FROM studies ORDER BY study_id")]
+
+    fingerprints = Load_manifest.unit_fingerprints(conn, SOURCE_LOADERS)
+    built = []
+    for study_id in study_ids:
+        if not is_current(study_cache_dir(conn, study_id), fingerprints.get(study_id)):
+            build_study_cube(conn, study_id, fingerprints.get(study_id))
+            built.append(study_id)
+    return built
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the memory-mapped expression cube cache of a database.")
+    parser.add_argument("db_path", help="Path to the database.")
+    parser.add_argument("--studies", nargs="+", help="Only cache these studies.")
+    parser.add_argument("--clear", action="store_true", help="Delete the cache instead of building it.")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db_path)
+    try:
+        if args.clear:
+            for study_id in args.studies or [None]:
+                invalidate(conn, study_id)
+            print("Expression cube cache cleared.")
+        else:
+            built = warm_cache(conn, args.studies)
+            print(f"Built the expression cubes of {len(built)} studies.")
+    finally:
+        conn.close()
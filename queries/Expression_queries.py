@@ -0,0 +1,198 @@
+import numpy as np
+import pandas as pd
+
+from loaders import Bulk_insert
+from loaders import Schema_info
+from loaders import Study_matrix
+
+# The columns of read_gene_expression
+GENE_EXPRESSION_COLUMNS = ['gene_id', 'study_id', 'run_id', 'count_value', 'tpm_value']
+
+# A study matrix is read the same way by the loaders, see loaders/Study_matrix.py
+read_study_matrix = Study_matrix.read_study_matrix
+iter_study_matrix = Study_matrix.iter_study_matrix
+
+def placeholders(values):
+    # One "?" per value of an IN (...) list
+    return ', '.join('?' for _ in values)
+
+def gene_studies(conn, gene_ids, study_id=None):
+    """
+    Find the studies whose expression files list any of the genes ("packed" or "sparse" storage).
+
+    A seek per gene on the study_genes index built by Finalize_database.
+
+    Args:
+        conn (Connection): The SQLite connection.
+        gene_ids (List[str]): The genes.
+        study_id (str, optional): Only look in this study.
+
+    Returns:
+        List[str]: The study_ids, sorted.
+    """
+    study_ids = set()
+    for batch in Bulk_insert.batched(gene_ids, Schema_info.LOOKUP_BATCH_SIZE):
+        query = f"SELECT DISTINCT study_id FROM study_genes WHERE gene_id IN ({placeholders(batch)})"
+        params = list(batch)
+        if study_id is not None:
+            query += " AND study_id = ?"
+            params.append(study_id)
+        study_ids.update(row[0] for row in conn.execute(query, params))
+    return sorted(study_ids)
+
+def read_gene_rows(conn, gene_ids, study_id=None):
+    """
+    Read the run_genes rows of some genes, as stored ("long" or "sparse" storage).
+
+    Args:
+        conn (Connection): The SQLite connection.
+        gene_ids (List[str]): The genes, at most Schema_info.LOOKUP_BATCH_SIZE.
+        study_id (str, optional): Only read the runs of this study.
+
+    Returns:
+        DataFrame: The rows, with GENE_EXPRESSION_COLUMNS. TPM values are not decoded.
+    """
+    if Schema_info.get_layout(conn) == 'keyed':
+        query = f'''
+            SELECT g.gene_id, r.study_id, r.run_id, rg.count_value, rg.tpm_value
+            FROM genes g
+            JOIN run_genes rg ON rg.gene_key = g.gene_key
+            JOIN runs r ON r.run_key = rg.run_key
+            WHERE g.gene_id IN ({placeholders(gene_ids)})
+        '''
+    else:
+        query = f'''
+            SELECT rg.gene_id, r.study_id, rg.run_id, rg.count_value, rg.tpm_value
+            FROM run_genes rg
+            JOIN runs r ON r.run_id = rg.run_id
+            WHERE rg.gene_id IN ({placeholders(gene_ids)})
+        '''
+    params = list(gene_ids)
+    if study_id is not None:
+        query += ' AND r.study_id = ?'
+        params.append(study_id)
+
+    return pd.read_sql_query(query, conn, params=params)
+
+def fill_sparse_rows(conn, gene_ids, study_id, df):
+    """
+    Add the zero rows left out by the "sparse" storage to the stored rows of some genes.
+
+    Args:
+        conn (Connection): The SQLite connection.
+        gene_ids (List[str]): The genes, at most Schema_info.LOOKUP_BATCH_SIZE.
+        study_id (str, optional): Only fill in the runs of this study.
+        df (DataFrame): The stored rows of the genes, from read_gene_rows.
+
+    Returns:
+        DataFrame: A row for every recorded gene and run of the studies, with GENE_EXPRESSION_COLUMNS.
+    """
+    # Like fill_sparse_matrix, only the runs listed under the study in the runs table
+    query = f'''
+        SELECT sg.gene_id, sr.study_id, sr.run_id
+        FROM study_genes sg
+        JOIN study_runs sr ON sr.study_id = sg.study_id
+        JOIN runs r ON r.run_id = sr.run_id AND r.study_id = sr.study_id
+        WHERE sg.gene_id IN ({placeholders(gene_ids)})
+    '''
+    params = list(gene_ids)
+    if study_id is not None:
+        query += ' AND sg.study_id = ?'
+        params.append(study_id)
+
+    df_all = pd.read_sql_query(query, conn, params=params).merge(
+        df, on=['gene_id', 'study_id', 'run_id'], how='left', indicator=True
+    )
+    # Missing values (NaN) of stored rows stay missing
+    omitted = (df_all.pop('_merge') == 'left_only').to_numpy()
+    df_all.loc[omitted, ['count_value', 'tpm_value']] = 0
+    return df_all
+
+def read_packed_gene_expression(conn, gene_ids, study_id=None):
+    """
+    Read the expression of some genes from the packed run_vectors of the studies listing them.
+
+    Args:
+        conn (Connection): The SQLite connection.
+        gene_ids (List[str]): The genes.
+        study_id (str, optional): Only read this study.
+
+    Returns:
+        DataFrame: The values, with GENE_EXPRESSION_COLUMNS.
+    """
+    frames = []
+    for study in gene_studies(conn, gene_ids, study_id):
+        counts, study_genes, run_ids = Study_matrix.read_packed_matrix(conn, study, 'count')
+        tpm, _, _ = Study_matrix.read_packed_matrix(conn, study, 'tpm')
+        positions = pd.Index(study_genes).get_indexer(gene_ids)
+        found = positions >= 0
+        positions = positions[found]
+
+        frames.append(pd.DataFrame({
+            'gene_id': np.repeat(np.array(gene_ids, dtype=object)[found], len(run_ids)),
+            'study_id': study,
+            'run_id': np.tile(np.array(run_ids, dtype=object), len(positions)),
+            'count_value': counts[positions].ravel().astype(np.float64),
+            'tpm_value': tpm[positions].ravel().astype(np.float64),
+        }))
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=GENE_EXPRESSION_COLUMNS)
+
+def read_gene_expression(conn, gene_ids, study_id=None):
+    """
+    Read the expression of one or more genes across the runs of every study, or of one study.
+
+    With "long" or "sparse" storage the stored rows are a seek per gene on the run_genes index
+    built by Finalize_database (the primary key in the "keyed" layout), and sparse storage fills
+    in the zeros. With "packed" storage the matrices of the studies listing the genes are read.
+
+    Args:
+        conn (Connection): The SQLite connection.
+        gene_ids (Iterable[str]): The genes to read.
+        study_id (str, optional): Only read the runs of this study.
+
+    Returns:
+        DataFrame: The gene_id, study_id, run_id, count_value and tpm_value of every gene and run,
+            sorted by gene_id, study_id and run_id.
+    """
+    gene_ids = list(dict.fromkeys(gene_ids))
+    storage = Schema_info.get_expression_storage(conn)
+
+    if storage == 'packed':
+        df = read_packed_gene_expression(conn, gene_ids, study_id)
+    else:
+        tpm_scale = Schema_info.get_tpm_scale(conn)
+        frames = []
+        for batch in Bulk_insert.batched(gene_ids, Schema_info.LOOKUP_BATCH_SIZE):
+            df_batch = read_gene_rows(conn, batch, study_id)
+            # Decode "compact" values, stored as integers
+            df_batch['count_value'] = df_batch['count_value'].astype(np.float64)
+            df_batch['tpm_value'] = Schema_info.decode_tpm(df_batch['tpm_value'].astype(np.float64).to_numpy(), tpm_scale)
+            if storage == 'sparse':
+                df_batch = fill_sparse_rows(conn, batch, study_id, df_batch)
+            frames.append(df_batch)
+        df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=GENE_EXPRESSION_COLUMNS)
+
+    return df[GENE_EXPRESSION_COLUMNS].sort_values(['gene_id', 'study_id', 'run_id']).reset_index(drop=True)
+
+def read_gene_condition_stats(conn, gene_id, study_id=None):
+    """
+    Read the TPM summary of a gene per condition, from the gene_condition_stats table.
+
+    Both forms are a seek on the gene_id index built by Finalize_database.
+
+    Args:
+        conn (Connection): The SQLite connection.
+        gene_id (str): The gene to read.
+        study_id (str, optional): Only read the stats of this study.
+
+    Returns:
+        DataFrame: One row per study and condition, with n_runs, mean_tpm, median_tpm, sd_tpm,
+            min_tpm, max_tpm and fraction_expressed.
+    """
+    query = 'SELECT * FROM gene_condition_stats WHERE gene_id = ?'
+    params = [gene_id]
+    if study_id is not None:
+        query += ' AND study_id = ?'
+        params.append(study_id)
+
+    return pd.read_sql_query(query + ' ORDER BY study_id, condition', conn, params=params)
@@ -0,0 +1,66 @@
+from loaders import Schema_info
+
+def find_runs(conn, key, value, study_id=None):
+    """
+    Find the runs whose metadata has the given value for a key, e.g. developmental_stage = "L3".
+
+    Uses the run_metadata table, so the lookup reads the key's range of the (key, value) index built
+    by Finalize_database instead of a json_extract scan over every run.
+
+    Values are compared as text, so "1", e.g. from a URL, matches the metadata values
+    stored as the number 1. A number passed as value is compared as text too.
+
+    Args:
+        conn (Connection): The SQLite connection.
+        key (str): The metadata key, e.g. "developmental_stage".
+        value: The value to match, as text or as a number.
+        study_id (str, optional): Only return runs of this study.
+
+    Returns:
+        List[str]: The matching run_ids, sorted.
+    """
+    if Schema_info.get_layout(conn) == 'keyed':
+        query = '''
+            SELECT r.run_id
+            FROM run_metadata rm
+            JOIN runs r ON r.run_key = rm.run_key
+            WHERE rm.key = ? AND CAST(rm.value AS TEXT) = ?
+        '''
+    else:
+        query = '''
+            SELECT r.run_id
+            FROM run_metadata rm
+            JOIN runs r ON r.run_id = rm.run_id
+            WHERE rm.key = ? AND CAST(rm.value AS TEXT) = ?
+        '''
+    params = [key, value]
+
+    if study_id is not None:
+        query += ' AND r.study_id = ?'
+        params.append(study_id)
+
+    return sorted(run_id for (run_id,) in conn.execute(query + ' ORDER BY r.run_id', params))
+
+
+def read_run_metadata(conn, run_id):
+    """
+    Read the metadata of one run as a dictionary.
+
+    Args:
+        conn (Connection): The SQLite connection.
+        run_id (str): The run to read.
+
+    Returns:
+        dict: The metadata values by key, empty if the run has none.
+    """
+    if Schema_info.get_layout(conn) == 'keyed':
+        query = '''
+            SELECT rm.key, rm.value
+            FROM runs r
+            JOIN run_metadata rm ON rm.run_key = r.run_key
+            WHERE r.run_id = ?
+        '''
+    else:
+        query = 'SELECT key, value FROM run_metadata WHERE run_id = ?'
+
+    return dict(conn.execute(query, (run_id,)))
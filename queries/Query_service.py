@@ -0,0 +1,483 @@
+import argparse
+import collections
+import json
+import math
+import pathlib
+import queue
+import sqlite3
+import threading
+import urllib.parse
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pandas as pd
+
+from loaders import Schema_info
+from queries import DE_queries
+from queries import Expression_queries
+from queries import Metadata_queries
+from queries import Study_queries
+
+# Default number of pooled read-only connections, i.e. of queries run at the same time
+POOL_SIZE = 4
+
+# Default number of endpoint results kept in the LRU cache, 0 to disable it
+CACHE_SIZE = 1024
+
+# Memory map size of each pooled connection, in MB. The mapped pages are the OS page cache,
+# shared by every connection and process reading the file, instead of a private copy per connection.
+MMAP_SIZE_MB = 1024
+
+# How long a query waits for a free connection, in seconds
+POOL_TIMEOUT = 30
+
+# Default address of the HTTP service
+HOST = '127.0.0.1'
+PORT = 8765
+
+# The pool of the running service, the database it reads, and its result cache.
+# The cache holds results of the load generation _cache_generation, see Schema_info.bump_load_generation.
+_db_path = None
+_pool = None
+_connections = []
+_cache = collections.OrderedDict()
+_cache_size = CACHE_SIZE
+_cache_generation = None
+_cache_lock = threading.Lock()
+_stats = {'queries': 0, 'hits': 0, 'misses': 0, 'invalidations': 0}
+
+def open_readonly(db_path, mmap_size_mb=MMAP_SIZE_MB):
+    """
+    Open a read-only connection to a database, usable from any thread.
+
+    Args:
+        db_path (str): The path to the SQLite database.
+        mmap_size_mb (int): The memory map size, in MB.
+
+    Returns:
+        Connection: The connection. Writing through it raises sqlite3.OperationalError.
+    """
+    uri = pathlib.Path(db_path).resolve().as_uri() + '?mode=ro'
+    # Each connection is used by one thread at a time, handed over through the pool
+    conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+    conn.execute(f"PRAGMA mmap_size = {mmap_size_mb * 1024 * 1024}")
+    return conn
+
+def start(db_path, pool_size=POOL_SIZE, cache_size=CACHE_SIZE, mmap_size_mb=MMAP_SIZE_MB):
+    """
+    Open the connection pool and an empty result cache for a database, closing any previous pool.
+
+    Args:
+        db_path (str): The path to the SQLite database.
+        pool_size (int): The number of read-only connections.
+        cache_size (int): The number of results kept in the LRU cache, 0 to disable it.
+        mmap_size_mb (int): The memory map size of each connection, in MB.
+
+    Returns:
+        None
+    """
+    global _db_path, _pool, _connections, _cache_size, _cache_generation
+
+    stop()
+    _connections = [open_readonly(db_path, mmap_size_mb) for _ in range(max(1, pool_size))]
+    _pool = queue.Queue()
+    for conn in _connections:
+        _pool.put(conn)
+    _db_path = db_path
+
+    with _cache_lock:
+        _cache.clear()
+        _cache_size = max(0, cache_size)
+        _cache_generation = None
+        _stats.update(queries=0, hits=0, misses=0, invalidations=0)
+
+def stop():
+    """
+    Close the connections of the pool, if the service was started.
+
+    Returns:
+        None
+    """
+    global _db_path, _pool, _connections
+
+    for conn in _connections:
+        conn.close()
+    _db_path, _pool, _connections = None, None, []
+    with _cache_lock:
+        _cache.clear()
+
+@contextmanager
+def borrow():
+    """
+    Borrow a connection of the pool, waiting up to POOL_TIMEOUT seconds for a free one.
+
+    Yields:
+        Connection: A read-only connection, returned to the pool afterwards.
+
+    Raises:
+        RuntimeError: If the service was not started.
+        TimeoutError: If no connection became free in time.
+    """
+    pool = _pool
+    if pool is None:
+        raise RuntimeError("The query service is not started, call start(db_path) first")
+    try:
+        conn = pool.get(timeout=POOL_TIMEOUT)
+    except queue.Empty:
+        raise TimeoutError(f"No free connection after {POOL_TIMEOUT} seconds") from None
+    try:
+        yield conn
+    finally:
+        pool.put(conn)
+
+def gene_expression(conn, gene_ids, study_id=None):
+    """
+    Get the expression of one or more genes across runs, see Expression_queries.read_gene_expression.
+
+    Args:
+        conn (Connection): The SQLite connection.
+        gene_ids (List[str]): The genes.
+        study_id (str, optional): Only the runs of this study.
+
+    Returns:
+        DataFrame: The gene_id, study_id, run_id, count_value and tpm_value of every gene and run.
+    """
+    return Expression_queries.read_gene_expression(conn, gene_ids, study_id)
+
+def require_contrast(conn, study_id, condition_1, condition_2):
+    # The contrast_key of a contrast, LookupError if the study has no such contrast
+    contrast_key = DE_queries.find_contrast(conn, study_id, condition_1, condition_2)
+    if contrast_key is None:
+        raise LookupError(f"Study {study_id} has no contrast {condition_1} vs {condition_2}")
+    return contrast_key
+
+def legacy_contrast_genes(conn, study_id, condition_1, condition_2, where='', params=(), n=None):
+    """
+    Read the DE rows of a contrast from a database created before the contrasts table existed.
+
+    Those databases have no contrast_key, so the rows are found by their study and conditions.
+
+    Args:
+        conn (Connection): The SQLite connection.
+        study_id (str): The study.
+        condition_1 (str): The first condition of the contrast.
+        condition_2 (str): The second condition.
+        where (str): Extra conditions on the de alias, as for DE_queries.contrast_query.
+        params (tuple): The parameters of where.
+        n (int, optional): Only read the first n rows.
+
+    Returns:
+        DataFrame: The gene_id, log2FoldChange and adj_p_value of each gene, by increasing adj_p_value.
+
+    Raises:
+        LookupError: If the study has no such contrast.
+    """
+    contrast = (study_id, condition_1, condition_2)
+    if conn.execute('''
+        SELECT 1 FROM differential_expression WHERE study_id = ? AND condition_1 = ? AND condition_2 = ? LIMIT 1
+    ''', contrast).fetchone() is None:
+        raise LookupError(f"Study {study_id} has no contrast {condition_1} vs {condition_2}")
+
+    query = f'''
+        SELECT de.gene_id, de.log2FoldChange, de.adj_p_value
+        FROM differential_expression de
+        WHERE de.study_id = ? AND de.condition_1 = ? AND de.condition_2 = ? AND de.adj_p_value IS NOT NULL {where}
+        ORDER BY de.adj_p_value
+    '''
+    if n is not None:
+        query, params = query + ' LIMIT ?', (*params, n)
+    return pd.read_sql_query(query, conn, params=(*contrast, *params))
+
+def top_de_genes(conn, study_id, condition_1, condition_2, n=100):
+    """
+    Get the n genes with the lowest adjusted p-value in a contrast, see DE_queries.top_genes.
+
+    Args:
+        conn (Connection): The SQLite connection.
+        study_id (str): The study.
+        condition_1 (str): The first condition of the contrast.
+        condition_2 (str): The second condition.
+        n (int): The number of genes.
+
+    Returns:
+        DataFrame: The gene_id, log2FoldChange and adj_p_value of each gene, by increasing adj_p_value.
+    """
+    if not Schema_info.has_table(conn, 'contrasts'):
+        return legacy_contrast_genes(conn, study_id, condition_1, condition_2, n=n)
+    return DE_queries.top_genes(conn, require_contrast(conn, study_id, condition_1, condition_2), n)
+
+def significant_de_genes(conn, study_id, condition_1, condition_2, max_adj_p_value=0.05, min_abs_log2_fold_change=1.0):
+    """
+    Get the genes of a contrast passing both thresholds, see DE_queries.significant_genes.
+
+    Args:
+        conn (Connection): The SQLite connection.
+        study_id (str): The study.
+        condition_1 (str): The first condition of the contrast.
+        condition_2 (str): The second condition.
+        max_adj_p_value (float): The highest adjusted p-value kept.
+        min_abs_log2_fold_change (float): The lowest absolute log2 fold change kept.
+
+    Returns:
+        DataFrame: The gene_id, log2FoldChange and adj_p_value of each gene, by increasing adj_p_value.
+    """
+    if not Schema_info.has_table(conn, 'contrasts'):
+        return legacy_contrast_genes(conn, study_id, condition_1, condition_2,
+                                     'AND de.adj_p_value <= ? AND abs(de.log2FoldChange) >= ?',
+                                     (max_adj_p_value, min_abs_log2_fold_change))
+    contrast_key = require_contrast(conn, study_id, condition_1, condition_2)
+    return DE_queries.significant_genes(conn, contrast_key, max_adj_p_value, min_abs_log2_fold_change)
+
+def contrasts(conn, study_id=None):
+    """
+    List the DE contrasts of one study, or of every study, see DE_queries.list_contrasts.
+
+    Args:
+        conn (Connection): The SQLite connection.
+        study_id (str, optional): The study.
+
+    Returns:
+        DataFrame: The contrast_key, study_id, condition_1 and condition_2 of each contrast.
+            The contrast_key is null in a database created before the contrasts table existed.
+    """
+    if not Schema_info.has_table(conn, 'contrasts'):
+        query = 'SELECT DISTINCT NULL AS contrast_key, study_id, condition_1, condition_2 FROM differential_expression'
+        params = []
+        if study_id is not None:
+            query += ' WHERE study_id = ?'
+            params.append(study_id)
+        return pd.read_sql_query(query + ' ORDER BY study_id, condition_1, condition_2', conn, params=params)
+    return DE_queries.list_contrasts(conn, study_id)
+
+def runs_by_metadata(conn, key, value, study_id=None):
+    """
+    Find the runs with a metadata value, see Metadata_queries.find_runs.
+
+    Args:
+        conn (Connection): The SQLite connection.
+        key (str): The metadata key, e.g. "developmental_stage".
+        value (str): The value to match.
+        study_id (str, optional): Only runs of this study.
+
+    Returns:
+        List[str]: The matching run_ids, sorted.
+    """
+    return Metadata_queries.find_runs(conn, key, value, study_id)
+
+def studies_for_species(conn, species):
+    """
+    List the studies of a species, see Study_queries.list_studies.
+
+    Args:
+        conn (Connection): The SQLite connection.
+        species (str): The species_id, species_name or alternative_species_id.
+
+    Returns:
+        DataFrame: The species_id, study_id, study_category, study_name and link of each study.
+    """
+    return Study_queries.list_studies(conn, species)
+
+# The endpoints of the service: each function takes a connection and the parameters listed
+# with their types, which are used to parse HTTP query strings. Lists are given as repeated
+# or comma separated values, e.g. /gene_expression?gene_ids=WBGene1,WBGene2.
+ENDPOINTS = {
+    'gene_expression': (gene_expression, {'gene_ids': list, 'study_id': str}),
+    'top_de_genes': (top_de_genes, {'study_id': str, 'condition_1': str, 'condition_2': str, 'n': int}),
+    'significant_de_genes': (significant_de_genes, {'study_id': str, 'condition_1': str, 'condition_2': str,
+                                                    'max_adj_p_value': float, 'min_abs_log2_fold_change': float}),
+    'contrasts': (contrasts, {'study_id': str}),
+    'runs_by_metadata': (runs_by_metadata, {'key': str, 'value': str, 'study_id': str}),
+    'studies_for_species': (studies_for_species, {'species': str}),
+}
+
+def coerce_params(endpoint, params):
+    """
+    Check the parameters of an endpoint and convert them to their declared types.
+
+    Args:
+        endpoint (str): A key of ENDPOINTS.
+        params (dict): The parameters. Values may be strings, or lists of strings as from urllib.parse.parse_qs.
+
+    Returns:
+        dict: The converted parameters. Lists become tuples, so the parameters can key the cache.
+
+    Raises:
+        KeyError: If the endpoint does not exist.
+        ValueError: If a parameter is unknown or cannot be converted.
+    """
+    _, types = ENDPOINTS[endpoint]
+    converted = {}
+    for name, value in params.items():
+        if name not in types:
+            raise ValueError(f"Unknown parameter {name} of {endpoint}")
+        if types[name] is list:
+            values = [value] if isinstance(value, str) else list(value)
+            # Repeated and comma separated values, in order and without duplicates
+            converted[name] = tuple(dict.fromkeys(
+                part for item in values for part in (item.split(',') if isinstance(item, str) else [item]) if part != ''
+            ))
+        else:
+            if isinstance(value, (list, tuple)):
+                value = value[-1]
+            converted[name] = types[name](value)
+    return converted
+
+def query(endpoint, **params):
+    """
+    Run an endpoint on a pooled connection, answering repeated queries from the LRU cache.
+
+    The cache is emptied when the database's load generation changes, so results are never
+    older than the last completed load. Results are shared by every caller: treat them as read-only.
+
+    Args:
+        endpoint (str): A key of ENDPOINTS.
+        **params: The parameters of the endpoint.
+
+    Returns:
+        The result of the endpoint function, a DataFrame or a list.
+
+    Raises:
+        KeyError: If the endpoint does not exist.
+        ValueError: If a parameter is unknown or cannot be converted.
+        LookupError: If a requested contrast does not exist.
+    """
+    global _cache_generation
+
+    function, _ = ENDPOINTS[endpoint]
+    params = coerce_params(endpoint, params)
+    key = (endpoint, tuple(sorted(params.items())))
+
+    with borrow() as conn:
+        # A primary key lookup, so checking the generation on every query costs little
+        generation = Schema_info.get_load_generation(conn)
+        with _cache_lock:
+            _stats['queries'] += 1
+            if generation != _cache_generation:
+                if _cache:
+                    _stats['invalidations'] += 1
+                _cache.clear()
+                _cache_generation = generation
+            if key in _cache:
+                _stats['hits'] += 1
+                _cache.move_to_end(key)
+                return _cache[key]
+            _stats['misses'] += 1
+
+        result = function(conn, **params)
+
+    with _cache_lock:
+        # Not cached if a newer load was seen meanwhile
+        if _cache_size and generation == _cache_generation:
+            _cache[key] = result
+            while len(_cache) > _cache_size:
+                _cache.popitem(last=False)
+    return result
+
+def stats():
+    """
+    Get the counters of the service since it started.
+
+    Returns:
+        dict: The number of queries, cache hits, misses and invalidations, cached results,
+            the load generation of the cache, and the pool size.
+    """
+    with _cache_lock:
+        return dict(_stats, cached=len(_cache), cache_size=_cache_size, load_generation=_cache_generation,
+                    pool_size=len(_connections), db_path=_db_path)
+
+def to_json(result):
+    """
+    Convert an endpoint result to a JSON-serializable value.
+
+    Args:
+        result: A DataFrame or a list.
+
+    Returns:
+        List: One dictionary per DataFrame row, with missing values as None, or the list itself.
+    """
+    if isinstance(result, pd.DataFrame):
+        records = result.to_dict(orient='records')
+        return [{name: None if isinstance(value, float) and math.isnan(value) else value for name, value in record.items()}
+                for record in records]
+    return list(result)
+
+class QueryHandler(BaseHTTPRequestHandler):
+    """
+    Answer GET /<endpoint>?<parameters> with {"result": ...} and GET /stats with the service counters.
+    """
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        endpoint = url.path.strip('/')
+        try:
+            if endpoint == 'stats':
+                body = stats()
+            elif endpoint not in ENDPOINTS:
+                return self.send_json(404, {'error': f"Unknown endpoint {endpoint}", 'endpoints': sorted(ENDPOINTS)})
+            else:
+                params = urllib.parse.parse_qs(url.query, keep_blank_values=True)
+                body = {'result': to_json(query(endpoint, **params))}
+        except LookupError as e:
+            return self.send_json(404, {'error': str(e)})
+        except (ValueError, TypeError) as e:
+            # Unknown, missing or malformed parameters
+            return self.send_json(400, {'error': str(e)})
+        except TimeoutError as e:
+            return self.send_json(503, {'error': str(e)})
+        except (sqlite3.Error, pd.errors.DatabaseError) as e:
+            # E.g. a table missing from a database created by an older version.
+            # pandas raises its own DatabaseError for a query that failed in read_sql_query.
+            return self.send_json(500, {'error': f"Database error: {e}"})
+        self.send_json(200, body)
+
+    def send_json(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        # One line per request would dominate the time of small queries
+        pass
+
+def serve(db_path, host=HOST, port=PORT, pool_size=POOL_SIZE, cache_size=CACHE_SIZE, mmap_size_mb=MMAP_SIZE_MB):
+    """
+    Serve the endpoints over HTTP until interrupted, each request in a thread of its own.
+
+    Args:
+        db_path (str): The path to the SQLite database.
+        host (str): The address to listen on, the local machine by default.
+        port (int): The port to listen on.
+        pool_size (int): The number of read-only connections.
+        cache_size (int): The number of results kept in the LRU cache, 0 to disable it.
+        mmap_size_mb (int): The memory map size of each connection, in MB.
+
+    Returns:
+        None
+    """
+    start(db_path, pool_size, cache_size, mmap_size_mb)
+    server = ThreadingHTTPServer((host, port), QueryHandler)
+    server.daemon_threads = True
+    print(f"Serving {db_path} on http://{host}:{server.server_port} with {pool_size} connections", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve read-only queries on a WBPS database over local HTTP.")
+    parser.add_argument("db_path", help="Path to the database.")
+    parser.add_argument("--host", default=HOST, help="Address to listen on.")
+    parser.add_argument("--port", type=int, default=PORT, help="Port to listen on, 0 for any free port.")
+    parser.add_argument("--pool-size", type=int, default=POOL_SIZE, help="Number of read-only connections.")
+    parser.add_argument("--cache-size", type=int, default=CACHE_SIZE, help="Number of results kept in the LRU cache, 0 to disable it.")
+    parser.add_argument("--mmap-size-mb", type=int, default=MMAP_SIZE_MB, help="Memory map size of each connection.")
+    args = parser.parse_args()
+
+    serve(args.db_path, args.host, args.port, args.pool_size, args.cache_size, args.mmap_size_mb)
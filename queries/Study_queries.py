@@ -0,0 +1,30 @@
+import pandas as pd
+
+def list_studies(conn, species=None):
+    """
+    List the studies of one species, or every study.
+
+    Uses the study_species index on species_id built by Finalize_database.
+
+    Args:
+        conn (Connection): The SQLite connection.
+        species (str, optional): The species, by species_id, species_name or alternative_species_id.
+
+    Returns:
+        DataFrame: The species_id, study_id, study_category, study_name and link of each study, sorted by study_id.
+    """
+    query = '''
+        SELECT ss.species_id, s.study_id, s.study_category, s.study_name, s.link
+        FROM studies s
+        JOIN study_species ss ON ss.study_id = s.study_id
+    '''
+    params = []
+
+    if species is not None:
+        query += '''
+        JOIN species sp ON sp.species_id = ss.species_id
+        WHERE ? IN (sp.species_id, sp.species_name, sp.alternative_species_id)
+        '''
+        params.append(species)
+
+    return pd.read_sql_query(query + ' ORDER BY s.study_id, ss.species_id', conn, params=params)
@@ -0,0 +1,23 @@
+import os
+import sys
+
+import pytest
+
+# The loaders, queries and benchmarks packages are imported from the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import Create_db_and_tables
+from benchmarks import Synthetic_dataset
+
+@pytest.fixture
+def release(tmp_path):
+    # A small synthetic release: one species with two studies
+    return Synthetic_dataset.generate_dataset(str(tmp_path / 'release'), n_species=1, n_studies=2, n_genes=50,
+                                              n_runs=6, n_contrasts=1, seed=1)
+
+@pytest.fixture
+def db_path(tmp_path):
+    # An empty database with the default layout
+    path = str(tmp_path / 'test.db')
+    Create_db_and_tables.create_database(path)
+    return path
@@ -0,0 +1,27 @@
+import sqlite3
+
+import pytest
+
+import Create_db_and_tables
+
+def test_compact_keyed_view_decodes_tpm(tmp_path):
+    db_path = str(tmp_path / 'compact.db')
+    Create_db_and_tables.create_database(db_path, layout='keyed', value_encoding='compact', tpm_scale=1000)
+
+    conn = sqlite3.connect(db_path)
+    conn.execute("INSERT INTO genes (gene_key, gene_id) VALUES (1, 'G1')")
+    conn.execute("INSERT INTO runs (run_key, run_id) VALUES (1, 'R1')")
+    conn.execute("INSERT INTO run_genes (gene_key, run_key, count_value, tpm_value) VALUES (1, 1, 7, 1234)")
+
+    assert conn.execute("SELECT run_id, gene_id, count_value, tpm_value FROM run_genes_by_id").fetchall() == [('R1', 'G1', 7, 1.234)]
+    conn.close()
+
+def test_compact_check_rejects_undecoded_view(tmp_path):
+    db_path = str(tmp_path / 'keyed.db')
+    Create_db_and_tables.create_database(db_path, layout='keyed')
+
+    # The real-valued keyed schema stores FLOAT values and its view returns tpm_value as stored
+    conn = sqlite3.connect(db_path)
+    with pytest.raises(RuntimeError):
+        Create_db_and_tables.check_compact_schema(conn, 'keyed', 1000)
+    conn.close()
@@ -0,0 +1,48 @@
+import sqlite3
+
+import pytest
+
+import Create_db_and_tables
+import Populate_schema
+from loaders import Differential_Expression_loader
+from loaders import Finalize_database
+from loaders import Load_manifest
+from queries import DE_queries
+
+@pytest.mark.parametrize('layout', ['text', 'keyed'])
+def test_contrast_rows_are_read_by_contrast_key(release, tmp_path, layout):
+    db_path = str(tmp_path / 'de.db')
+    Create_db_and_tables.create_database(db_path, layout=layout)
+    Populate_schema.populate_species(release[0], db_path)
+    Finalize_database.finalize_database(db_path)
+
+    conn = sqlite3.connect(db_path)
+    # DE rows refer to their contrast by key; the study and conditions are only in contrasts
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(differential_expression)")}
+    assert 'contrast_key' in columns and not columns & {'study_id', 'condition_1', 'condition_2'}
+
+    contrast_key, study_id, condition_1, condition_2 = conn.execute(
+        "SELECT contrast_key, study_id, condition_1, condition_2 FROM contrasts ORDER BY contrast_key"
+    ).fetchone()
+    expected = conn.execute('''
+        SELECT gene_id, log2FoldChange, adj_p_value FROM differential_expression_by_id
+        WHERE study_id = ? AND condition_1 = ? AND condition_2 = ? AND adj_p_value IS NOT NULL
+        ORDER BY adj_p_value, gene_id LIMIT 5
+    ''', (study_id, condition_1, condition_2)).fetchall()
+    df_top = DE_queries.top_genes(conn, contrast_key, n=5)
+    assert sorted(df_top.itertuples(index=False, name=None)) == sorted(expected)
+
+    # The top genes are an ordered range of the covering contrast index
+    plan = ' '.join(row[-1] for row in conn.execute(
+        'EXPLAIN QUERY PLAN ' + DE_queries.contrast_query(conn, '') + ' LIMIT ?', (contrast_key, 5)
+    ))
+    assert 'idx_de_contrast_padj' in plan and 'TEMP B-TREE' not in plan
+
+    # Reloading the study replaces its rows through its contrasts
+    n_rows = conn.execute("SELECT COUNT(*) FROM differential_expression").fetchone()[0]
+    conn.close()
+    Load_manifest.invalidate(db_path, Differential_Expression_loader.LOADER_NAME, study_id)
+    Populate_schema.populate_species(release[0], db_path)
+    conn = sqlite3.connect(db_path)
+    assert conn.execute("SELECT COUNT(*) FROM differential_expression").fetchone()[0] == n_rows
+    conn.close()
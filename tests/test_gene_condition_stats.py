@@ -0,0 +1,88 @@
+import glob
+import os
+import sqlite3
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import Create_db_and_tables
+import Populate_schema
+from loaders import Gene_condition_stats
+from queries import Expression_queries
+
+# Fewer values than one study (50 genes x 6 runs), so every study is loaded and summarized in several chunks
+CHUNK_SIZE = 100
+
+def read_stats(conn):
+    return pd.read_sql_query(
+        "SELECT * FROM gene_condition_stats ORDER BY study_id, gene_id, condition", conn
+    )
+
+def expected_stats(conn):
+    # The stats of every whole study matrix, read back in one piece
+    frames = []
+    for (study_id,) in conn.execute("SELECT study_id FROM studies ORDER BY study_id").fetchall():
+        matrix, gene_ids, run_ids = Expression_queries.read_study_matrix(conn, study_id, 'tpm', np.float64)
+        conditions = dict(conn.execute("SELECT run_id, condition FROM runs WHERE study_id = ?", (study_id,)))
+        df = Gene_condition_stats.condition_stats(matrix, gene_ids, [conditions.get(run_id) for run_id in run_ids])
+        frames.append(df.assign(study_id=study_id))
+    df = pd.concat(frames, ignore_index=True)
+    return df[['study_id', 'gene_id', 'condition'] + Gene_condition_stats.STAT_COLUMNS] \
+        .sort_values(['study_id', 'gene_id', 'condition'], ignore_index=True)
+
+@pytest.mark.parametrize('options', [
+    {},
+    {'layout': 'keyed'},
+    {'expression_storage': 'sparse'},
+    {'expression_storage': 'packed'},
+    {'value_encoding': 'compact'},
+])
+def test_study_larger_than_chunk_size_gives_the_same_stats(release, tmp_path, options):
+    db_path = str(tmp_path / 'stats.db')
+    Create_db_and_tables.create_database(db_path, **options)
+    Populate_schema.populate_species(release[0], db_path, chunk_size=CHUNK_SIZE)
+
+    conn = sqlite3.connect(db_path)
+    expected = expected_stats(conn)
+    assert len(expected) > 0
+    pd.testing.assert_frame_equal(read_stats(conn), expected, check_dtype=False)
+
+    # Recomputing from the stored values, in slices of genes, gives the same rows again
+    Gene_condition_stats.refresh_studies(db_path, expected['study_id'].unique(), CHUNK_SIZE)
+    pd.testing.assert_frame_equal(read_stats(conn), expected, check_dtype=False)
+    conn.close()
+
+def test_changed_studies_json_refreshes_only_the_studies_not_reloaded(release, db_path, monkeypatch):
+    Populate_schema.populate_species(release[0], db_path, chunk_size=CHUNK_SIZE)
+    study_paths = sorted(glob.glob(os.path.join(release[0], '*', '')))
+    reloaded_id, kept_id = [os.path.basename(path.rstrip(os.sep)) for path in study_paths]
+
+    # New run conditions for every study, and new expression values for the first one
+    studies_json = glob.glob(os.path.join(release[0], '*.studies.json'))[0]
+    with open(studies_json) as file:
+        text = file.read()
+    with open(studies_json, 'w') as file:
+        file.write(text.replace('"condition 0"', '"condition 0 renamed"'))
+    tpm_file = os.path.join(study_paths[0], f'{reloaded_id}.tpm_per_run.tsv')
+    with open(tpm_file) as file:
+        header, *rows = file.readlines()
+    with open(tpm_file, 'w') as file:
+        file.writelines([header] + rows[::-1])
+
+    refreshed = []
+    refresh_study = Gene_condition_stats.refresh_study
+    def record(db_path, study_id, chunk_size=None):
+        refreshed.append(study_id)
+        return refresh_study(db_path, study_id, chunk_size)
+    monkeypatch.setattr(Gene_condition_stats, 'refresh_study', record)
+
+    Populate_schema.populate_species(release[0], db_path, chunk_size=CHUNK_SIZE)
+
+    # The reloaded study got its stats with its data, and only the other one is read back
+    assert refreshed == [kept_id]
+    conn = sqlite3.connect(db_path)
+    expected = expected_stats(conn)
+    assert 'condition 0 renamed' in set(expected['condition'])
+    pd.testing.assert_frame_equal(read_stats(conn), expected, check_dtype=False)
+    conn.close()
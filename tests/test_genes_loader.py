@@ -0,0 +1,49 @@
+import sqlite3
+
+import pytest
+
+import Populate_schema
+from loaders import Genes_loader
+from loaders import Load_manifest
+
+def manifest_state(db_path, species_path):
+    name_id = species_path.rstrip('/').split('/')[-1]
+    return Load_manifest.check(db_path, Genes_loader.LOADER_NAME, name_id, Genes_loader.source_files(species_path))
+
+def fail_gene_inserts(db_path):
+    # Make every insert into genes fail, returning the connection that can drop the trigger again
+    conn = sqlite3.connect(db_path)
+    conn.execute("CREATE TRIGGER fail_genes BEFORE INSERT ON genes BEGIN SELECT RAISE(ABORT, 'insert failed'); END")
+    conn.commit()
+    return conn
+
+def test_failed_insert_is_not_recorded_as_loaded(release, db_path):
+    species_path = release[0]
+    conn = fail_gene_inserts(db_path)
+
+    with pytest.raises(sqlite3.Error):
+        Genes_loader.load_genes(species_path, db_path)
+
+    assert conn.execute("SELECT COUNT(*) FROM genes").fetchone()[0] == 0
+    assert manifest_state(db_path, species_path) != Load_manifest.CURRENT
+
+    # The next load retries the species and registers its genes
+    conn.execute("DROP TRIGGER fail_genes")
+    conn.commit()
+    Genes_loader.load_genes(species_path, db_path)
+
+    assert conn.execute("SELECT COUNT(*) FROM genes").fetchone()[0] == 50
+    assert manifest_state(db_path, species_path) == Load_manifest.CURRENT
+    conn.close()
+
+def test_failed_insert_fails_the_populate_stage(release, db_path):
+    species_path = release[0]
+    conn = fail_gene_inserts(db_path)
+
+    report = Populate_schema.populate_species(species_path, db_path)
+
+    stages = {stage['stage']: stage for stage in report['stages'] if stage['phase'] == 'load'}
+    assert stages['genes']['status'] == 'error'
+    assert 'insert failed' in stages['genes']['error']
+    assert manifest_state(db_path, species_path) != Load_manifest.CURRENT
+    conn.close()
@@ -0,0 +1,102 @@
+import json
+import sqlite3
+import threading
+import urllib.error
+import urllib.request
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+import Populate_schema
+from benchmarks import Query_load
+from queries import Metadata_queries
+from queries import Query_service
+
+@pytest.fixture
+def legacy_db(release, db_path):
+    # A loaded database without the contrasts and run_metadata tables, like one created by an older version,
+    # whose DE rows hold their study and conditions as text
+    Populate_schema.populate_species(release[0], db_path)
+    conn = sqlite3.connect(db_path)
+    conn.execute("DROP VIEW differential_expression_by_id")
+    conn.execute('''
+        CREATE TABLE legacy_de AS
+        SELECT de.gene_id, de.log2FoldChange, de.adj_p_value, c.condition_1, c.condition_2, c.study_id
+        FROM differential_expression de
+        JOIN contrasts c ON c.contrast_key = de.contrast_key
+    ''')
+    conn.execute("DROP TABLE differential_expression")
+    conn.execute("ALTER TABLE legacy_de RENAME TO differential_expression")
+    conn.execute("DROP TABLE contrasts")
+    conn.execute("DROP TABLE run_metadata")
+    conn.commit()
+    conn.close()
+    return db_path
+
+@contextmanager
+def serving(db_path):
+    # The HTTP service on a free local port, in a background thread
+    Query_service.start(db_path, pool_size=1, cache_size=0)
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Query_service.QueryHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_port}"
+    finally:
+        server.shutdown()
+        server.server_close()
+        Query_service.stop()
+
+@pytest.fixture
+def service(legacy_db):
+    with serving(legacy_db) as base_url:
+        yield base_url
+
+def get(base_url, endpoint, params):
+    try:
+        with urllib.request.urlopen(Query_load.request_url(base_url, endpoint, params)) as response:
+            return response.status, json.load(response)
+    except urllib.error.HTTPError as e:
+        return e.code, json.load(e)
+
+def test_de_endpoints_fall_back_to_the_schema_without_contrasts(service, legacy_db):
+    conn = sqlite3.connect(legacy_db)
+    study_id, condition_1, condition_2 = conn.execute(
+        "SELECT study_id, condition_1, condition_2 FROM differential_expression LIMIT 1"
+    ).fetchone()
+    conn.close()
+    contrast = {'study_id': study_id, 'condition_1': condition_1, 'condition_2': condition_2}
+
+    status, body = get(service, 'contrasts', {'study_id': study_id})
+    assert status == 200
+    assert [row['condition_1'] for row in body['result']] == [condition_1]
+
+    status, body = get(service, 'top_de_genes', {**contrast, 'n': 5})
+    assert status == 200
+    p_values = [row['adj_p_value'] for row in body['result']]
+    assert len(p_values) == 5 and p_values == sorted(p_values)
+
+    status, body = get(service, 'significant_de_genes', {**contrast, 'max_adj_p_value': 1, 'min_abs_log2_fold_change': 0})
+    assert status == 200 and len(body['result']) >= 5
+
+    status, body = get(service, 'top_de_genes', {**contrast, 'condition_1': 'missing'})
+    assert status == 404
+
+def test_database_error_is_answered_with_500(service):
+    status, body = get(service, 'runs_by_metadata', {'key': 'tissue', 'value': 'gut'})
+    assert status == 500
+    assert 'run_metadata' in body['error']
+
+def test_numeric_metadata_value_matches(release, db_path):
+    # The synthetic metadata stores replicate as a number, while URL parameters are text
+    Populate_schema.populate_species(release[0], db_path)
+    conn = sqlite3.connect(db_path)
+    expected = Metadata_queries.find_runs(conn, 'replicate', 1)
+    conn.close()
+    assert expected
+
+    with serving(db_path) as base_url:
+        status, body = get(base_url, 'runs_by_metadata', {'key': 'replicate', 'value': '1'})
+    assert status == 200
+    assert body['result'] == expected
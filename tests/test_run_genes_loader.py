@@ -0,0 +1,69 @@
+import glob
+import os
+import sqlite3
+
+import numpy as np
+import pytest
+
+import Create_db_and_tables
+import Populate_schema
+from loaders import Gene_condition_stats
+from loaders import Run_genes_count_tpm_loader
+from queries import Expression_queries
+
+# Fewer values than one study (50 genes x 6 runs), so every study is streamed in several batches
+CHUNK_SIZE = 100
+
+def study_matrices(db_path):
+    conn = sqlite3.connect(db_path)
+    study_ids = [study_id for (study_id,) in conn.execute("SELECT study_id FROM studies ORDER BY study_id")]
+    matrices = {(study_id, value): Expression_queries.read_study_matrix(conn, study_id, value, np.float64)
+                for study_id in study_ids for value in ('count', 'tpm')}
+    conn.close()
+    return matrices
+
+def test_unaligned_files_are_paired_by_gene_id(release, tmp_path):
+    aligned_db = str(tmp_path / 'aligned.db')
+    Create_db_and_tables.create_database(aligned_db)
+    Populate_schema.populate_species(release[0], aligned_db, chunk_size=CHUNK_SIZE)
+
+    # List the genes of every counts file in reverse order
+    for counts_file in glob.glob(os.path.join(release[0], '*', '*.counts_per_run.tsv')):
+        with open(counts_file) as file:
+            header, *rows = file.readlines()
+        with open(counts_file, 'w') as file:
+            file.writelines([header] + rows[::-1])
+
+    unaligned_db = str(tmp_path / 'unaligned.db')
+    Create_db_and_tables.create_database(unaligned_db)
+    Populate_schema.populate_species(release[0], unaligned_db, chunk_size=CHUNK_SIZE)
+
+    expected, loaded = study_matrices(aligned_db), study_matrices(unaligned_db)
+    assert expected.keys() == loaded.keys()
+    for key, (matrix, gene_ids, run_ids) in expected.items():
+        assert loaded[key][1:] == (gene_ids, run_ids)
+        assert np.array_equal(loaded[key][0], matrix, equal_nan=True)
+
+def test_other_errors_are_not_taken_for_unaligned_files(release, db_path, monkeypatch):
+    Populate_schema.populate_species(release[0], db_path, chunk_size=CHUNK_SIZE)
+    before = study_matrices(db_path)
+    study_path = sorted(glob.glob(os.path.join(release[0], '*', '')))[0].rstrip(os.sep)
+    study_id = os.path.basename(study_path)
+
+    def fail(*args, **kwargs):
+        raise ValueError("bug in the stats")
+
+    def load_in_memory(*args, **kwargs):
+        raise AssertionError("the study was loaded in memory")
+
+    monkeypatch.setattr(Gene_condition_stats, 'add_rows', fail)
+    monkeypatch.setattr(Run_genes_count_tpm_loader, 'load_gene_data', load_in_memory)
+
+    with pytest.raises(ValueError, match="bug in the stats"):
+        Run_genes_count_tpm_loader.stream_data_to_database(study_path, db_path, CHUNK_SIZE, study_id, study_id=study_id)
+
+    # The transaction was rolled back, so the study keeps its rows
+    after = study_matrices(db_path)
+    for key, (matrix, gene_ids, run_ids) in before.items():
+        assert after[key][1:] == (gene_ids, run_ids)
+        assert np.array_equal(after[key][0], matrix, equal_nan=True)